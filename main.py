@@ -2,19 +2,42 @@ import os
 import re
 import asyncio
 import random
+import itertools
 import glob
+import hashlib
+import json
 import shutil
+import subprocess
+import sys
 import time
+import traceback
 import logging
-from typing import List, Tuple, Optional, Iterable
-
+import sqlite3
+import threading
+import multiprocessing
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from bisect import bisect_left, insort
+from functools import partial, wraps
+from dataclasses import dataclass
+from enum import Enum
+from typing import AsyncIterator, List, Tuple, Optional, Iterable
+from urllib.parse import urlparse, parse_qs
+
+import aiohttp
 import discord
+from aiohttp import web
 from discord.ext import commands
 from discord import app_commands
 from dotenv import load_dotenv
 
 import yt_dlp
 
+import ytdl_worker
+
 try:
     import spotipy
     from spotipy.oauth2 import SpotifyClientCredentials
@@ -63,6 +86,65 @@ GUILD_ID = int(GUILD_ID_RAW) if GUILD_ID_RAW and GUILD_ID_RAW.isdigit() else Non
 VOICE_CONNECT_TIMEOUT_SEC = parse_int_env("VOICE_CONNECT_TIMEOUT_SEC", 30, minimum=5)
 VOICE_CONNECT_RETRIES = parse_int_env("VOICE_CONNECT_RETRIES", 3, minimum=1)
 VOICE_RETRY_BACKOFF_SEC = parse_int_env("VOICE_RETRY_BACKOFF_SEC", 2, minimum=1)
+BOT_DATA_DIR = os.getenv("BOT_DATA_DIR", "data")
+TRACK_CACHE_SIZE = parse_int_env("TRACK_CACHE_SIZE", 512, minimum=1)
+# Stream URLs without an expire= parameter are kept this long.
+TRACK_CACHE_DEFAULT_TTL_SEC = parse_int_env("TRACK_CACHE_DEFAULT_TTL_SEC", 3600, minimum=60)
+# Treat stream URLs as expired this long before googlevideo actually rejects them.
+TRACK_CACHE_EXPIRY_MARGIN_SEC = parse_int_env("TRACK_CACHE_EXPIRY_MARGIN_SEC", 600, minimum=0)
+# Upcoming queue entries resolved ahead of time while the current track plays.
+QUEUE_PREFETCH_AHEAD = parse_int_env("QUEUE_PREFETCH_AHEAD", 2, minimum=0)
+QUEUE_PAGE_SIZE = 10
+# "opus" sends Opus packets straight from FFmpeg (stream copy for Opus inputs); "pcm" is the legacy path.
+AUDIO_PIPELINE = (os.getenv("AUDIO_PIPELINE") or "opus").strip().lower()
+# Spawn and prime FFmpeg for the next entry this many seconds before the current track ends.
+PRELOAD_LEAD_SEC = parse_int_env("PRELOAD_LEAD_SEC", 10, minimum=0)
+SPOTIFY_RESOLVE_CONCURRENCY = parse_int_env("SPOTIFY_RESOLVE_CONCURRENCY", 4, minimum=1)
+# Tracks imported from one Spotify playlist or album at most.
+SPOTIFY_MAX_TRACKS = parse_int_env("SPOTIFY_MAX_TRACKS", 1000, minimum=1)
+YTDL_EXTRACT_WORKERS = parse_int_env("YTDL_EXTRACT_WORKERS", 4, minimum=1)
+YTDL_SEARCH_WORKERS = parse_int_env("YTDL_SEARCH_WORKERS", 2, minimum=1)
+# "thread" (default) or "process" to run extraction in warm worker processes outside the GIL.
+YTDL_BACKEND = (os.getenv("YTDL_BACKEND") or "thread").strip().lower()
+YTDL_PROCESS_WORKERS = parse_int_env("YTDL_PROCESS_WORKERS", max(2, min(os.cpu_count() or 2, 4)), minimum=1)
+# A worker still busy this long after its request timed out is considered hung.
+YTDL_PROCESS_HANG_SEC = parse_int_env("YTDL_PROCESS_HANG_SEC", 45, minimum=15)
+# More restarts than this within 10 minutes falls back to the thread backend.
+YTDL_PROCESS_MAX_RESTARTS = parse_int_env("YTDL_PROCESS_MAX_RESTARTS", 5, minimum=1)
+# Local audio cache for frequently played tracks (off unless AUDIO_CACHE_ENABLED=1).
+AUDIO_CACHE_ENABLED = os.getenv("AUDIO_CACHE_ENABLED", "0").strip().lower() in {"1", "true", "yes", "on"}
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", os.path.join(BOT_DATA_DIR, "audio_cache"))
+AUDIO_CACHE_MAX_MB = parse_int_env("AUDIO_CACHE_MAX_MB", 1024, minimum=16)
+AUDIO_CACHE_PLAY_THRESHOLD = parse_int_env("AUDIO_CACHE_PLAY_THRESHOLD", 3, minimum=1)
+# Queue/session persistence across restarts; empty value disables it.
+SESSION_STORE_DB = os.getenv("SESSION_STORE_DB", os.path.join(BOT_DATA_DIR, "sessions.db"))
+SESSION_CHECKPOINT_SEC = parse_int_env("SESSION_CHECKPOINT_SEC", 15, minimum=5)
+SESSION_RESTORE_CONCURRENCY = parse_int_env("SESSION_RESTORE_CONCURRENCY", 2, minimum=1)
+# Prometheus text metrics on a local HTTP port; 0 disables the endpoint.
+METRICS_PORT = parse_int_env("METRICS_PORT", 0, minimum=0)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Tracing spans go to a JSON-lines file and/or an OTLP/HTTP collector; both empty disables tracing.
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")
+TRACE_FLUSH_SEC = parse_int_env("TRACE_FLUSH_SEC", 5, minimum=1)
+# Event loop scheduling delay that counts as a stall (logged with the blocking stack); 0 disables the monitor.
+LOOP_LAG_WARN_MS = parse_int_env("LOOP_LAG_WARN_MS", 200, minimum=0)
+# Idle per-guild player state is dropped after this long without activity.
+PLAYER_IDLE_EVICT_SEC = parse_int_env("PLAYER_IDLE_EVICT_SEC", 1800, minimum=60)
+# How often the reaper sweeps idle guild state and expired cache entries.
+REAPER_INTERVAL_SEC = parse_int_env("REAPER_INTERVAL_SEC", 300, minimum=10)
+# Recent autocomplete search results kept in memory (LRU) and how long they stay valid.
+AUTOCOMPLETE_CACHE_SIZE = parse_int_env("AUTOCOMPLETE_CACHE_SIZE", 1024, minimum=16)
+AUTOCOMPLETE_CACHE_TTL_SEC = parse_int_env("AUTOCOMPLETE_CACHE_TTL_SEC", 30, minimum=1)
+# Autocomplete searches wait this long for the next keystroke before hitting the network.
+AUTOCOMPLETE_DEBOUNCE_MS = parse_int_env("AUTOCOMPLETE_DEBOUNCE_MS", 300, minimum=0)
+# Debounced searches waiting for a free search worker; the oldest are dropped beyond this.
+AUTOCOMPLETE_MAX_PENDING = parse_int_env("AUTOCOMPLETE_MAX_PENDING", 8, minimum=1)
+# Spotify track/album/playlist metadata; playlists are revalidated by snapshot_id, the rest expire after the TTL.
+SPOTIFY_CACHE_DB = os.getenv("SPOTIFY_CACHE_DB", os.path.join(BOT_DATA_DIR, "spotify_cache.db"))
+SPOTIFY_CACHE_TTL_SEC = parse_int_env("SPOTIFY_CACHE_TTL_SEC", 7 * 24 * 3600, minimum=60)
+# Empty value disables the on-disk backing store.
+TRACK_CACHE_DB = os.getenv("TRACK_CACHE_DB", os.path.join(BOT_DATA_DIR, "track_cache.db"))
 
 LOG_LEVEL = parse_log_level()
 logging.basicConfig(
@@ -71,6 +153,532 @@ logging.basicConfig(
 )
 logger = logging.getLogger("dc_bot")
 
+
+# --------------------------------------------------------------
+# Metrics
+# --------------------------------------------------------------
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metric:
+    """Base for the small built-in metric types rendered in Prometheus text format.
+
+    Values are keyed by the tuple of label values. A lock guards updates
+    because FFmpeg reader and executor threads record samples too.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), registry: Optional["MetricsRegistry"] = None):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        (registry if registry is not None else metrics).register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, key: tuple, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = [*zip(self.labelnames, key), *extra]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+
+    def samples(self) -> List[str]:
+        return []
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{self._format_labels(key)} {float(value)!r}" for key, value in items]
+
+
+class Gauge(Metric):
+    """Gauge that is either set directly or computed at scrape time by ``collect``.
+
+    ``collect`` returns ``(labels, value)`` pairs, which suits values derived
+    from existing state such as queue lengths.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, *args, collect=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+        self._collect = collect
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self) -> List[str]:
+        if self._collect is not None:
+            try:
+                items = [(self._key(labels), value) for labels, value in self._collect()]
+            except Exception as collect_err:
+                logger.warning("Metric collect failed name=%s error=%s", self.name, collect_err)
+                return []
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{self._format_labels(key)} {float(value)!r}" for key, value in items]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # Per label key: [bucket counts..., +Inf count], sum.
+        self._values: dict[tuple, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[idx] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{self._format_labels(key, (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total!r}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> None:
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+YTDL_RESOLVE_SECONDS = Histogram(
+    "dcbot_ytdl_resolve_seconds", "yt-dlp resolution latency on track cache misses.", ("outcome",)
+)
+SPOTIFY_FETCH_SECONDS = Histogram(
+    "dcbot_spotify_fetch_seconds", "Spotify API fetch latency per link.", ("kind", "outcome")
+)
+VOICE_CONNECT_SECONDS = Histogram(
+    "dcbot_voice_connect_seconds", "Duration of one voice connect attempt.", ("outcome",)
+)
+FIRST_AUDIO_SECONDS = Histogram(
+    "dcbot_time_to_first_audio_seconds",
+    "Time from picking a track (or restarting it) to its first audio frame.",
+    ("kind",),
+)
+RECOVERY_ATTEMPTS = Counter(
+    "dcbot_recovery_attempts_total", "Attempts to restart a track after an error or disconnect.", ("cause", "outcome")
+)
+
+
+def _collect_queue_lengths():
+    return [
+        ({"guild_id": guild_id}, len(player.queue))
+        for guild_id, player in players.items() if player.queue is not None and len(player.queue)
+    ]
+
+
+def _collect_voice_clients():
+    return [({}, len(bot.voice_clients))]
+
+
+def _ffmpeg_running(source) -> bool:
+    # Unwrap TrackedSource/PreloadedSource down to discord.py's FFmpeg source.
+    while hasattr(source, "original"):
+        source = source.original
+    process = getattr(source, "_process", None)
+    return bool(process) and process.poll() is None
+
+
+def _collect_ffmpeg_processes():
+    sources = []
+    for _, player in players.items():
+        if player.playback_source is not None:
+            sources.append(player.playback_source)
+        if player.preloaded is not None:
+            sources.append(player.preloaded[1])
+    return [({}, sum(1 for source in sources if _ffmpeg_running(source)))]
+
+
+def _collect_executor_depth():
+    pools = [extract_pool.stats(), search_pool.stats()]
+    if isinstance(extract_backend, ProcessExtractPool):
+        pools.append(extract_backend.stats())
+    # Thread pools count queued and running jobs separately; the process pool's pending covers both.
+    return [({"pool": stats["name"]}, stats["pending"] + stats.get("active", 0)) for stats in pools]
+
+
+Gauge("dcbot_queue_length", "Tracks waiting in each guild's queue.", ("guild_id",), collect=_collect_queue_lengths)
+Gauge("dcbot_voice_clients", "Connected voice clients.", collect=_collect_voice_clients)
+Gauge("dcbot_ffmpeg_processes", "Running FFmpeg playback and preload processes.", collect=_collect_ffmpeg_processes)
+Gauge("dcbot_executor_pending", "Jobs waiting or running in the yt-dlp pools.", ("pool",), collect=_collect_executor_depth)
+
+
+async def start_metrics_server() -> Optional[web.AppRunner]:
+    """Serve ``/metrics`` on METRICS_HOST:METRICS_PORT."""
+
+    async def handle_metrics(_request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    except OSError as bind_err:
+        logger.warning("Metrics endpoint unavailable host=%s port=%s error=%s", METRICS_HOST, METRICS_PORT, bind_err)
+        await runner.cleanup()
+        return None
+    logger.info("Metrics endpoint listening host=%s port=%s", METRICS_HOST, METRICS_PORT)
+    return runner
+
+
+# --------------------------------------------------------------
+# Tracing
+# --------------------------------------------------------------
+class Span:
+    """One timed stage of a command. Spans started inside another span share its trace ID."""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, **attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else ""
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error = ""
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        """Finish the span; safe to call from non-loop threads and more than once."""
+        if self.end_ns:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if span_exporter:
+            span_exporter.record(self)
+
+    def to_record(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    def set(self, **attributes) -> None:
+        pass
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def start_span(name: str, **attributes):
+    """Start a span under the current one without making it current (ended by the caller)."""
+    if span_exporter is None:
+        return NOOP_SPAN
+    return Span(name, current_span.get(), **attributes)
+
+
+@contextmanager
+def trace_span(name: str, **attributes):
+    """Run a block inside a child span of the current one (a new trace if there is none)."""
+    if span_exporter is None:
+        yield NOOP_SPAN
+        return
+    span = Span(name, current_span.get(), **attributes)
+    token = current_span.set(span)
+    try:
+        yield span
+    except BaseException as err:
+        span.end(err)
+        raise
+    finally:
+        current_span.reset(token)
+        span.end()
+
+
+def annotate_span(**attributes) -> None:
+    """Add attributes to the current span, if any."""
+    span = current_span.get()
+    if span is not None:
+        span.set(**attributes)
+
+
+def traced(name: str):
+    """Decorator running a coroutine function inside ``trace_span(name)``."""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with trace_span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class SpanExporter:
+    """Buffers finished spans and flushes them periodically off the hot path.
+
+    Spans are appended to a JSON-lines file and/or posted as OTLP/HTTP JSON
+    to a collector (e.g. ``http://127.0.0.1:4318/v1/traces``). The buffer is
+    bounded, so an unreachable collector drops spans instead of growing.
+    """
+
+    MAX_BUFFERED = 10000
+
+    def __init__(self, path: str = "", otlp_endpoint: str = ""):
+        self.path = path
+        self.otlp_endpoint = otlp_endpoint
+        self._buffer: "deque[Span]" = deque(maxlen=self.MAX_BUFFERED)
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def record(self, span: Span) -> None:
+        self._buffer.append(span)
+
+    def _drain(self) -> List[Span]:
+        batch = []
+        while self._buffer:
+            batch.append(self._buffer.popleft())
+        return batch
+
+    def _write_jsonl(self, batch: List[Span]) -> None:
+        with open(self.path, "a", encoding="utf-8") as fh:
+            for span in batch:
+                fh.write(json.dumps(span.to_record(), ensure_ascii=False, default=str) + "\n")
+
+    def otlp_payload(self, batch: List[Span]) -> dict:
+        spans = [
+            {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent_id,
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+            }
+            for span in batch
+        ]
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "dc-bot"}}]},
+                "scopeSpans": [{"scope": {"name": "dc_bot"}, "spans": spans}],
+            }]
+        }
+
+    async def flush(self) -> None:
+        batch = self._drain()
+        if not batch:
+            return
+        if self.path:
+            try:
+                await asyncio.to_thread(self._write_jsonl, batch)
+            except OSError as write_err:
+                logger.warning("Trace file write failed path=%s error=%s", self.path, write_err)
+        if self.otlp_endpoint:
+            try:
+                async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+                    async with session.post(self.otlp_endpoint, json=self.otlp_payload(batch)) as resp:
+                        if resp.status >= 300:
+                            logger.warning("OTLP export rejected status=%s", resp.status)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as post_err:
+                logger.warning("OTLP export failed endpoint=%s error=%s", self.otlp_endpoint, post_err)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(TRACE_FLUSH_SEC)
+            await self.flush()
+
+
+span_exporter: Optional[SpanExporter] = (
+    SpanExporter(TRACE_FILE, TRACE_OTLP_ENDPOINT) if TRACE_FILE or TRACE_OTLP_ENDPOINT else None
+)
+
+
+# --------------------------------------------------------------
+# Event loop lag watchdog
+# --------------------------------------------------------------
+LOOP_LAG_SECONDS = Histogram(
+    "dcbot_loop_lag_seconds",
+    "Event loop scheduling delay of a periodic probe.",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+LOOP_STALLS = Counter("dcbot_loop_stalls_total", "Event loop stalls longer than LOOP_LAG_WARN_MS.")
+
+
+class LoopWatchdog:
+    """Measures event loop scheduling delay and reports what blocks the loop.
+
+    A probe coroutine sleeps for SAMPLE_SEC and records how late it woke up.
+    It also leaves a heartbeat for a daemon thread, which notices when the
+    heartbeat stops while the loop is stuck and logs the loop thread's current
+    stack. That stack shows the blocking coroutine or callback while it is
+    still running.
+    """
+
+    SAMPLE_SEC = 0.5
+    WINDOW = 600
+
+    def __init__(self, threshold_sec: float):
+        self.threshold_sec = threshold_sec
+        self.samples: "deque[float]" = deque(maxlen=self.WINDOW)
+        self.stalls = 0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._stall_reported = False
+        self._stopped = threading.Event()
+
+    def percentiles(self, quantiles: Iterable[float] = (0.5, 0.95, 0.99)) -> dict:
+        """Lag percentiles in seconds over the last WINDOW samples."""
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: 0.0 for q in quantiles}
+        return {q: ordered[min(int(q * len(ordered)), len(ordered) - 1)] for q in quantiles}
+
+    def record(self, lag: float) -> None:
+        self.samples.append(lag)
+        LOOP_LAG_SECONDS.observe(lag)
+        if lag >= self.threshold_sec:
+            logger.warning("Event loop lag lag_ms=%d", lag * 1000)
+
+    def check_stall(self) -> Optional[str]:
+        """Watchdog thread: return the loop thread's stack once per stall."""
+        stalled = time.monotonic() - self._heartbeat - self.SAMPLE_SEC
+        if stalled < self.threshold_sec:
+            self._stall_reported = False
+            return None
+        if self._stall_reported:
+            return None
+        self._stall_reported = True
+        self.stalls += 1
+        LOOP_STALLS.inc()
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame else "<unknown>"
+        logger.warning("Event loop blocked stalled_ms=%d stack:\n%s", stalled * 1000, stack)
+        return stack
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.threshold_sec / 2):
+            self.check_stall()
+
+    async def run(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        try:
+            while True:
+                expected = time.monotonic() + self.SAMPLE_SEC
+                await asyncio.sleep(self.SAMPLE_SEC)
+                now = time.monotonic()
+                self._heartbeat = now
+                self.record(max(0.0, now - expected))
+        finally:
+            self._stopped.set()
+
+
+loop_watchdog: Optional[LoopWatchdog] = LoopWatchdog(LOOP_LAG_WARN_MS / 1000) if LOOP_LAG_WARN_MS else None
+
+
+def _collect_loop_lag_quantiles():
+    if loop_watchdog is None:
+        return []
+    return [({"quantile": str(q)}, lag) for q, lag in loop_watchdog.percentiles().items()]
+
+
+Gauge(
+    "dcbot_loop_lag_quantile_seconds",
+    "Event loop lag percentiles over the recent sample window.",
+    ("quantile",),
+    collect=_collect_loop_lag_quantiles,
+)
+
+
+def set_loop_debug(loop: asyncio.AbstractEventLoop, enabled: bool, slow_ms: int = LOOP_LAG_WARN_MS or 100) -> None:
+    """Toggle asyncio debug mode, which logs callbacks slower than ``slow_ms``."""
+    loop.set_debug(enabled)
+    loop.slow_callback_duration = max(slow_ms, 1) / 1000
+    logging.getLogger("asyncio").setLevel(logging.WARNING)
+    logger.info("Asyncio debug enabled=%s slow_callback_ms=%d", enabled, slow_ms)
+
 # Spotify credentials (optional)
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
@@ -80,21 +688,188 @@ intents.message_content = True
 
 bot = commands.Bot(command_prefix=PREFIX, intents=intents)
 last_resync_ts: float = 0.0
+session_tasks_started = False
+metrics_runner: Optional[web.AppRunner] = None
+trace_flusher_started = False
+loop_watchdog_started = False
+reaper_started = False
+stores_opened = False
+
+# --------------------------------------------------------------
+# Per-guild player state
+# --------------------------------------------------------------
+class PlayerState(Enum):
+    IDLE = "idle"
+    CONNECTING = "connecting"
+    PLAYING = "playing"
+    PAUSED = "paused"
+    RECOVERING = "recovering"
+
+
+# Allowed transitions; anything else raises IllegalTransition.
+PLAYER_TRANSITIONS = {
+    PlayerState.IDLE: {PlayerState.CONNECTING, PlayerState.PLAYING},
+    PlayerState.CONNECTING: {PlayerState.IDLE, PlayerState.PLAYING, PlayerState.PAUSED, PlayerState.RECOVERING},
+    PlayerState.PLAYING: {PlayerState.PLAYING, PlayerState.PAUSED, PlayerState.RECOVERING, PlayerState.CONNECTING, PlayerState.IDLE},
+    PlayerState.PAUSED: {PlayerState.PLAYING, PlayerState.RECOVERING, PlayerState.CONNECTING, PlayerState.IDLE},
+    PlayerState.RECOVERING: {PlayerState.PLAYING, PlayerState.CONNECTING, PlayerState.IDLE},
+}
+
+
+class IllegalTransition(RuntimeError):
+    """Raised when a player is moved along an edge missing from PLAYER_TRANSITIONS."""
+
+
+class GuildPlayer:
+    """All playback state of one guild in a single slotted object.
 
-# Per‑guild song queues and currently playing information
-# Each item in the queue is a tuple of (audio_url, title, target)
-song_queue: dict[int, asyncio.Queue] = {}
-now_playing: dict[int, str] = {}
-current_track: dict[int, Tuple[str, str, object]] = {}
-playback_locks: dict[int, asyncio.Lock] = {}
-voice_reconnect_locks: dict[int, asyncio.Lock] = {}
-last_voice_channel_id: dict[int, int] = {}
-track_recovery_attempts: dict[int, int] = {}
+    Fields are ``None`` until used, so a guild that only ever ran one command
+    costs a handful of pointers. ``state`` follows PLAYER_TRANSITIONS and every
+    transition is a dict lookup.
+    """
+
+    __slots__ = (
+        "guild_id", "state", "last_active",
+        "queue", "now_playing", "current", "play_lock", "reconnect_lock",
+        "last_channel_id", "recovery_attempts", "intentional_disconnect_until",
+        "prefetch_task", "preload_task", "preloaded", "playback_source",
+        "pending_resume", "interrupted", "track_end_events", "track_end_worker",
+    )
+
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        self.state = PlayerState.IDLE
+        self.last_active = time.monotonic()
+        self.queue: Optional["GuildPlaylist"] = None
+        self.now_playing: Optional[str] = None
+        # (location, title, announce target, codec, queue track) of the track currently playing.
+        self.current: Optional[Tuple[str, str, object, str, Optional["Track"]]] = None
+        self.play_lock: Optional[asyncio.Lock] = None
+        self.reconnect_lock: Optional[asyncio.Lock] = None
+        self.last_channel_id: Optional[int] = None
+        self.recovery_attempts: Optional[int] = None
+        self.intentional_disconnect_until: Optional[float] = None
+        self.prefetch_task: Optional[asyncio.Task] = None
+        self.preload_task: Optional[asyncio.Task] = None
+        self.preloaded: Optional[Tuple["Track", "PreloadedSource"]] = None
+        # Frame-counting wrapper around the source currently playing.
+        self.playback_source: Optional["TrackedSource"] = None
+        # Track and position to resume when play_next reaches a restored session's current track.
+        self.pending_resume: Optional[Tuple["Track", float]] = None
+        # Current track and position cut off by an unexpected voice disconnect, resumed on reconnect.
+        self.interrupted: Optional[Tuple[Tuple[str, str, object, str, Optional["Track"]], float]] = None
+        # Pending track-end events and the task draining them in order.
+        self.track_end_events: Optional["deque[Optional[Exception]]"] = None
+        self.track_end_worker: Optional[asyncio.Task] = None
+
+    def can_transition(self, new_state: PlayerState) -> bool:
+        return new_state is self.state or new_state in PLAYER_TRANSITIONS[self.state]
+
+    def transition(self, new_state: PlayerState) -> None:
+        if not self.can_transition(new_state):
+            raise IllegalTransition(
+                f"guild {self.guild_id}: {self.state.value} -> {new_state.value}"
+            )
+        self.state = new_state
+        self.last_active = time.monotonic()
+
+    def follow_voice(self, new_state: PlayerState) -> None:
+        """Record a pause/resume the voice client has already carried out.
+
+        The voice client is the truth here, so a state that drifted from it
+        (say IDLE after a failed recovery while audio still plays) is resynced
+        instead of raising once the audio has changed.
+        """
+        if not self.can_transition(new_state):
+            logger.warning(
+                "Player state drifted guild_id=%s state=%s voice=%s",
+                self.guild_id, self.state.value, new_state.value,
+            )
+            self.state = new_state
+        self.transition(new_state)
+
+    def reset_playback(self) -> None:
+        """Forget the current track and go idle; the queue is left alone."""
+        self.now_playing = None
+        self.current = None
+        self.playback_source = None
+        self.recovery_attempts = None
+        self.interrupted = None
+        self.transition(PlayerState.IDLE)
+
+    def is_evictable(self, now: float, idle_sec: float) -> bool:
+        """True when nothing would be lost by dropping this player."""
+        if self.state is not PlayerState.IDLE or now - self.last_active < idle_sec:
+            return False
+        if self.queue is not None and len(self.queue):
+            return False
+        if self.current is not None or self.preloaded is not None or self.track_end_events:
+            return False
+        for lock in (self.play_lock, self.reconnect_lock):
+            if lock is not None and lock.locked():
+                return False
+        for task in (self.prefetch_task, self.preload_task, self.track_end_worker):
+            if task is not None and not task.done():
+                return False
+        return True
+
+
+class PlayerRegistry:
+    """Guild ID to GuildPlayer map that drops players idle for ``idle_sec``.
+
+    ``get`` creates players on demand; ``peek`` never does. Eviction runs from
+    the reaper task and skips guilds that still have a voice client.
+    """
+
+    def __init__(self, idle_sec: float = PLAYER_IDLE_EVICT_SEC):
+        self.idle_sec = idle_sec
+        self._players: dict[int, GuildPlayer] = {}
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._players)
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self._players
+
+    def items(self):
+        return list(self._players.items())
+
+    def peek(self, guild_id: int) -> Optional[GuildPlayer]:
+        return self._players.get(guild_id)
+
+    def get(self, guild_id: int) -> GuildPlayer:
+        player = self._players.get(guild_id)
+        if player is None:
+            player = self._players[guild_id] = GuildPlayer(guild_id)
+        else:
+            player.last_active = time.monotonic()
+        return player
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Drop idle players without a voice connection; return how many were dropped."""
+        now = time.monotonic() if now is None else now
+        stale = [
+            guild_id for guild_id, player in self._players.items()
+            if player.is_evictable(now, self.idle_sec) and not guild_has_voice_client(guild_id)
+        ]
+        for guild_id in stale:
+            del self._players[guild_id]
+        self.evicted += len(stale)
+        return len(stale)
+
+    def discard(self, guild_id: int) -> Optional[GuildPlayer]:
+        return self._players.pop(guild_id, None)
+
+
+def guild_has_voice_client(guild_id: int) -> bool:
+    guild = bot.get_guild(guild_id)
+    return bool(guild and guild.voice_client)
+
+
+players = PlayerRegistry()
 MAX_TRACK_RECOVERY_ATTEMPTS = 2
-autocomplete_cache: dict[str, Tuple[float, List[str]]] = {}
-AUTOCOMPLETE_CACHE_TTL_SECONDS = 30.0
-autocomplete_inflight: dict[str, asyncio.Task] = {}
-intentional_voice_disconnect_until: dict[int, float] = {}
+PRELOAD_PRIME_FRAMES = 10
 VOICE_CONNECT_TIMEOUT_CODE = "VOICE_CONNECT_TIMEOUT"
 VOICE_CONNECT_UNSTABLE_CODE = "VOICE_CONNECT_UNSTABLE"
 VOICE_INTENTIONAL_DISCONNECT_GRACE_SEC = 15.0
@@ -128,27 +903,179 @@ def find_ffmpeg_executable() -> Optional[str]:
 
 
 FFMPEG_EXE = find_ffmpeg_executable()
+if AUDIO_PIPELINE not in {"opus", "pcm"}:
+    logger.warning("Invalid AUDIO_PIPELINE=%r. Using default=opus.", AUDIO_PIPELINE)
+    AUDIO_PIPELINE = "opus"
+
 
+class GuildPlaylist:
+    """Per-guild play queue backed by a list with a moving head index.
+
+    Popping the head only advances the index (the dead prefix is compacted
+    once it dominates the list), so head pops, random access and slicing are
+    cheap, and shuffle, move, remove and dedupe work in place. An optional
+    journal receives every mutation so it can be persisted incrementally.
+    """
 
-def get_guild_queue(guild_id: int) -> asyncio.Queue:
+    COMPACT_MIN_HEAD = 64
+
+    def __init__(self, journal: Optional["PlaylistJournal"] = None) -> None:
+        self._items: list = []
+        self._head = 0
+        self.journal = journal
+
+    def __len__(self) -> int:
+        return len(self._items) - self._head
+
+    def __iter__(self):
+        return itertools.islice(self._items, self._head, None)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            return self._items[self._head + start:self._head + stop:step]
+        return self._items[self._head + self._normalize(index)]
+
+    def _normalize(self, index: int) -> int:
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("playlist index out of range")
+        return index
+
+    def _compact(self) -> None:
+        if self._head:
+            del self._items[:self._head]
+            self._head = 0
+
+    def empty(self) -> bool:
+        return len(self) == 0
+
+    def append(self, entry) -> None:
+        self._items.append(entry)
+        if self.journal:
+            self.journal.appended([entry])
+
+    def extend(self, entries: Iterable) -> None:
+        start = len(self._items)
+        self._items.extend(entries)
+        if self.journal and len(self._items) > start:
+            self.journal.appended(self._items[start:])
+
+    def restore(self, entries: Iterable) -> None:
+        """Load already-persisted entries without journaling them again."""
+        self._items.extend(entries)
+
+    def insert(self, index: int, entry) -> None:
+        index = max(0, min(index, len(self)))
+        self._items.insert(self._head + index, entry)
+        if self.journal:
+            self.journal.inserted(index, entry, self)
+
+    def popleft(self):
+        """Remove and return the head entry; raises IndexError when empty."""
+        if not len(self):
+            raise IndexError("pop from empty playlist")
+        entry = self._items[self._head]
+        self._items[self._head] = None
+        self._head += 1
+        if self._head >= self.COMPACT_MIN_HEAD and self._head * 2 >= len(self._items):
+            self._compact()
+        if self.journal:
+            self.journal.removed(0)
+        return entry
+
+    def peek(self, count: int) -> list:
+        """Return up to ``count`` upcoming entries without removing them."""
+        return self._items[self._head:self._head + max(count, 0)]
+
+    def _position(self, index: int) -> int:
+        # Queue positions come from users, so negative indices are rejected rather than wrapped.
+        if not 0 <= index < len(self):
+            raise IndexError("playlist index out of range")
+        return index
+
+    def remove_at(self, index: int):
+        index = self._position(index)
+        entry = self._items.pop(self._head + index)
+        if self.journal:
+            self.journal.removed(index)
+        return entry
+
+    def move(self, source: int, destination: int) -> None:
+        if destination < 0:
+            raise IndexError("playlist index out of range")
+        entry = self.remove_at(source)
+        self.insert(destination, entry)
+
+    def shuffle(self) -> None:
+        self._compact()
+        random.shuffle(self._items)
+        if self.journal:
+            self.journal.replaced(self._items)
+
+    def dedupe(self, key) -> int:
+        """Drop later entries whose ``key(entry)`` was already seen; return how many were removed."""
+        self._compact()
+        seen = set()
+        kept = []
+        for entry in self._items:
+            entry_key = key(entry)
+            if entry_key in seen:
+                continue
+            seen.add(entry_key)
+            kept.append(entry)
+        removed = len(self._items) - len(kept)
+        self._items = kept
+        if self.journal and removed:
+            self.journal.replaced(self._items)
+        return removed
+
+    def clear(self) -> int:
+        removed = len(self)
+        self._items = []
+        self._head = 0
+        if self.journal and removed:
+            self.journal.replaced([])
+        return removed
+
+
+def get_guild_queue(guild_id: int) -> GuildPlaylist:
     """Retrieve or create a queue for a given guild."""
-    if guild_id not in song_queue:
-        song_queue[guild_id] = asyncio.Queue()
-    return song_queue[guild_id]
+    player = players.get(guild_id)
+    if player.queue is None:
+        journal = session_store.journal(guild_id) if session_store else None
+        player.queue = GuildPlaylist(journal)
+    return player.queue
 
 
 def get_playback_lock(guild_id: int) -> asyncio.Lock:
     """Retrieve or create a playback lock for a guild."""
-    if guild_id not in playback_locks:
-        playback_locks[guild_id] = asyncio.Lock()
-    return playback_locks[guild_id]
+    player = players.get(guild_id)
+    if player.play_lock is None:
+        player.play_lock = asyncio.Lock()
+    return player.play_lock
 
 
 def get_voice_reconnect_lock(guild_id: int) -> asyncio.Lock:
     """Retrieve or create a reconnect lock for a guild."""
-    if guild_id not in voice_reconnect_locks:
-        voice_reconnect_locks[guild_id] = asyncio.Lock()
-    return voice_reconnect_locks[guild_id]
+    player = players.get(guild_id)
+    if player.reconnect_lock is None:
+        player.reconnect_lock = asyncio.Lock()
+    return player.reconnect_lock
+
+
+# Phases that end one connect attempt; their elapsed time feeds VOICE_CONNECT_SECONDS.
+VOICE_CONNECT_OUTCOME_PHASES = {
+    "already_connected",
+    "connect_success",
+    "connect_unstable",
+    "connect_timeout",
+    "connect_ws_closed",
+    "connect_client_exception",
+    "connect_exception",
+}
 
 
 def log_voice_event(
@@ -170,21 +1097,24 @@ def log_voice_event(
         f"elapsed_ms={elapsed_ms if elapsed_ms is not None else 'none'}",
     ]
     logger.log(level, "VOICE_EVENT %s", " ".join(fields))
+    if phase in VOICE_CONNECT_OUTCOME_PHASES and elapsed_ms is not None:
+        VOICE_CONNECT_SECONDS.observe(elapsed_ms / 1000, outcome=phase.replace("connect_", "", 1))
 
 
 def mark_intentional_voice_disconnect(guild_id: int, grace_seconds: float = VOICE_INTENTIONAL_DISCONNECT_GRACE_SEC) -> None:
     """Suppress automatic reconnect briefly after manual/expected disconnects."""
-    intentional_voice_disconnect_until[guild_id] = time.monotonic() + max(grace_seconds, 1.0)
+    players.get(guild_id).intentional_disconnect_until = time.monotonic() + max(grace_seconds, 1.0)
 
 
 def is_intentional_voice_disconnect_active(guild_id: int) -> bool:
     """Return True while reconnect suppression window is active."""
-    until = intentional_voice_disconnect_until.get(guild_id)
+    player = players.peek(guild_id)
+    until = player.intentional_disconnect_until if player else None
     if not until:
         return False
     if time.monotonic() < until:
         return True
-    intentional_voice_disconnect_until.pop(guild_id, None)
+    player.intentional_disconnect_until = None
     return False
 
 
@@ -197,12 +1127,40 @@ def voice_error_message(error_code: str) -> str:
     return "Nem sikerült csatlakozni a voice csatornához."
 
 
+def voice_bitrate_kbps(guild: discord.Guild) -> int:
+    """Bitrate of the guild's current (or last known) voice channel in kbps, 0 if unknown."""
+    vc = guild.voice_client
+    channel = vc.channel if vc else None
+    if channel is None:
+        player = players.peek(guild.id)
+        channel_id = player.last_channel_id if player else None
+        channel = guild.get_channel(channel_id) if channel_id else None
+    bitrate = getattr(channel, "bitrate", 0) or 0
+    return int(bitrate) // 1000
+
+
+@traced("voice.connect")
 async def connect_voice_with_retries(
     guild: discord.Guild,
     channel: discord.abc.Connectable,
     reason: str,
 ) -> Tuple[Optional[discord.VoiceClient], str]:
     """Connect or move voice client with deterministic retries and backoff."""
+    player = players.get(guild.id)
+    previous = player.state
+    player.transition(PlayerState.CONNECTING)
+    try:
+        return await _connect_voice_attempts(guild, channel, reason)
+    finally:
+        if player.state is PlayerState.CONNECTING:
+            player.transition(previous)
+
+
+async def _connect_voice_attempts(
+    guild: discord.Guild,
+    channel: discord.abc.Connectable,
+    reason: str,
+) -> Tuple[Optional[discord.VoiceClient], str]:
     async def reset_voice_client_state(channel_id: Optional[int], attempt: int) -> None:
         """Force cleanup of partially-initialized voice clients between retries."""
         current_vc = guild.voice_client
@@ -251,7 +1209,7 @@ async def connect_voice_with_retries(
                         attempt=attempt,
                         elapsed_ms=int((time.monotonic() - started) * 1000),
                     )
-                    last_voice_channel_id[guild.id] = channel_id
+                    players.get(guild.id).last_channel_id = channel_id
                     return vc, ""
 
                 if vc and vc.is_connected() and vc.channel and vc.channel.id != channel_id:
@@ -282,7 +1240,7 @@ async def connect_voice_with_retries(
                 if vc and vc.is_connected() and vc.channel and vc.channel.id == channel_id:
                     elapsed_ms = int((time.monotonic() - started) * 1000)
                     log_voice_event("connect_success", guild.id, channel_id=channel_id, attempt=attempt, elapsed_ms=elapsed_ms)
-                    last_voice_channel_id[guild.id] = channel_id
+                    players.get(guild.id).last_channel_id = channel_id
                     return vc, ""
 
                 last_error_code = VOICE_CONNECT_UNSTABLE_CODE
@@ -349,10 +1307,12 @@ async def connect_voice_with_retries(
     logger.error("Voice connect failed reason=%s guild_id=%s", reason, guild.id)
     return None, last_error_code
 
+URL_PATTERN = re.compile(r'^(?:http|ftp)s?://|^(?:www\.)', re.IGNORECASE)
+
+
 def is_url(text: str) -> bool:
     """Check if the provided text looks like a URL."""
-    url_pattern = re.compile(r'^(?:http|ftp)s?://|^(?:www\.)', re.IGNORECASE)
-    return re.match(url_pattern, text) is not None
+    return URL_PATTERN.match(text) is not None
 
 
 def is_spotify_url(url: str) -> bool:
@@ -370,9 +1330,1009 @@ def create_spotify_client() -> Optional[spotipy.Spotify]:
 
 SPOTIFY_CLIENT = create_spotify_client()
 
+
+# --------------------------------------------------------------
+# Bounded caches
+# --------------------------------------------------------------
+CACHE_EVENTS = Counter(
+    "dcbot_cache_events_total",
+    "Lookups and removals of the in-memory caches (hit, miss, eviction, expiration).",
+    ("cache", "event"),
+)
+
+
+class TTLCache:
+    """Size-bounded LRU mapping whose entries also expire.
+
+    Entries live for ``ttl_sec`` (0 keeps them until evicted) unless ``put``
+    passes its own ``ttl``, and ``validate`` can reject values whose freshness
+    is part of the value itself. Expired entries at the LRU end are dropped
+    on every insert and ``purge_expired`` sweeps the rest. Hits, misses,
+    evictions and expirations are counted per cache in ``stats`` and in
+    ``dcbot_cache_events_total``.
+    """
+
+    def __init__(self, name: str, capacity: int, ttl_sec: float = 0.0, validate=None):
+        self.name = name
+        self.capacity = capacity
+        self.ttl_sec = ttl_sec
+        self._validate = validate
+        self._entries: "OrderedDict[object, Tuple[float, object]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    EVENT_LABELS = {"hits": "hit", "misses": "miss", "evictions": "eviction", "expirations": "expiration"}
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        setattr(self, counter, getattr(self, counter) + amount)
+        CACHE_EVENTS.inc(amount, cache=self.name, event=self.EVENT_LABELS[counter])
+
+    def _is_live(self, entry: Tuple[float, object], now: float) -> bool:
+        expires_at, value = entry
+        return now < expires_at and (self._validate is None or self._validate(value))
+
+    def get(self, key, default=None, now: Optional[float] = None):
+        """Return a live value and mark it recently used; expired entries are dropped."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if self._is_live(entry, time.monotonic() if now is None else now):
+                self._entries.move_to_end(key)
+                self._count("hits")
+                return entry[1]
+            del self._entries[key]
+            self._count("expirations")
+        self._count("misses")
+        return default
+
+    def peek(self, key, default=None, now: Optional[float] = None):
+        """Like ``get`` but without touching LRU order or the counters."""
+        entry = self._entries.get(key)
+        if entry is not None and self._is_live(entry, time.monotonic() if now is None else now):
+            return entry[1]
+        return default
+
+    def put(self, key, value, ttl: Optional[float] = None, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        ttl = self.ttl_sec if ttl is None else ttl
+        self._entries[key] = (now + ttl if ttl else float("inf"), value)
+        self._entries.move_to_end(key)
+        while self._entries:
+            oldest_key, oldest = next(iter(self._entries.items()))
+            if len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self._count("evictions")
+            elif oldest_key != key and not self._is_live(oldest, now):
+                self._entries.popitem(last=False)
+                self._count("expirations")
+            else:
+                break
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def items(self) -> List[tuple]:
+        return [(key, value) for key, (_, value) in self._entries.items()]
+
+    def values(self) -> list:
+        return [value for _, value in self._entries.values()]
+
+    def purge_expired(self, now: Optional[float] = None) -> int:
+        """Drop every expired entry and return how many were removed."""
+        now = time.monotonic() if now is None else now
+        expired = [key for key, entry in self._entries.items() if not self._is_live(entry, now)]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._count("expirations", len(expired))
+        return len(expired)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+# --------------------------------------------------------------
+# Track resolution cache
+# --------------------------------------------------------------
+YOUTUBE_ID_PATTERN = re.compile(
+    r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/)|youtu\.be/)([A-Za-z0-9_-]{11})'
+)
+
+
+@dataclass
+class ResolvedTrack:
+    """A yt-dlp resolution result: title, chosen format and a stream URL with its expiry."""
+    video_id: str
+    title: str
+    stream_url: str
+    expires_at: float
+    format_id: str = ""
+    acodec: str = ""
+    ext: str = ""
+    abr: float = 0.0
+    duration: int = 0
+    # Page the track was extracted from; re-resolving it yields the same track on any extractor.
+    webpage_url: str = ""
+
+    def is_fresh(self, now: Optional[float] = None) -> bool:
+        """Return True while the stream URL is safely usable."""
+        now = time.time() if now is None else now
+        return now < self.expires_at - TRACK_CACHE_EXPIRY_MARGIN_SEC
+
+
+def normalize_search_term(term: str) -> str:
+    """Normalize user search input so equivalent queries share a cache key."""
+    return " ".join(term.lower().split())
+
+
+def extract_youtube_video_id(url: str) -> Optional[str]:
+    """Extract the 11-character video ID from common YouTube URL shapes."""
+    match = YOUTUBE_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+
+def parse_stream_expiry(url: str, now: Optional[float] = None) -> float:
+    """Read the expire= timestamp of googlevideo URLs, falling back to the default TTL."""
+    now = time.time() if now is None else now
+    try:
+        expire = parse_qs(urlparse(url).query).get("expire")
+        if expire:
+            return float(expire[0])
+        # Some googlevideo URLs carry parameters as path segments (/expire/<ts>/).
+        match = re.search(r'/expire/(\d+)', url)
+        if match:
+            return float(match.group(1))
+    except ValueError:
+        pass
+    return now + TRACK_CACHE_DEFAULT_TTL_SEC
+
+
+class TrackCache:
+    """LRU + TTL cache of resolved tracks keyed by search term and video ID.
+
+    The in-memory layer is bounded to ``capacity`` entries per index. When a
+    database path is given, entries are mirrored to SQLite so restarts can
+    skip yt-dlp until the stored stream URL expires.
+    """
+
+    def __init__(self, capacity: int = TRACK_CACHE_SIZE, db_path: Optional[str] = None):
+        self.capacity = capacity
+        self._tracks = TTLCache("tracks", capacity, validate=ResolvedTrack.is_fresh)
+        self._terms = TTLCache("track_terms", capacity)
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self.open_db(db_path)
+
+    def open_db(self, db_path: str) -> None:
+        try:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(db_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS tracks ("
+                "video_id TEXT PRIMARY KEY, title TEXT NOT NULL, stream_url TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, format_id TEXT, acodec TEXT, ext TEXT, "
+                "abr REAL, duration INTEGER, webpage_url TEXT)"
+            )
+            columns = {row[1] for row in db.execute("PRAGMA table_info(tracks)")}
+            if "webpage_url" not in columns:
+                db.execute("ALTER TABLE tracks ADD COLUMN webpage_url TEXT")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, video_id TEXT NOT NULL)"
+            )
+            db.execute("DELETE FROM tracks WHERE expires_at < ?", (time.time(),))
+            db.commit()
+            self._db = db
+        except sqlite3.Error as db_err:
+            logger.warning("Track cache DB unavailable path=%s error=%s", db_path, db_err)
+            self._db = None
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def _remember(self, term: Optional[str], track: ResolvedTrack) -> None:
+        self._tracks.put(track.video_id, track)
+        if term:
+            self._terms.put(term, track.video_id)
+
+    def _load_from_db(self, term: Optional[str], video_id: Optional[str]) -> Optional[ResolvedTrack]:
+        if not self._db:
+            return None
+        with self._db_lock:
+            try:
+                if video_id is None and term is not None:
+                    row = self._db.execute("SELECT video_id FROM terms WHERE term = ?", (term,)).fetchone()
+                    if not row:
+                        return None
+                    video_id = row[0]
+                row = self._db.execute(
+                    "SELECT video_id, title, stream_url, expires_at, format_id, acodec, ext, abr, duration, webpage_url "
+                    "FROM tracks WHERE video_id = ?",
+                    (video_id,),
+                ).fetchone()
+            except sqlite3.Error as db_err:
+                logger.warning("Track cache DB read failed error=%s", db_err)
+                return None
+        if not row:
+            return None
+        return ResolvedTrack(
+            video_id=row[0],
+            title=row[1],
+            stream_url=row[2],
+            expires_at=row[3],
+            format_id=row[4] or "",
+            acodec=row[5] or "",
+            ext=row[6] or "",
+            abr=row[7] or 0.0,
+            duration=row[8] or 0,
+            webpage_url=row[9] or "",
+        )
+
+    def _video_id_from_db(self, term: str) -> Optional[str]:
+        with self._db_lock:
+            try:
+                row = self._db.execute("SELECT video_id FROM terms WHERE term = ?", (term,)).fetchone()
+            except sqlite3.Error as db_err:
+                logger.warning("Track cache DB read failed error=%s", db_err)
+                return None
+        return row[0] if row else None
+
+    async def video_id_for(self, term: str) -> Optional[str]:
+        """Video a term resolved to before, even if its stream URL has expired since."""
+        video_id = self._terms.peek(term)
+        if video_id is None and self._db:
+            video_id = await asyncio.to_thread(self._video_id_from_db, term)
+        return video_id
+
+    def _store_in_db(self, term: Optional[str], track: ResolvedTrack) -> None:
+        if not self._db:
+            return
+        with self._db_lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO tracks "
+                    "(video_id, title, stream_url, expires_at, format_id, acodec, ext, abr, duration, webpage_url) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        track.video_id, track.title, track.stream_url, track.expires_at,
+                        track.format_id, track.acodec, track.ext, track.abr, track.duration, track.webpage_url,
+                    ),
+                )
+                if term:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO terms (term, video_id) VALUES (?, ?)",
+                        (term, track.video_id),
+                    )
+                self._db.commit()
+            except sqlite3.Error as db_err:
+                logger.warning("Track cache DB write failed error=%s", db_err)
+
+    def _lookup_memory(self, term: Optional[str], video_id: Optional[str]) -> Optional[ResolvedTrack]:
+        if video_id is None and term is not None:
+            video_id = self._terms.get(term)
+        if video_id is None:
+            return None
+        return self._tracks.get(video_id)
+
+    async def get(self, term: Optional[str] = None, video_id: Optional[str] = None) -> Optional[ResolvedTrack]:
+        """Return a fresh cached track by normalized term or video ID."""
+        track = self._lookup_memory(term, video_id)
+        if track:
+            return track
+        if not self._db:
+            return None
+        track = await asyncio.to_thread(self._load_from_db, term, video_id)
+        if not track or not track.is_fresh():
+            return None
+        self._remember(term, track)
+        return track
+
+    async def put(self, term: Optional[str], track: ResolvedTrack) -> None:
+        """Store a track under its video ID and, if given, a normalized term."""
+        self._remember(term, track)
+        if self._db:
+            await asyncio.to_thread(self._store_in_db, term, track)
+
+    def _delete_from_db(self, video_id: str) -> None:
+        with self._db_lock:
+            try:
+                self._db.execute("DELETE FROM tracks WHERE video_id = ?", (video_id,))
+                self._db.commit()
+            except sqlite3.Error as db_err:
+                logger.warning("Track cache DB delete failed error=%s", db_err)
+
+    def stored_titles(self) -> List[str]:
+        """Blocking: titles in the SQLite store, used to seed autocomplete."""
+        if not self._db:
+            return [track.title for track in self._tracks.values()]
+        with self._db_lock:
+            try:
+                return [row[0] for row in self._db.execute("SELECT title FROM tracks")]
+            except sqlite3.Error as db_err:
+                logger.warning("Track cache DB read failed error=%s", db_err)
+                return []
+
+    def purge_expired(self) -> int:
+        """Drop in-memory tracks whose stream URL is no longer fresh, and terms pointing at them."""
+        stale = self._tracks.purge_expired()
+        dangling = [term for term, video_id in self._terms.items() if video_id not in self._tracks]
+        for term in dangling:
+            self._terms.pop(term)
+        return stale
+
+    def stats(self) -> List[dict]:
+        return [self._tracks.stats(), self._terms.stats()]
+
+    async def invalidate(self, video_id: str) -> None:
+        """Drop a video whose stream URL stopped working so the next lookup re-resolves it."""
+        self._tracks.pop(video_id, None)
+        if self._db:
+            await asyncio.to_thread(self._delete_from_db, video_id)
+
+
+# The SQLite mirror is attached by open_stores() once the bot starts.
+track_cache = TrackCache(TRACK_CACHE_SIZE)
+
+
+# --------------------------------------------------------------
+# yt-dlp worker pools
+# --------------------------------------------------------------
+YTDL_EXTRACT_OPTS = {
+    # Final choice among audio formats is made by select_audio_format.
+    'format': 'bestaudio[acodec=opus]/bestaudio[acodec!=none]/best',
+    'quiet': True,
+    'noplaylist': True,
+    'extract_flat': False,
+    'skip_download': True,
+    # Prefer clients that usually expose direct media URLs over SABR-limited web formats.
+    'extractor_args': {
+        'youtube': {
+            'player_client': ['android', 'web'],
+        }
+    },
+}
+
+# Flat extraction to avoid deep info and keep autocomplete searches cheap.
+YTDL_SEARCH_OPTS = {
+    'format': 'bestaudio/best',
+    'quiet': True,
+    'noplaylist': True,
+    'extract_flat': True,
+    'skip_download': True,
+}
+
+
+class YoutubeDLPool:
+    """Bounded thread pool with one long-lived YoutubeDL instance per worker thread.
+
+    Reusing instances skips extractor registration, option parsing and cookie
+    setup on every call, and a dedicated executor keeps yt-dlp work from
+    competing with other ``asyncio.to_thread`` users. ``pending`` and
+    ``active`` expose the queue state.
+    """
+
+    def __init__(self, name: str, options: dict, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._options = options
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"ytdl-{name}")
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.pending = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+
+    def _get_ydl(self) -> yt_dlp.YoutubeDL:
+        ydl = getattr(self._local, "ydl", None)
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(self._options)
+            self._local.ydl = ydl
+        return ydl
+
+    def _run(self, url: str, submitted_at: float, transform=None) -> object:
+        with self._stats_lock:
+            self.pending -= 1
+            self.active += 1
+        wait_ms = int((time.monotonic() - submitted_at) * 1000)
+        if wait_ms >= 1000:
+            logger.info("yt-dlp pool=%s queue_wait_ms=%d pending=%d", self.name, wait_ms, self.pending)
+        ok = False
+        try:
+            info = self._get_ydl().extract_info(url, download=False)
+            result = transform(info) if transform else info
+            ok = True
+            return result
+        finally:
+            with self._stats_lock:
+                self.active -= 1
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    def _job_done(self, future) -> None:
+        # A job cancelled while still queued never reaches _run, so it leaves the pending count here.
+        if future.cancelled():
+            with self._stats_lock:
+                self.pending -= 1
+
+    def _submit(self, *args) -> asyncio.Future:
+        with self._stats_lock:
+            self.pending += 1
+        future = self._executor.submit(self._run, *args)
+        future.add_done_callback(self._job_done)
+        return asyncio.wrap_future(future)
+
+    async def extract_info(self, url: str, timeout: float) -> dict:
+        """Run ``extract_info`` on a pooled instance without downloading."""
+        return await asyncio.wait_for(self._submit(url, time.monotonic()), timeout=timeout)
+
+    async def resolve(self, search_term: str, timeout: float, target_kbps: int = 0) -> Optional[ResolvedTrack]:
+        """Extract ``search_term`` and build the ResolvedTrack on the worker thread."""
+        transform = partial(first_resolved_entry, target_kbps=target_kbps)
+        return await asyncio.wait_for(self._submit(search_term, time.monotonic(), transform), timeout=timeout)
+
+    def stats(self) -> dict:
+        """Snapshot of queue and throughput counters for logging or diagnostics."""
+        with self._stats_lock:
+            return {
+                "name": self.name,
+                "workers": self.max_workers,
+                "pending": self.pending,
+                "active": self.active,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+
+# Separate pools so a burst of plays cannot starve autocomplete searches.
+extract_pool = YoutubeDLPool("extract", YTDL_EXTRACT_OPTS, YTDL_EXTRACT_WORKERS)
+search_pool = YoutubeDLPool("search", YTDL_SEARCH_OPTS, YTDL_SEARCH_WORKERS)
+
+
+class ProcessExtractPool:
+    """Extraction backend running yt-dlp in warm worker processes.
+
+    Signature deciphering and JSON parsing then run outside the bot's GIL, so
+    they cannot stall the event loop feeding voice packets. Workers run the
+    side-effect-free ``ytdl_worker`` module and only send back a compact
+    record of the first entry; the format is picked here. A crashed pool is rebuilt on
+    the next call; a worker still busy ``hang_seconds`` after its request
+    timed out gets the pool killed and rebuilt. Too many restarts in a short
+    window fall back to the thread backend.
+    """
+
+    RESTART_WINDOW_SEC = 600.0
+
+    def __init__(self, options: dict, max_workers: int, hang_seconds: float, max_restarts: int, fallback: YoutubeDLPool):
+        self.max_workers = max_workers
+        self.hang_seconds = hang_seconds
+        self.max_restarts = max_restarts
+        self._options = options
+        self._fallback = fallback
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._restart_times: List[float] = []
+        self.restarts = 0
+        self.disabled = False
+        self.pending = 0
+
+    def _ensure_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=ytdl_worker.init_worker,
+                initargs=(self._options,),
+            )
+        return self._executor
+
+    def warm_up(self) -> None:
+        """Start all worker processes so the first resolution does not pay for spawning."""
+        if self.disabled:
+            return
+        executor = self._ensure_executor()
+        for _ in range(self.max_workers):
+            executor.submit(ytdl_worker.warm_worker)
+
+    def _restart(self, reason: str) -> None:
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            # ProcessPoolExecutor cannot cancel a running task, so hung workers are killed.
+            for process in list((getattr(executor, "_processes", None) or {}).values()):
+                try:
+                    process.kill()
+                except Exception:
+                    pass
+            executor.shutdown(wait=False, cancel_futures=True)
+        now = time.monotonic()
+        self.restarts += 1
+        self._restart_times = [t for t in self._restart_times if now - t < self.RESTART_WINDOW_SEC]
+        self._restart_times.append(now)
+        logger.warning("yt-dlp process pool restart reason=%s restarts=%d", reason, self.restarts)
+        if len(self._restart_times) > self.max_restarts:
+            self.disabled = True
+            logger.error("yt-dlp process pool unstable, falling back to thread backend.")
+
+    async def _restart_if_hung(self, future: asyncio.Future, executor: ProcessPoolExecutor) -> None:
+        done, _ = await asyncio.wait({future}, timeout=self.hang_seconds)
+        if not done and self._executor is executor:
+            self._restart("hung_worker")
+
+    async def resolve(self, search_term: str, timeout: float, target_kbps: int = 0) -> Optional[ResolvedTrack]:
+        """Resolve ``search_term`` in a worker process."""
+        if self.disabled:
+            return await self._fallback.resolve(search_term, timeout, target_kbps)
+        executor = self._ensure_executor()
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        try:
+            future = loop.run_in_executor(executor, ytdl_worker.extract_entry, search_term)
+        except (BrokenProcessPool, RuntimeError):
+            self.pending -= 1
+            self._restart("broken_pool")
+            return await self.resolve(search_term, timeout, target_kbps)
+        try:
+            record = await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            asyncio.create_task(self._restart_if_hung(future, executor))
+            raise
+        except BrokenProcessPool:
+            if self._executor is executor:
+                self._restart("worker_crashed")
+            raise
+        finally:
+            self.pending -= 1
+        return build_resolved_track(record, target_kbps) if record else None
+
+    def stats(self) -> dict:
+        """Snapshot of pool state for logging or diagnostics."""
+        return {
+            "name": "extract-process",
+            "workers": self.max_workers,
+            "pending": self.pending,
+            "restarts": self.restarts,
+            "disabled": self.disabled,
+        }
+
+
+def create_extract_backend():
+    """Pick the extraction backend configured by YTDL_BACKEND."""
+    if YTDL_BACKEND == "process":
+        return ProcessExtractPool(
+            YTDL_EXTRACT_OPTS,
+            YTDL_PROCESS_WORKERS,
+            YTDL_PROCESS_HANG_SEC,
+            YTDL_PROCESS_MAX_RESTARTS,
+            fallback=extract_pool,
+        )
+    if YTDL_BACKEND != "thread":
+        logger.warning("Invalid YTDL_BACKEND=%r. Using default=thread.", YTDL_BACKEND)
+    return extract_pool
+
+
+extract_backend = create_extract_backend()
+
+
+# --------------------------------------------------------------
+# Local audio cache
+# --------------------------------------------------------------
+class AudioCache:
+    """On-disk Ogg/Opus cache for tracks that keep getting played.
+
+    Play counts live in a small SQLite index next to the files. Once a video
+    crosses ``play_threshold`` plays it is fetched once in the background with
+    FFmpeg (stream copy when the source is already Opus). Files are written
+    under a temporary name and renamed into place, their SHA-256 is checked the
+    first time they are used in a process, and the least recently played files
+    are evicted when the directory grows past ``max_bytes``.
+    """
+
+    SUFFIX = ".opus"
+
+    def __init__(self, directory: str, max_bytes: int, play_threshold: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.play_threshold = play_threshold
+        self._lock = threading.Lock()
+        self._verified: set = set()
+        self._downloading: set = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audio-cache")
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files (video_id TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "sha256 TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS plays (video_id TEXT PRIMARY KEY, count INTEGER NOT NULL)")
+        self._db.commit()
+        self._cleanup_on_start()
+
+    def _path(self, video_id: str) -> str:
+        safe_id = re.sub(r'[^A-Za-z0-9_-]', '_', video_id)
+        return os.path.join(self.directory, safe_id + self.SUFFIX)
+
+    def _cleanup_on_start(self) -> None:
+        for leftover in glob.glob(os.path.join(self.directory, "*.part")):
+            try:
+                os.remove(leftover)
+            except OSError:
+                pass
+        with self._lock:
+            rows = self._db.execute("SELECT video_id FROM files").fetchall()
+            missing = [(vid,) for (vid,) in rows if not os.path.isfile(self._path(vid))]
+            self._db.executemany("DELETE FROM files WHERE video_id = ?", missing)
+            self._db.commit()
+
+    @staticmethod
+    def _sha256(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _forget(self, video_id: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM files WHERE video_id = ?", (video_id,))
+            self._db.commit()
+        self._verified.discard(video_id)
+        try:
+            os.remove(self._path(video_id))
+        except OSError:
+            pass
+
+    def _lookup_sync(self, video_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT size, sha256 FROM files WHERE video_id = ?", (video_id,)).fetchone()
+        if not row:
+            return None
+        path = self._path(video_id)
+        size, sha256 = row
+        try:
+            intact = os.path.getsize(path) == size
+            if intact and video_id not in self._verified:
+                intact = self._sha256(path) == sha256
+        except OSError:
+            intact = False
+        if not intact:
+            logger.warning("Audio cache entry corrupt, dropping video_id=%s", video_id)
+            self._forget(video_id)
+            return None
+        self._verified.add(video_id)
+        with self._lock:
+            self._db.execute("UPDATE files SET last_used = ? WHERE video_id = ?", (time.time(), video_id))
+            self._db.commit()
+        return path
+
+    def _count_play_sync(self, video_id: str) -> int:
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO plays (video_id, count) VALUES (?, 1) "
+                "ON CONFLICT(video_id) DO UPDATE SET count = count + 1",
+                (video_id,),
+            )
+            self._db.commit()
+            row = self._db.execute("SELECT count FROM plays WHERE video_id = ?", (video_id,)).fetchone()
+        return row[0] if row else 0
+
+    def _download_sync(self, track: ResolvedTrack) -> None:
+        final_path = self._path(track.video_id)
+        part_path = final_path + ".part"
+        codec_args = ["-c:a", "copy"] if is_opus_codec(track.acodec) else ["-c:a", "libopus", "-b:a", "128k"]
+        args = [
+            FFMPEG_EXE, "-loglevel", "error", "-y",
+            *FFMPEG_BEFORE_OPTIONS.split(),
+            "-i", track.stream_url, "-vn", *codec_args, "-f", "ogg", part_path,
+        ]
+        try:
+            subprocess.run(args, check=True, timeout=max(track.duration * 2, 300), capture_output=True)
+            size = os.path.getsize(part_path)
+            sha256 = self._sha256(part_path)
+            os.replace(part_path, final_path)
+        except (OSError, subprocess.SubprocessError) as dl_err:
+            logger.warning("Audio cache download failed video_id=%s error=%s", track.video_id, dl_err)
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (video_id, size, sha256, last_used) VALUES (?, ?, ?, ?)",
+                (track.video_id, size, sha256, time.time()),
+            )
+            self._db.commit()
+        self._verified.add(track.video_id)
+        logger.info("Audio cache stored video_id=%s size=%d", track.video_id, size)
+        self._evict_sync()
+
+    def _evict_sync(self) -> None:
+        with self._lock:
+            rows = self._db.execute("SELECT video_id, size FROM files ORDER BY last_used ASC").fetchall()
+        total = sum(size for _, size in rows)
+        for video_id, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._forget(video_id)
+            total -= size
+            logger.info("Audio cache evicted video_id=%s", video_id)
+
+    async def lookup(self, video_id: str) -> Optional[str]:
+        """Return the path of an intact cached file for ``video_id``."""
+        return await asyncio.to_thread(self._lookup_sync, video_id)
+
+    async def record_play(self, track: ResolvedTrack) -> None:
+        """Count a streamed play and start a background download once the track is hot."""
+        count = await asyncio.to_thread(self._count_play_sync, track.video_id)
+        if count < self.play_threshold or track.video_id in self._downloading or not FFMPEG_EXE:
+            return
+        self._downloading.add(track.video_id)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, self._download_sync, track)
+        future.add_done_callback(lambda _f: self._downloading.discard(track.video_id))
+
+
+def create_audio_cache() -> Optional[AudioCache]:
+    """Build the local audio cache if enabled and its directory is usable."""
+    if not AUDIO_CACHE_ENABLED:
+        return None
+    try:
+        return AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_MB * 1024 * 1024, AUDIO_CACHE_PLAY_THRESHOLD)
+    except (OSError, sqlite3.Error) as cache_err:
+        logger.warning("Audio cache disabled path=%s error=%s", AUDIO_CACHE_DIR, cache_err)
+        return None
+
+
+audio_cache: Optional[AudioCache] = None
+
+
+# --------------------------------------------------------------
+# Autocomplete suggestion index
+# --------------------------------------------------------------
+SUGGESTION_WORD_PATTERN = re.compile(r"[^\W_]+")
+
+
+class SuggestionIndex:
+    """Sorted prefix index over titles the bot has resolved, played or seen in searches.
+
+    Each title is indexed under the suffixes starting at its first few words,
+    so "never gonna" finds "Rick Astley - Never Gonna Give You Up". Lookups
+    are a bisect into the sorted key list plus a scan of the matching range.
+    Results are ranked by play count with an exponential recency decay.
+    """
+
+    MAX_INDEXED_WORDS = 8
+    HALF_LIFE_SEC = 7 * 24 * 3600.0
+
+    def __init__(self, capacity: int = 5000):
+        self.capacity = capacity
+        self._keys: List[Tuple[str, str]] = []
+        # title key -> [display title, plays, last seen (wall clock)]
+        self._titles: dict[str, list] = {}
+
+    def __len__(self) -> int:
+        return len(self._titles)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(SUGGESTION_WORD_PATTERN.findall(text.lower()))
+
+    def _suffixes(self, title_key: str) -> List[str]:
+        words = title_key.split(" ")
+        return [" ".join(words[i:]) for i in range(min(len(words), self.MAX_INDEXED_WORDS))]
+
+    def add(self, title: str, played: bool = False, now: Optional[float] = None) -> None:
+        """Index a title, or refresh it; ``played`` also bumps its play count."""
+        title_key = self.normalize(title)
+        if not title_key:
+            return
+        now = time.time() if now is None else now
+        entry = self._titles.get(title_key)
+        if entry is None:
+            self._titles[title_key] = [title[:100], int(played), now]
+            for suffix in self._suffixes(title_key):
+                insort(self._keys, (suffix, title_key))
+            if len(self._titles) > self.capacity:
+                self._trim(now)
+            return
+        entry[1] += int(played)
+        entry[2] = now
+
+    def _score(self, entry: list, now: float) -> float:
+        return (entry[1] + 1) * 0.5 ** (max(now - entry[2], 0.0) / self.HALF_LIFE_SEC)
+
+    def _trim(self, now: float) -> None:
+        """Drop the lowest-ranked tenth of titles and rebuild the key list."""
+        ranked = sorted(self._titles, key=lambda key: self._score(self._titles[key], now))
+        for title_key in ranked[:max(len(ranked) // 10, 1)]:
+            del self._titles[title_key]
+        self._keys = [item for item in self._keys if item[1] in self._titles]
+
+    def suggest(self, query: str, limit: int = 5, now: Optional[float] = None) -> List[str]:
+        prefix = self.normalize(query)
+        if not prefix:
+            return []
+        now = time.time() if now is None else now
+        matches: set = set()
+        idx = bisect_left(self._keys, (prefix, ""))
+        while idx < len(self._keys) and self._keys[idx][0].startswith(prefix):
+            matches.add(self._keys[idx][1])
+            idx += 1
+        ranked = sorted(matches, key=lambda key: self._score(self._titles[key], now), reverse=True)
+        return [self._titles[key][0] for key in ranked[:limit]]
+
+
+suggestion_index = SuggestionIndex()
+# Normalized query -> titles of the last network search for it.
+autocomplete_cache = TTLCache("autocomplete", AUTOCOMPLETE_CACHE_SIZE, AUTOCOMPLETE_CACHE_TTL_SEC)
+
 # --------------------------------------------------------------
 # Slash command helpers and autocomplete
 # --------------------------------------------------------------
+AUTOCOMPLETE_SEARCHES = Counter(
+    "dcbot_autocomplete_searches_total",
+    "Autocomplete network searches by outcome (started, superseded, dropped).",
+    ("outcome",),
+)
+
+
+class AutocompleteSearch:
+    __slots__ = ("key", "fetch", "submitted_at", "task", "waiter", "started")
+
+    def __init__(self, key: str, fetch):
+        self.key = key
+        self.fetch = fetch
+        self.submitted_at = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self.waiter: Optional[asyncio.Future] = None
+        self.started = False
+
+
+class AutocompleteScheduler:
+    """Debounced, bounded runner for autocomplete network searches.
+
+    Each user has at most one search scheduled: a newer prefix cancels the
+    previous one while it is still debouncing or waiting for a slot. At most
+    ``max_concurrent`` searches run at once and a freed slot goes to the most
+    recently typed prefix, since older ones are likely stale. A search that
+    already runs is left to finish because its titles still feed the
+    suggestion index and the worker thread cannot be interrupted anyway.
+    """
+
+    def __init__(self, max_concurrent: int, debounce_sec: float, max_pending: int):
+        self.max_concurrent = max_concurrent
+        self.debounce_sec = debounce_sec
+        self.max_pending = max_pending
+        self.active = 0
+        self._by_user: dict[int, AutocompleteSearch] = {}
+        self._by_key: dict[str, AutocompleteSearch] = {}
+        self._waiting: List[AutocompleteSearch] = []
+
+    def __len__(self) -> int:
+        return len(self._by_key)
+
+    def submit(self, user_id: int, key: str, fetch) -> bool:
+        """Schedule ``fetch()`` for ``key`` on behalf of ``user_id``; False if it is already scheduled."""
+        if key in self._by_key:
+            return False
+        previous = self._by_user.get(user_id)
+        if previous is not None and not previous.started:
+            self._cancel(previous, "superseded")
+        search = AutocompleteSearch(key, fetch)
+        self._by_user[user_id] = search
+        self._by_key[key] = search
+        search.task = asyncio.create_task(self._run(user_id, search))
+        return True
+
+    async def _run(self, user_id: int, search: AutocompleteSearch) -> None:
+        try:
+            if self.debounce_sec:
+                await asyncio.sleep(self.debounce_sec)
+            await self._acquire(search)
+            search.started = True
+            AUTOCOMPLETE_SEARCHES.inc(outcome="started")
+            try:
+                await search.fetch()
+            finally:
+                self._release()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if self._by_user.get(user_id) is search:
+                del self._by_user[user_id]
+            if self._by_key.get(search.key) is search:
+                del self._by_key[search.key]
+
+    async def _acquire(self, search: AutocompleteSearch) -> None:
+        if self.active < self.max_concurrent and not self._waiting:
+            self.active += 1
+            return
+        search.waiter = asyncio.get_running_loop().create_future()
+        self._waiting.append(search)
+        while len(self._waiting) > self.max_pending:
+            oldest = min(self._waiting, key=lambda item: item.submitted_at)
+            self._waiting.remove(oldest)
+            self._cancel(oldest, "dropped")
+        try:
+            await search.waiter
+        except asyncio.CancelledError:
+            if search in self._waiting:
+                self._waiting.remove(search)
+            elif search.waiter.done() and not search.waiter.cancelled():
+                # The slot was handed over just before the cancel; pass it on.
+                self._release()
+            raise
+
+    def _cancel(self, search: AutocompleteSearch, outcome: str) -> None:
+        # Unregister here too: a task cancelled before its first step never runs its finally block.
+        for registry in (self._by_user, self._by_key):
+            for owner, scheduled in list(registry.items()):
+                if scheduled is search:
+                    del registry[owner]
+        search.task.cancel()
+        AUTOCOMPLETE_SEARCHES.inc(outcome=outcome)
+
+    def _release(self) -> None:
+        # Hand the slot straight to the newest waiting search.
+        while self._waiting:
+            newest = max(self._waiting, key=lambda item: item.submitted_at)
+            self._waiting.remove(newest)
+            if not newest.waiter.done():
+                newest.waiter.set_result(None)
+                return
+        self.active -= 1
+
+    async def join(self) -> None:
+        """Wait until every scheduled search has finished or been cancelled."""
+        while self._by_key:
+            await asyncio.gather(*(search.task for search in list(self._by_key.values())), return_exceptions=True)
+
+
+autocomplete_scheduler = AutocompleteScheduler(
+    YTDL_SEARCH_WORKERS, AUTOCOMPLETE_DEBOUNCE_MS / 1000, AUTOCOMPLETE_MAX_PENDING
+)
+
+
+def searched_prefix_recently(cache_key: str, now: float) -> bool:
+    """True if a shorter prefix of the query was searched recently.
+
+    Its results are already in the suggestion index, so when they still match
+    the longer query another network search would mostly repeat them.
+    """
+    for end in range(2, len(cache_key)):
+        if autocomplete_cache.peek(cache_key[:end].rstrip(), now=now) is not None:
+            return True
+    return False
+
+
 async def yt_autocomplete(
     interaction: discord.Interaction,
     current: str
@@ -380,15 +2340,18 @@ async def yt_autocomplete(
     """
     Provide autocomplete suggestions for the play slash command.
 
-    This function uses yt_dlp to search for the current user input and returns
-    up to five song titles as choices. If yt_dlp is unavailable or an error
-    occurs, an empty list is returned.
+    Choices come from ``suggestion_index`` (titles already played or searched)
+    plus any cached search for the same input, so no network call is awaited.
+    When that is not enough, a yt_dlp search is scheduled in the background,
+    debounced per user by ``autocomplete_scheduler``; its results are cached
+    in ``autocomplete_cache`` and added to the index for later keystrokes. A
+    failed search simply adds nothing.
 
     Parameters
     ----------
     interaction: discord.Interaction
-        The interaction that triggered the autocomplete. Unused here but
-        required by the signature.
+        The interaction that triggered the autocomplete; its user keys the
+        search debounce.
     current: str
         The text the user has typed so far.
 
@@ -401,24 +2364,18 @@ async def yt_autocomplete(
     query = current.strip()
     if len(query) < 2:
         return []
+    # Answer from titles seen before; the network search below only backfills the index.
+    titles = suggestion_index.suggest(query)
     cache_key = query.lower()
     now = time.monotonic()
-    cached = autocomplete_cache.get(cache_key)
-    if cached and now - cached[0] < AUTOCOMPLETE_CACHE_TTL_SECONDS:
-        return [app_commands.Choice(name=title, value=title) for title in cached[1]]
-
-    # Prepare search options: flat extraction to avoid deep info and limit results
-    search_opts = {
-        'format': 'bestaudio/best',
-        'quiet': True,
-        'noplaylist': True,
-        'extract_flat': True,
-        'skip_download': True,
-    }
-
-    def _fetch_titles() -> List[str]:
-        with yt_dlp.YoutubeDL(search_opts) as ydl:
-            info = ydl.extract_info(f"ytsearch5:{query}", download=False)
+    cached = autocomplete_cache.get(cache_key, now=now)
+    if cached is not None:
+        titles.extend(t for t in cached if t not in titles)
+    if len(titles) >= 5 or cached is not None or (titles and searched_prefix_recently(cache_key, now)):
+        return [app_commands.Choice(name=title, value=title) for title in titles[:5]]
+
+    async def _fetch_titles() -> List[str]:
+        info = await search_pool.extract_info(f"ytsearch5:{query}", timeout=4.0)
         titles: List[str] = []
         for entry in info.get('entries', []):
             title = entry.get('title')
@@ -429,73 +2386,804 @@ async def yt_autocomplete(
                 break
         return titles
 
-    async def _populate_cache() -> None:
+    async def _populate_cache() -> None:
+        try:
+            # Populate cache in the background so autocomplete response stays immediate.
+            titles = await _fetch_titles()
+            autocomplete_cache.put(cache_key, titles)
+            for title in titles:
+                suggestion_index.add(title)
+        except Exception:
+            pass
+
+    # Never block autocomplete on network I/O; return fast to avoid 10062 Unknown interaction.
+    user_id = interaction.user.id if interaction is not None else 0
+    autocomplete_scheduler.submit(user_id, cache_key, _populate_cache)
+    return [app_commands.Choice(name=title, value=title) for title in titles]
+
+
+def select_audio_format(formats: List[dict], target_kbps: int = 0) -> Optional[dict]:
+    """Pick the cheapest direct audio format to play into a voice channel.
+
+    Opus formats win because they can be stream-copied without transcoding.
+    Within a codec the bitrate closest to the channel bitrate is preferred,
+    since anything above it is wasted bandwidth; without a target the highest
+    bitrate wins.
+    """
+    audio_formats = [
+        f for f in formats
+        if f.get('acodec') not in (None, 'none')
+        and f.get('vcodec') == 'none'
+        and f.get('url')
+        and f.get('protocol') not in {'m3u8', 'm3u8_native', 'http_dash_segments'}
+    ]
+    if not audio_formats:
+        return None
+
+    def _bitrate(f: dict) -> float:
+        return float(f.get('abr') or f.get('tbr') or 0.0)
+
+    def _score(f: dict) -> Tuple[int, float]:
+        codec_rank = 0 if is_opus_codec(str(f.get('acodec'))) else 1
+        if target_kbps <= 0:
+            return codec_rank, -_bitrate(f)
+        return codec_rank, abs(_bitrate(f) - target_kbps)
+
+    return min(audio_formats, key=_score)
+
+
+def build_resolved_track(entry: dict, target_kbps: int = 0) -> Optional[ResolvedTrack]:
+    """Turn a yt-dlp info entry into a ResolvedTrack, picking a direct audio URL."""
+    chosen = select_audio_format(entry.get('formats') or [], target_kbps)
+    if chosen is None:
+        # Extractors without a formats list only expose the URL yt-dlp selected.
+        if not entry.get('url'):
+            return None
+        chosen = entry
+    audio_url = chosen['url']
+    return ResolvedTrack(
+        video_id=str(entry.get('id') or audio_url),
+        title=entry.get('title', 'Ismeretlen'),
+        stream_url=audio_url,
+        expires_at=parse_stream_expiry(audio_url),
+        format_id=str(chosen.get('format_id') or ''),
+        acodec=str(chosen.get('acodec') or ''),
+        ext=str(chosen.get('ext') or ''),
+        abr=float(chosen.get('abr') or chosen.get('tbr') or 0.0),
+        duration=int(entry.get('duration') or 0),
+        webpage_url=str(entry.get('webpage_url') or entry.get('original_url') or ''),
+    )
+
+
+def first_resolved_entry(info: Optional[dict], target_kbps: int = 0) -> Optional[ResolvedTrack]:
+    """Normalise search results and resolve the first entry."""
+    if not info:
+        return None
+    entries = info.get('entries', [info])
+    if not entries:
+        return None
+    return build_resolved_track(entries[0], target_kbps)
+
+
+_resolve_inflight: dict[str, asyncio.Task] = {}
+
+
+@traced("search_youtube")
+async def resolve_track(term: str, target_kbps: int = 0) -> Optional[ResolvedTrack]:
+    """Resolve a search term or URL to a playable track, consulting the cache first.
+
+    ``target_kbps`` is the voice channel bitrate used to pick the audio format
+    on a cache miss; cached tracks keep the format chosen when first resolved.
+    """
+    video_id = extract_youtube_video_id(term) if is_url(term) else None
+    cache_term = None if video_id else normalize_search_term(term)
+    cached = await track_cache.get(term=cache_term, video_id=video_id)
+    annotate_span(cache="hit" if cached else "miss")
+    if cached:
+        logger.debug("Track cache hit term=%r video_id=%s", term, cached.video_id)
+        return cached
+
+    # A search term resolved before (e.g. a re-imported Spotify playlist) skips the search step.
+    # Only plain searches map to YouTube video IDs; other URLs keep their own extractor.
+    extract_term = term
+    if cache_term and not is_url(term):
+        known_video_id = await track_cache.video_id_for(cache_term)
+        if known_video_id:
+            extract_term = f"https://www.youtube.com/watch?v={known_video_id}"
+
+    # Prefetch and playback may ask for the same term at once; share one extraction.
+    inflight_key = video_id or cache_term or term
+    task = _resolve_inflight.get(inflight_key)
+    if task is None:
+        task = asyncio.create_task(_extract_and_cache(extract_term, cache_term, target_kbps))
+        _resolve_inflight[inflight_key] = task
+        task.add_done_callback(lambda _t: _resolve_inflight.pop(inflight_key, None))
+    return await asyncio.shield(task)
+
+
+async def _extract_and_cache(term: str, cache_term: Optional[str], target_kbps: int = 0) -> Optional[ResolvedTrack]:
+    """Run yt-dlp extraction for ``term`` and store the result in the track cache."""
+    search_term = term if is_url(term) else f"ytsearch:{term}"
+    started = time.monotonic()
+    try:
+        track = await extract_backend.resolve(search_term, timeout=15.0, target_kbps=target_kbps)
+    except asyncio.TimeoutError:
+        YTDL_RESOLVE_SECONDS.observe(time.monotonic() - started, outcome="timeout")
+        logger.warning("yt-dlp search timeout term=%r", term)
+        return None
+    except Exception as e:
+        YTDL_RESOLVE_SECONDS.observe(time.monotonic() - started, outcome="error")
+        logger.error("yt-dlp search error term=%r error=%s", term, e)
+        return None
+    YTDL_RESOLVE_SECONDS.observe(time.monotonic() - started, outcome="ok" if track else "empty")
+    if track:
+        await track_cache.put(cache_term, track)
+        suggestion_index.add(track.title)
+    return track
+
+
+class Track:
+    """Compact queue record resolved to a stream URL only shortly before it plays.
+
+    Only IDs are kept instead of the originating Context/Interaction, so long
+    queues do not pin messages, interaction tokens or member caches in memory.
+    ``resolved`` holds the stream URL and format once the track is resolved.
+    """
+
+    __slots__ = ("term", "title", "channel_id", "requester_id", "duration", "source_id", "source_url", "resolved")
+
+    def __init__(
+        self,
+        term: str,
+        title: str,
+        channel_id: int = 0,
+        requester_id: int = 0,
+        resolved: Optional[ResolvedTrack] = None,
+    ):
+        self.term = term
+        self.title = title
+        self.channel_id = channel_id
+        self.requester_id = requester_id
+        self.duration = 0
+        self.source_id = ""
+        self.source_url = ""
+        self.resolved: Optional[ResolvedTrack] = None
+        if resolved:
+            self.apply(resolved)
+
+    @classmethod
+    def from_target(cls, term: str, title: str, target: object, resolved: Optional[ResolvedTrack] = None) -> "Track":
+        """Build a track from the Context or Interaction that requested it."""
+        channel_id = getattr(target, "channel_id", None) or getattr(getattr(target, "channel", None), "id", 0)
+        requester = getattr(target, "author", None) or getattr(target, "user", None)
+        return cls(term, title, channel_id or 0, getattr(requester, "id", 0), resolved)
+
+    def apply(self, resolved: ResolvedTrack) -> None:
+        """Record a resolution result on the track."""
+        self.resolved = resolved
+        self.title = resolved.title
+        self.duration = resolved.duration
+        self.source_id = resolved.video_id
+        if resolved.webpage_url:
+            self.source_url = resolved.webpage_url
+
+    def needs_resolve(self) -> bool:
+        return self.resolved is None or not self.resolved.is_fresh()
+
+    def to_record(self) -> dict:
+        """Serializable form used by the session store; stream URLs are not kept."""
+        return {
+            "term": self.term,
+            "title": self.title,
+            "channel_id": self.channel_id,
+            "requester_id": self.requester_id,
+            "duration": self.duration,
+            "source_id": self.source_id,
+            "source_url": self.source_url,
+        }
+
+    @classmethod
+    def from_record(cls, record: dict) -> "Track":
+        track = cls(
+            record.get("term") or record.get("title", ""),
+            record.get("title", ""),
+            record.get("channel_id", 0),
+            record.get("requester_id", 0),
+        )
+        track.duration = record.get("duration", 0)
+        track.source_id = record.get("source_id", "")
+        track.source_url = record.get("source_url", "")
+        return track
+
+    def __repr__(self) -> str:
+        return f"Track(title={self.title!r}, source_id={self.source_id!r})"
+
+
+def channel_handle(channel_id: int) -> Optional[discord.abc.Messageable]:
+    """Lightweight handle for sending announcements to a text channel by ID."""
+    if not channel_id:
+        return None
+    return bot.get_partial_messageable(channel_id)
+
+
+async def announce(track: Track, message: str):
+    """Send a message to the channel a track was requested from."""
+    channel = channel_handle(track.channel_id)
+    if channel is not None:
+        await safe_send(channel, message)
+
+
+async def resolve_entry(entry: Track, target_kbps: int = 0) -> Optional[ResolvedTrack]:
+    """Resolve a queued track in place, reusing its stream URL while still fresh.
+
+    The resolved track carries the chosen format, codec and bitrate, which the
+    playback path uses to pick the cheapest FFmpeg pipeline.
+    """
+    if entry.needs_resolve():
+        resolved = await resolve_track(entry.term, target_kbps)
+        if resolved is None:
+            return None
+        entry.apply(resolved)
+    return entry.resolved
+
+
+async def refresh_stream(entry: Track, target_kbps: int = 0) -> Optional[ResolvedTrack]:
+    """Re-resolve a track whose stream URL expired or was rejected by the server.
+
+    The cached URL is dropped first, and the page the track was extracted
+    from is resolved directly so the same track is played again rather than a
+    new search result. Without a recorded page the original term is used.
+    """
+    if entry.source_id:
+        await track_cache.invalidate(entry.source_id)
+    term = entry.source_url or entry.term
+    resolved = await resolve_track(term, target_kbps)
+    if resolved:
+        entry.apply(resolved)
+        logger.info("Stream URL refreshed video_id=%s expires_at=%d", resolved.video_id, resolved.expires_at)
+    return resolved
+
+
+def entry_identity(entry: Track) -> str:
+    """Key used to detect duplicate queue entries."""
+    return entry.source_id or normalize_search_term(entry.term)
+
+
+# --------------------------------------------------------------
+# Session persistence
+# --------------------------------------------------------------
+class PlaylistJournal:
+    """Mirrors one guild's GuildPlaylist mutations into the session store.
+
+    Every row carries a REAL sort key; the journal keeps the keys of the live
+    entries in order so a pop, insert or removal only touches a single row.
+    Inserts take the midpoint between their neighbours; once repeated inserts
+    at the same spot shrink a gap below ``MIN_GAP``, the whole queue is
+    rewritten with integer keys before float precision runs out.
+    """
+
+    MIN_GAP = 1e-6
+
+    def __init__(self, store: "SessionStore", guild_id: int):
+        self.store = store
+        self.guild_id = guild_id
+        self._keys: "deque[float]" = deque()
+
+    def seed(self, keys: Iterable[float]) -> None:
+        """Adopt the sort keys of rows loaded from disk."""
+        self._keys = deque(keys)
+
+    def appended(self, entries: list) -> None:
+        last = self._keys[-1] if self._keys else 0.0
+        rows = []
+        for offset, entry in enumerate(entries, start=1):
+            rows.append((last + offset, entry.to_record()))
+        self._keys.extend(key for key, _ in rows)
+        self.store.submit(self.store._insert_rows, self.guild_id, rows)
+
+    def inserted(self, index: int, entry, entries: Iterable) -> None:
+        """Journal ``entry`` inserted at ``index``; ``entries`` is the whole queue, used to rebalance."""
+        before = self._keys[index - 1] if index > 0 else None
+        after = self._keys[index] if index < len(self._keys) else None
+        if before is None and after is None:
+            key = 1.0
+        elif before is None:
+            key = after - 1.0
+        elif after is None:
+            key = before + 1.0
+        else:
+            if after - before < self.MIN_GAP:
+                self.replaced(list(entries))
+                return
+            key = (before + after) / 2
+        self._keys.insert(index, key)
+        self.store.submit(self.store._insert_rows, self.guild_id, [(key, entry.to_record())])
+
+    def removed(self, index: int) -> None:
+        if index == 0:
+            key = self._keys.popleft()
+        else:
+            key = self._keys[index]
+            del self._keys[index]
+        self.store.submit(self.store._delete_row, self.guild_id, key)
+
+    def replaced(self, entries: list) -> None:
+        rows = [(float(pos), entry.to_record()) for pos, entry in enumerate(entries, start=1)]
+        self._keys = deque(key for key, _ in rows)
+        self.store.submit(self.store._replace_rows, self.guild_id, rows)
+
+
+class SessionStore:
+    """SQLite (WAL) store of per-guild queues and the track that was playing.
+
+    Queue mutations arrive through PlaylistJournal and are written one row at
+    a time on a single background thread, so writes stay ordered and never
+    block the event loop. The playing track and its approximate position are
+    checkpointed periodically; on startup each guild is restored on its own.
+    """
+
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-store")
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (guild_id INTEGER PRIMARY KEY, "
+            "voice_channel_id INTEGER NOT NULL, current TEXT, position REAL NOT NULL DEFAULT 0, "
+            "updated_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS queue_items (guild_id INTEGER NOT NULL, pos REAL NOT NULL, "
+            "payload TEXT NOT NULL, PRIMARY KEY (guild_id, pos))"
+        )
+        # Queues that never reached playback have no session and cannot be restored.
+        self._db.execute("DELETE FROM queue_items WHERE guild_id NOT IN (SELECT guild_id FROM sessions)")
+        self._db.commit()
+
+    def journal(self, guild_id: int) -> PlaylistJournal:
+        return PlaylistJournal(self, guild_id)
+
+    def submit(self, fn, *args) -> None:
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(future) -> None:
+        err = future.exception()
+        if err:
+            logger.warning("Session store write failed error=%s", err)
+
+    def flush(self) -> None:
+        """Block until all queued writes are on disk."""
+        self._executor.submit(lambda: None).result()
+
+    def _insert_rows(self, guild_id: int, rows: list) -> None:
+        self._db.executemany(
+            "INSERT OR REPLACE INTO queue_items (guild_id, pos, payload) VALUES (?, ?, ?)",
+            [(guild_id, key, json.dumps(record)) for key, record in rows],
+        )
+        self._db.commit()
+
+    def _delete_row(self, guild_id: int, key: float) -> None:
+        self._db.execute("DELETE FROM queue_items WHERE guild_id = ? AND pos = ?", (guild_id, key))
+        self._db.commit()
+
+    def _replace_rows(self, guild_id: int, rows: list) -> None:
+        with self._db:
+            self._db.execute("DELETE FROM queue_items WHERE guild_id = ?", (guild_id,))
+            self._db.executemany(
+                "INSERT INTO queue_items (guild_id, pos, payload) VALUES (?, ?, ?)",
+                [(guild_id, key, json.dumps(record)) for key, record in rows],
+            )
+
+    def _save_session(self, guild_id: int, voice_channel_id: int, current: Optional[dict], position: float) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO sessions (guild_id, voice_channel_id, current, position, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (guild_id, voice_channel_id, json.dumps(current) if current else None, position, time.time()),
+        )
+        self._db.commit()
+
+    def _checkpoint(self, positions: list) -> None:
+        self._db.executemany(
+            "UPDATE sessions SET position = ?, updated_at = ? WHERE guild_id = ?",
+            [(position, time.time(), guild_id) for guild_id, position in positions],
+        )
+        self._db.commit()
+
+    def _forget(self, guild_id: int) -> None:
+        with self._db:
+            self._db.execute("DELETE FROM sessions WHERE guild_id = ?", (guild_id,))
+            self._db.execute("DELETE FROM queue_items WHERE guild_id = ?", (guild_id,))
+
+    def save_session(self, guild_id: int, voice_channel_id: int, current: Optional[Track], position: float = 0.0) -> None:
+        """Record the voice channel and the track that just started."""
+        record = current.to_record() if current else None
+        self.submit(self._save_session, guild_id, voice_channel_id, record, position)
+
+    def checkpoint(self, positions: list) -> None:
+        """Update playback positions given as ``(guild_id, seconds)`` pairs."""
+        if positions:
+            self.submit(self._checkpoint, positions)
+
+    def forget(self, guild_id: int) -> None:
+        self.submit(self._forget, guild_id)
+
+    def load_sessions(self) -> List[Tuple[int, int, Optional[Track], float]]:
+        """Blocking: list stored sessions without touching their queues."""
+        rows = self._db.execute(
+            "SELECT guild_id, voice_channel_id, current, position FROM sessions"
+        ).fetchall()
+        return [
+            (guild_id, channel_id, Track.from_record(json.loads(current)) if current else None, position or 0.0)
+            for guild_id, channel_id, current, position in rows
+        ]
+
+    def load_queue(self, guild_id: int) -> Tuple[List[float], List[Track]]:
+        """Blocking: return the sort keys and tracks of one guild's stored queue."""
+        rows = self._db.execute(
+            "SELECT pos, payload FROM queue_items WHERE guild_id = ? ORDER BY pos", (guild_id,)
+        ).fetchall()
+        return [pos for pos, _ in rows], [Track.from_record(json.loads(payload)) for _, payload in rows]
+
+
+def create_session_store() -> Optional[SessionStore]:
+    """Open the session store unless disabled or unusable."""
+    if not SESSION_STORE_DB:
+        return None
+    try:
+        return SessionStore(SESSION_STORE_DB)
+    except (OSError, sqlite3.Error) as store_err:
+        logger.warning("Session store disabled path=%s error=%s", SESSION_STORE_DB, store_err)
+        return None
+
+
+session_store: Optional[SessionStore] = None
+
+
+def open_stores() -> None:
+    """Open the on-disk caches and the session store.
+
+    Called once from on_ready rather than at import time, so importing main
+    (tests, tooling) does not create databases or clean up cache directories.
+    """
+    global session_store, audio_cache
+    if TRACK_CACHE_DB:
+        track_cache.open_db(TRACK_CACHE_DB)
+    if SPOTIFY_CACHE_DB:
+        spotify_cache.open_db(SPOTIFY_CACHE_DB)
+    audio_cache = create_audio_cache()
+    session_store = create_session_store()
+
+
+def forget_session(guild_id: int) -> None:
+    """Drop the persisted session once playback ends on purpose."""
+    player = players.peek(guild_id)
+    if player is not None:
+        player.playback_source = None
+        player.pending_resume = None
+    if session_store:
+        session_store.forget(guild_id)
+
+
+# --------------------------------------------------------------
+# Idle resource reaper
+# --------------------------------------------------------------
+REAPED_OBJECTS = Counter("dcbot_reaped_objects_total", "Objects dropped by the idle reaper.", ("kind",))
+
+
+def live_object_counts() -> dict:
+    return {
+        "players": len(players),
+        "autocomplete": len(autocomplete_cache),
+        "tracks": len(track_cache),
+        "suggestions": len(suggestion_index),
+    }
+
+
+Gauge(
+    "dcbot_live_objects",
+    "Per-guild players and cache entries currently held in memory.",
+    ("kind",),
+    collect=lambda: [({"kind": kind}, count) for kind, count in live_object_counts().items()],
+)
+
+
+def reap_idle_resources(now: Optional[float] = None) -> dict:
+    """One reaper pass: evict idle players and expired cache entries, return counts per kind."""
+    reaped = {
+        "players": players.evict_idle(now),
+        "autocomplete": autocomplete_cache.purge_expired(now),
+        "tracks": track_cache.purge_expired(),
+    }
+    for kind, count in reaped.items():
+        if count:
+            REAPED_OBJECTS.inc(count, kind=kind)
+    return reaped
+
+
+async def run_reaper() -> None:
+    while True:
+        await asyncio.sleep(REAPER_INTERVAL_SEC)
+        try:
+            reaped = reap_idle_resources()
+        except Exception as reap_err:
+            logger.warning("Reaper pass failed error=%s", reap_err)
+            continue
+        if any(reaped.values()):
+            logger.info(
+                "Reaper pass reaped=%s live=%s",
+                " ".join(f"{k}={v}" for k, v in reaped.items()),
+                " ".join(f"{k}={v}" for k, v in live_object_counts().items()),
+            )
+        for stats in (autocomplete_cache.stats(), *track_cache.stats()):
+            logger.debug("Cache stats %s", " ".join(f"{k}={v}" for k, v in stats.items()))
+
+
+async def release_guild(guild_id: int) -> None:
+    """Drop everything held for a guild the bot was removed from."""
+    player = players.peek(guild_id)
+    if player is None:
+        forget_session(guild_id)
+        return
+    if player.queue is not None:
+        player.queue.clear()
+    reset_guild_playback(guild_id)
+    for task in (player.prefetch_task, player.preload_task, player.track_end_worker):
+        if task is not None and not task.done() and task is not asyncio.current_task():
+            task.cancel()
+    players.discard(guild_id)
+    REAPED_OBJECTS.inc(kind="players")
+
+
+async def checkpoint_sessions() -> None:
+    """Periodically persist the playback position of every playing guild."""
+    while True:
+        await asyncio.sleep(SESSION_CHECKPOINT_SEC)
+        positions = []
+        for guild_id, player in players.items():
+            if player.playback_source is None:
+                continue
+            guild = bot.get_guild(guild_id)
+            vc = guild.voice_client if guild else None
+            if vc and vc.is_playing():
+                positions.append((guild_id, playback_position(guild_id)))
+        session_store.checkpoint(positions)
+
+
+async def restore_session(guild_id: int, channel_id: int, current: Optional[Track], position: float) -> None:
+    """Rejoin a stored voice channel and continue its queue where it stopped."""
+    guild = bot.get_guild(guild_id)
+    channel = guild.get_channel(channel_id) if guild else None
+    if not isinstance(channel, discord.VoiceChannel) or not any(not m.bot for m in channel.members):
+        log_voice_event("session_restore_skip", guild_id, channel_id=channel_id)
+        forget_session(guild_id)
+        return
+    queue = get_guild_queue(guild_id)
+    if guild.voice_client or not queue.empty():
+        # Someone already started a new session before we got here; make the
+        # stored rows match it instead of the old session.
+        if queue.journal:
+            queue.journal.replaced(list(queue))
+        return
+    keys, entries = await asyncio.to_thread(session_store.load_queue, guild_id)
+    if queue.journal:
+        queue.journal.seed(keys)
+    queue.restore(entries)
+    if current:
+        queue.insert(0, current)
+        players.get(guild_id).pending_resume = (current, position)
+    if queue.empty():
+        forget_session(guild_id)
+        return
+    players.get(guild_id).last_channel_id = channel_id
+    vc, error_code = await connect_voice_with_retries(guild, channel, reason="session_restore")
+    if not vc:
+        logger.warning("Session restore failed guild_id=%s error=%s", guild_id, error_code)
+        return
+    await play_next(guild)
+
+
+async def restore_sessions() -> None:
+    """Restore stored sessions in the background, a few guilds at a time."""
+    sessions = await asyncio.to_thread(session_store.load_sessions)
+    if not sessions:
+        return
+    logger.info("Session restore start count=%d", len(sessions))
+    semaphore = asyncio.Semaphore(SESSION_RESTORE_CONCURRENCY)
+
+    async def _restore(session) -> None:
+        async with semaphore:
+            try:
+                await restore_session(*session)
+            except Exception as restore_err:
+                logger.warning("Session restore error guild_id=%s error=%s", session[0], restore_err)
+
+    await asyncio.gather(*(_restore(s) for s in sessions))
+
+
+async def prefetch_upcoming(guild_id: int) -> None:
+    """Resolve the next QUEUE_PREFETCH_AHEAD entries so they start without a yt-dlp wait."""
+    entries = [e for e in get_guild_queue(guild_id).peek(QUEUE_PREFETCH_AHEAD) if e.needs_resolve()]
+    if not entries:
+        return
+    guild = bot.get_guild(guild_id)
+    target_kbps = voice_bitrate_kbps(guild) if guild else 0
+    pending = iter(entries)
+    async for _term, track in resolve_terms_in_order([e.term for e in entries], target_kbps=target_kbps):
+        entry = next(pending)
+        if track is not None:
+            entry.apply(track)
+
+
+def schedule_prefetch(guild_id: int) -> None:
+    """Start a background prefetch for a guild unless one is already running."""
+    if QUEUE_PREFETCH_AHEAD <= 0:
+        return
+    player = players.get(guild_id)
+    running = player.prefetch_task
+    if running and not running.done():
+        return
+
+    async def _run() -> None:
+        try:
+            await prefetch_upcoming(guild_id)
+        except Exception as prefetch_err:
+            logger.warning("Prefetch failed guild_id=%s error=%s", guild_id, prefetch_err)
+        finally:
+            if player.prefetch_task is asyncio.current_task():
+                player.prefetch_task = None
+
+    player.prefetch_task = asyncio.create_task(_run())
+
+
+# --------------------------------------------------------------
+# Spotify metadata cache
+# --------------------------------------------------------------
+@dataclass
+class SpotifyEntry:
+    """Search terms of a Spotify track, album or playlist as of ``fetched_at``."""
+    terms: List[str]
+    snapshot_id: str = ""
+    fetched_at: float = 0.0
+
+
+class SpotifyCache:
+    """Spotify metadata keyed by ``(kind, id)`` with an optional SQLite mirror.
+
+    Tracks and albums are served until ``ttl_sec`` passes. Playlists carry
+    their ``snapshot_id`` and stay valid as long as Spotify reports the same
+    snapshot, which needs one cheap request instead of fetching every item.
+    Tracks seen inside albums and playlists are stored under their own ID too.
+    Collections longer than ``MAX_COLLECTION_TERMS`` are not kept as a whole.
+    Single tracks have their own memory layer so that one page of a playlist
+    cannot evict the cached albums and playlists.
+    """
+
+    MAX_COLLECTION_TERMS = 1000
+
+    def __init__(
+        self,
+        capacity: int = 256,
+        track_capacity: int = 4096,
+        ttl_sec: float = SPOTIFY_CACHE_TTL_SEC,
+        db_path: Optional[str] = None,
+    ):
+        self.ttl_sec = ttl_sec
+        self._collections = TTLCache("spotify", capacity)
+        self._tracks = TTLCache("spotify_tracks", track_capacity)
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self.open_db(db_path)
+
+    def open_db(self, db_path: str) -> None:
         try:
-            # Populate cache in the background so autocomplete response stays immediate.
-            titles = await asyncio.wait_for(asyncio.to_thread(_fetch_titles), timeout=4.0)
-            autocomplete_cache[cache_key] = (time.monotonic(), titles)
-        except Exception:
-            pass
-        finally:
-            autocomplete_inflight.pop(cache_key, None)
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(db_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "kind TEXT NOT NULL, spotify_id TEXT NOT NULL, snapshot_id TEXT NOT NULL, "
+                "terms TEXT NOT NULL, fetched_at REAL NOT NULL, PRIMARY KEY (kind, spotify_id))"
+            )
+            db.execute(
+                "DELETE FROM entries WHERE kind != 'playlist' AND fetched_at < ?",
+                (time.time() - self.ttl_sec,),
+            )
+            db.commit()
+            self._db = db
+        except sqlite3.Error as db_err:
+            logger.warning("Spotify cache DB unavailable path=%s error=%s", db_path, db_err)
+            self._db = None
 
-    # Never block autocomplete on network I/O; return fast to avoid 10062 Unknown interaction.
-    if cache_key not in autocomplete_inflight:
-        autocomplete_inflight[cache_key] = asyncio.create_task(_populate_cache())
-    return []
-
-
-async def search_youtube(term: str) -> Optional[Tuple[str, str]]:
-    """Search YouTube using yt_dlp and return the first audio result (url, title)."""
-    ydl_opts = {
-        'format': 'bestaudio[ext=m4a]/bestaudio[acodec!=none]/best',
-        'quiet': True,
-        'noplaylist': True,
-        'extract_flat': False,
-        'skip_download': True,
-        # Prefer clients that usually expose direct media URLs over SABR-limited web formats.
-        'extractor_args': {
-            'youtube': {
-                'player_client': ['android', 'web'],
-            }
-        },
-    }
-    search_term = term if is_url(term) else f"ytsearch:{term}"
-    def _extract() -> object:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            return ydl.extract_info(search_term, download=False)
+    def __len__(self) -> int:
+        return len(self._collections) + len(self._tracks)
 
-    try:
-        info = await asyncio.wait_for(asyncio.to_thread(_extract), timeout=15.0)
-    except asyncio.TimeoutError:
-        logger.warning("yt-dlp search timeout term=%r", term)
-        return None
-    except Exception as e:
-        logger.error("yt-dlp search error term=%r error=%s", term, e)
-        return None
-    # Normalise entries
-    entries = info.get('entries', [info])
-    if not entries:
-        return None
-    entry = entries[0]
-    # Let yt-dlp provide the final selected URL first; manual format fallback only if needed.
-    audio_url = entry.get('url')
-    if not audio_url:
-        formats = entry.get('formats', [])
-        audio_formats = [
-            f for f in formats
-            if f.get('acodec') != 'none'
-            and f.get('vcodec') == 'none'
-            and f.get('url')
-            and f.get('protocol') not in {'m3u8', 'http_dash_segments'}
-        ]
-        if audio_formats:
-            audio_formats.sort(key=lambda f: f.get('abr') or f.get('asr') or 0, reverse=True)
-            audio_url = audio_formats[0]['url']
-        else:
+    def _memory(self, kind: str) -> TTLCache:
+        return self._tracks if kind == "track" else self._collections
+
+    def is_fresh(self, kind: str, entry: SpotifyEntry, now: Optional[float] = None) -> bool:
+        """Playlists are checked by snapshot instead; everything else ages out."""
+        now = time.time() if now is None else now
+        return kind == "playlist" or now - entry.fetched_at < self.ttl_sec
+
+    def _load_from_db(self, kind: str, spotify_id: str) -> Optional[SpotifyEntry]:
+        if not self._db:
+            return None
+        with self._db_lock:
+            try:
+                row = self._db.execute(
+                    "SELECT terms, snapshot_id, fetched_at FROM entries WHERE kind = ? AND spotify_id = ?",
+                    (kind, spotify_id),
+                ).fetchone()
+            except sqlite3.Error as db_err:
+                logger.warning("Spotify cache DB read failed error=%s", db_err)
+                return None
+        if not row:
+            return None
+        return SpotifyEntry(terms=json.loads(row[0]), snapshot_id=row[1], fetched_at=row[2])
+
+    def _store_in_db(self, rows: List[tuple]) -> None:
+        with self._db_lock:
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO entries (kind, spotify_id, snapshot_id, terms, fetched_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._db.commit()
+            except sqlite3.Error as db_err:
+                logger.warning("Spotify cache DB write failed error=%s", db_err)
+
+    async def get(self, kind: str, spotify_id: str) -> Optional[SpotifyEntry]:
+        """Return the cached entry unless it has expired; playlists still need a snapshot check."""
+        memory = self._memory(kind)
+        entry = memory.get((kind, spotify_id))
+        if entry is None and self._db:
+            entry = await asyncio.to_thread(self._load_from_db, kind, spotify_id)
+            if entry is not None:
+                memory.put((kind, spotify_id), entry)
+        if entry is None or not self.is_fresh(kind, entry):
             return None
-    title = entry.get('title', 'Ismeretlen')
-    return audio_url, title
+        return entry
+
+    async def put(self, kind: str, spotify_id: str, terms: List[str], snapshot_id: str = "") -> SpotifyEntry:
+        """Store the terms of a track or of a whole album/playlist."""
+        now = time.time()
+        entry = SpotifyEntry(terms=terms, snapshot_id=snapshot_id, fetched_at=now)
+        self._memory(kind).put((kind, spotify_id), entry)
+        if self._db:
+            await asyncio.to_thread(self._store_in_db, [(kind, spotify_id, snapshot_id, json.dumps(terms), now)])
+        return entry
+
+    async def put_tracks(self, track_terms: dict) -> None:
+        """Store tracks seen inside a collection page (track ID -> term) under their own ID."""
+        now = time.time()
+        rows = []
+        for track_id, term in track_terms.items():
+            self._tracks.put(("track", track_id), SpotifyEntry(terms=[term], fetched_at=now))
+            rows.append(("track", track_id, "", json.dumps([term]), now))
+        if self._db and rows:
+            await asyncio.to_thread(self._store_in_db, rows)
+
+
+# The SQLite mirror is attached by open_stores() once the bot starts.
+spotify_cache = SpotifyCache()
+
+
+# Largest page the Spotify Web API returns per request.
+SPOTIFY_PAGE_LIMITS = {"album": 50, "playlist": 100}
+
+
+def spotify_search_term(track: dict) -> str:
+    artists = ', '.join(artist['name'] for artist in track['artists'])
+    return f"{track['name']} {artists}"
 
 
 def parse_spotify_id(url: str) -> Optional[Tuple[str, str]]:
@@ -507,54 +3195,177 @@ def parse_spotify_id(url: str) -> Optional[Tuple[str, str]]:
     return match.group(1), match.group(2)
 
 
-async def get_spotify_tracks(url: str) -> List[str]:
-    """Given a Spotify URL, return a list of track names with artist for searching."""
-    result: List[str] = []
+async def spotify_call(kind: str, func, *args, **kwargs):
+    """Run one blocking Spotify API call off the loop, traced and timed."""
+    started = time.monotonic()
+    with trace_span("spotify.fetch", kind=kind, call=func.__name__):
+        try:
+            result = await asyncio.wait_for(asyncio.to_thread(func, *args, **kwargs), timeout=15.0)
+        except Exception:
+            SPOTIFY_FETCH_SECONDS.observe(time.monotonic() - started, kind=kind, outcome="error")
+            raise
+    SPOTIFY_FETCH_SECONDS.observe(time.monotonic() - started, kind=kind, outcome="ok")
+    return result
+
+
+async def iter_spotify_tracks(url: str, max_tracks: int = SPOTIFY_MAX_TRACKS) -> AsyncIterator[List[str]]:
+    """Yield search terms ("name artists") of a Spotify link one page at a time.
+
+    The next page is only requested when the consumer asks for it, so the
+    first page can be queued and playing while the rest loads, and no more
+    than one page is held here. At most ``max_tracks`` terms are yielded.
+    Fresh albums and unchanged playlists are replayed from ``spotify_cache``.
+    """
     if not SPOTIFY_CLIENT:
-        return result
+        return
     parsed = parse_spotify_id(url)
     if not parsed:
-        return result
+        return
     content_type, spotify_id = parsed
-    def _fetch_tracks() -> List[str]:
-        local_result: List[str] = []
+    fetched = 0
+    try:
+        cached = await spotify_cache.get(content_type, spotify_id)
+        snapshot_id = ""
+        if content_type == 'playlist':
+            playlist = await spotify_call(content_type, SPOTIFY_CLIENT.playlist, spotify_id, fields='snapshot_id')
+            snapshot_id = playlist.get('snapshot_id') or ""
+            if cached is not None and snapshot_id and cached.snapshot_id == snapshot_id:
+                logger.info("Spotify playlist unchanged id=%s snapshot=%s", spotify_id, snapshot_id)
+            else:
+                cached = None
+        if cached is not None:
+            SPOTIFY_FETCH_SECONDS.observe(0.0, kind=content_type, outcome="cached")
+            terms = cached.terms[:max_tracks]
+            for page_start in range(0, len(terms), SPOTIFY_PAGE_LIMITS["playlist"]):
+                yield terms[page_start:page_start + SPOTIFY_PAGE_LIMITS["playlist"]]
+            return
         if content_type == 'track':
-            track = SPOTIFY_CLIENT.track(spotify_id)
-            name = track['name']
-            artists = ', '.join(artist['name'] for artist in track['artists'])
-            local_result.append(f"{name} {artists}")
-        elif content_type == 'album':
-            album_tracks = SPOTIFY_CLIENT.album_tracks(spotify_id)
-            for item in album_tracks['items']:
-                name = item['name']
-                artists = ', '.join(artist['name'] for artist in item['artists'])
-                local_result.append(f"{name} {artists}")
-        elif content_type == 'playlist':
-            # limit to first 50 tracks to prevent huge queues
-            playlist_tracks = SPOTIFY_CLIENT.playlist_items(
-                spotify_id,
-                fields='items(track(name,artists(name)))',
-                additional_types=['track'],
-                limit=50
-            )
-            for item in playlist_tracks['items']:
-                track = item['track']
-                if track:
-                    name = track['name']
-                    artists = ', '.join(a['name'] for a in track['artists'])
-                    local_result.append(f"{name} {artists}")
-        return local_result
+            term = spotify_search_term(await spotify_call(content_type, SPOTIFY_CLIENT.track, spotify_id))
+            await spotify_cache.put('track', spotify_id, [term])
+            yield [term]
+            return
 
-    try:
-        result = await asyncio.wait_for(asyncio.to_thread(_fetch_tracks), timeout=15.0)
+        # Whole collections are only cached while small; larger ones are streamed every time.
+        collected: Optional[List[str]] = []
+        complete = False
+        offset = 0
+        while fetched < max_tracks:
+            limit = min(SPOTIFY_PAGE_LIMITS[content_type], max_tracks - fetched)
+            if content_type == 'playlist':
+                page = await spotify_call(
+                    content_type,
+                    SPOTIFY_CLIENT.playlist_items,
+                    spotify_id,
+                    fields='items(track(id,name,artists(name))),next',
+                    additional_types=['track'],
+                    limit=limit,
+                    offset=offset,
+                )
+            else:
+                page = await spotify_call(content_type, SPOTIFY_CLIENT.album_tracks, spotify_id, limit=limit, offset=offset)
+            items = page.get('items') or []
+            offset += len(items)
+            terms: List[str] = []
+            track_terms: dict = {}
+            for item in items:
+                track = item.get('track') if content_type == 'playlist' else item
+                # Removed tracks come back as null, local files without a name.
+                if not track or not track.get('name'):
+                    continue
+                term = spotify_search_term(track)
+                terms.append(term)
+                if track.get('id'):
+                    track_terms[track['id']] = term
+            if track_terms:
+                await spotify_cache.put_tracks(track_terms)
+            if collected is not None:
+                collected.extend(terms)
+                if len(collected) > SpotifyCache.MAX_COLLECTION_TERMS:
+                    collected = None
+            if terms:
+                fetched += len(terms)
+                yield terms
+            if not items or not page.get('next'):
+                complete = True
+                break
+        if not complete:
+            logger.info("Spotify import capped kind=%s id=%s max_tracks=%d", content_type, spotify_id, max_tracks)
+        elif collected:
+            await spotify_cache.put(content_type, spotify_id, collected, snapshot_id)
     except Exception as e:
-        logger.warning("Spotify fetch failed error=%s", e)
-    return result
+        logger.warning("Spotify fetch failed kind=%s id=%s fetched=%d error=%s", content_type, spotify_id, fetched, e)
+
+
+async def resolve_terms_in_order(
+    terms: Iterable[str],
+    concurrency: int = SPOTIFY_RESOLVE_CONCURRENCY,
+    target_kbps: int = 0,
+) -> AsyncIterator[Tuple[str, Optional[ResolvedTrack]]]:
+    """Resolve search terms concurrently but yield results in the original order.
+
+    At most ``concurrency`` resolutions run at once, and only a small window of
+    tasks is kept ahead of the consumer so long lists stay memory-bounded.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _resolve(term: str) -> Optional[ResolvedTrack]:
+        async with semaphore:
+            return await resolve_track(term, target_kbps)
+
+    window: "deque[Tuple[str, asyncio.Task]]" = deque()
+    term_iter = iter(terms)
+    window_size = concurrency * 2
+    try:
+        while True:
+            while len(window) < window_size:
+                term = next(term_iter, None)
+                if term is None:
+                    break
+                window.append((term, asyncio.create_task(_resolve(term))))
+            if not window:
+                return
+            term, task = window.popleft()
+            yield term, await task
+    finally:
+        for _, task in window:
+            task.cancel()
+
+
+async def seed_suggestion_index() -> None:
+    """Index titles already in the track cache so autocomplete has answers right after a restart."""
+    titles = await asyncio.to_thread(track_cache.stored_titles)
+    for title in titles:
+        suggestion_index.add(title)
+    logger.info("Autocomplete index seeded titles=%d", len(suggestion_index))
 
 
 @bot.event
 async def on_ready():
     logger.info("Bot elindult user=%s", bot.user)
+    global session_tasks_started, metrics_runner, trace_flusher_started, loop_watchdog_started, reaper_started
+    global stores_opened
+    if not stores_opened:
+        stores_opened = True
+        open_stores()
+    if isinstance(extract_backend, ProcessExtractPool):
+        extract_backend.warm_up()
+    if not reaper_started:
+        reaper_started = True
+        bot.loop.create_task(run_reaper())
+        bot.loop.create_task(seed_suggestion_index())
+    if loop_watchdog and not loop_watchdog_started:
+        loop_watchdog_started = True
+        bot.loop.create_task(loop_watchdog.run())
+    if METRICS_PORT and metrics_runner is None:
+        metrics_runner = await start_metrics_server()
+    if span_exporter and not trace_flusher_started:
+        trace_flusher_started = True
+        bot.loop.create_task(span_exporter.run())
+    if session_store and not session_tasks_started:
+        # on_ready fires again after reconnects; restore only once per process.
+        session_tasks_started = True
+        bot.loop.create_task(restore_sessions())
+        bot.loop.create_task(checkpoint_sessions())
     try:
         # Keep a global registration for portability across guilds.
         # If a guild ID is configured, sync that too for faster propagation there.
@@ -578,6 +3389,31 @@ async def safe_send(target: object, message: str):
         logger.warning("safe_send failed error=%s", send_err)
 
 
+async def send_status(target: object, message: str) -> Optional[discord.Message]:
+    """Send a message that can be edited later (e.g. for progress updates)."""
+    try:
+        return await target.send(message)  # type: ignore[attr-defined]
+    except AttributeError:
+        try:
+            return await target.followup.send(message, wait=True)  # type: ignore[attr-defined]
+        except Exception as send_err:
+            logger.warning("send_status failed error=%s", send_err)
+    except Exception as send_err:
+        logger.warning("send_status failed error=%s", send_err)
+    return None
+
+
+async def edit_status(target: object, status: Optional[discord.Message], message: str):
+    """Edit a status message in place, falling back to sending a new one."""
+    if status is not None:
+        try:
+            await status.edit(content=message)
+            return
+        except Exception as edit_err:
+            logger.warning("edit_status failed error=%s", edit_err)
+    await safe_send(target, message)
+
+
 async def ensure_voice_connection(guild: discord.Guild, target: Optional[object] = None) -> Optional[discord.VoiceClient]:
     """Ensure active voice connection, attempting reconnect to last known channel."""
     if is_intentional_voice_disconnect_active(guild.id):
@@ -585,10 +3421,11 @@ async def ensure_voice_connection(guild: discord.Guild, target: Optional[object]
     vc = guild.voice_client
     if vc and vc.is_connected():
         if vc.channel:
-            last_voice_channel_id[guild.id] = vc.channel.id
+            players.get(guild.id).last_channel_id = vc.channel.id
         return vc
 
-    channel_id = last_voice_channel_id.get(guild.id)
+    player = players.peek(guild.id)
+    channel_id = player.last_channel_id if player else None
     channel = guild.get_channel(channel_id) if channel_id else None
     if not isinstance(channel, (discord.VoiceChannel, discord.StageChannel)):
         return None
@@ -602,31 +3439,374 @@ async def ensure_voice_connection(guild: discord.Guild, target: Optional[object]
 
 
 
-async def start_track(guild: discord.Guild, url: str, title: str, target: object, announce: bool = True) -> bool:
-    """Start playing one track and wire an error-tolerant after callback."""
-    vc = await ensure_voice_connection(guild, target)
-    if not vc:
-        return False
-    if not FFMPEG_EXE:
-        logger.error("FFmpeg nincs telepitve vagy nem talalhato.")
-        return False
+FFMPEG_BEFORE_OPTIONS = (
+    "-reconnect 1 -reconnect_streamed 1 -reconnect_at_eof 1 "
+    "-reconnect_on_network_error 1 -reconnect_delay_max 5 -nostdin"
+)
+
+
+OPUS_CODECS = {"opus", "libopus"}
+
+
+def is_opus_codec(codec: str) -> bool:
+    """True for codec names yt-dlp/ffprobe report for Opus audio."""
+    return codec.lower() in OPUS_CODECS
+
+
+async def ensure_codec_known(track: ResolvedTrack) -> str:
+    """Probe the stream codec when yt-dlp did not report it, caching the answer on the track."""
+    if track.acodec or AUDIO_PIPELINE != "opus" or not FFMPEG_EXE:
+        return track.acodec
+    codec, _bitrate = await discord.FFmpegOpusAudio.probe(
+        track.stream_url, method="fallback", executable=FFMPEG_EXE
+    )
+    # Remember failed probes too so every replay does not pay for another probe.
+    track.acodec = codec or "unknown"
+    return track.acodec
+
+
+async def playback_location(track: ResolvedTrack) -> Tuple[str, str]:
+    """Return the FFmpeg input and its codec: a cached local file if present, else the stream URL."""
+    if audio_cache:
+        local_path = await audio_cache.lookup(track.video_id)
+        if local_path:
+            return local_path, "opus"
+        await audio_cache.record_play(track)
+    return track.stream_url, await ensure_codec_known(track)
+
+
+class StreamErrorLog:
+    """File-like sink for FFmpeg's stderr that keeps the tail for diagnosis.
+
+    It has no ``fileno``, so discord.py pipes stderr into it from a reader
+    thread. The tail is used to tell expired or IP-bound stream URLs (HTTP
+    403/410) from other failures.
+    """
 
-    source = discord.FFmpegPCMAudio(
+    MAX_BYTES = 4096
+    REJECTED_PATTERN = re.compile(r'(?:HTTP error|Server returned) (403|410|4XX)')
+
+    def __init__(self) -> None:
+        self._tail = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._tail += data
+        del self._tail[:-self.MAX_BYTES]
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def text(self) -> str:
+        return self._tail.decode(errors="ignore")
+
+    def rejected(self) -> bool:
+        """True when the server refused the stream URL itself."""
+        return bool(self.REJECTED_PATTERN.search(self.text()))
+
+
+def create_audio_source(
+    url: str,
+    codec: str = "",
+    bitrate_kbps: int = 0,
+    start_at: float = 0.0,
+    stderr: Optional[StreamErrorLog] = None,
+) -> discord.AudioSource:
+    """Spawn the FFmpeg process for a stream URL.
+
+    Opus inputs are stream-copied into Opus packets so neither FFmpeg nor
+    discord.py re-encodes them; other codecs are encoded to Opus inside FFmpeg
+    at the voice channel bitrate.
+    PCM with Python-side encoding is only used as a fallback.
+    ``start_at`` seeks the input so a resumed track does not start over.
+    """
+    # Reconnect flags only apply to network inputs, not audio cache files.
+    before_options = FFMPEG_BEFORE_OPTIONS if is_url(url) else "-nostdin"
+    if start_at > 0:
+        before_options = f"-ss {start_at:.2f} {before_options}"
+    if AUDIO_PIPELINE == "opus":
+        try:
+            return discord.FFmpegOpusAudio(
+                url,
+                codec="copy" if is_opus_codec(codec) else None,
+                bitrate=min(max(bitrate_kbps, 32), 512) if bitrate_kbps else None,
+                executable=FFMPEG_EXE,
+                before_options=before_options,
+                options="-vn -loglevel error",
+                stderr=stderr,
+            )
+        except Exception as opus_err:
+            logger.warning("Opus pipeline unavailable, falling back to PCM error=%s", opus_err)
+    return discord.FFmpegPCMAudio(
         url,
         executable=FFMPEG_EXE,
-        before_options=(
-            "-reconnect 1 -reconnect_streamed 1 -reconnect_at_eof 1 "
-            "-reconnect_on_network_error 1 -reconnect_delay_max 5 -nostdin"
-        ),
-        options="-vn -loglevel panic"
+        before_options=before_options,
+        options="-vn -loglevel error",
+        stderr=stderr,
     )
 
+
+class PreloadedSource(discord.AudioSource):
+    """An FFmpeg source spawned ahead of time with its first frames already buffered."""
+
+    def __init__(
+        self,
+        original: discord.AudioSource,
+        location: str = "",
+        codec: str = "",
+        error_log: Optional[StreamErrorLog] = None,
+    ):
+        self.original = original
+        self.location = location
+        self.codec = codec
+        self.error_log = error_log
+        self._buffer: "deque[bytes]" = deque()
+
+    def prime(self, frames: int = PRELOAD_PRIME_FRAMES) -> bool:
+        """Blocking: read the first frames so the network fetch happens before playback."""
+        for _ in range(frames):
+            data = self.original.read()
+            if not data:
+                break
+            self._buffer.append(data)
+        return bool(self._buffer)
+
+    @property
+    def _current_error(self) -> Optional[Exception]:
+        # discord.py's player inspects this to report FFmpeg failures.
+        return getattr(self.original, "_current_error", None)
+
+    def read(self) -> bytes:
+        if self._buffer:
+            return self._buffer.popleft()
+        return self.original.read()
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    def cleanup(self) -> None:
+        self._buffer.clear()
+        self.original.cleanup()
+
+
+class TrackedSource(discord.AudioSource):
+    """Counts the 20 ms frames handed to the voice client to know the playback position.
+
+    Pauses stop the player from reading, so the count only covers audio that
+    was actually sent. ``start_at`` is the offset the source was seeked to.
+    """
+
+    FRAME_SECONDS = discord.opus.Encoder.FRAME_LENGTH / 1000
+
+    def __init__(
+        self,
+        original: discord.AudioSource,
+        start_at: float = 0.0,
+        error_log: Optional[StreamErrorLog] = None,
+        requested_at: Optional[float] = None,
+        first_audio_span=NOOP_SPAN,
+    ):
+        self.original = original
+        self.start_at = start_at
+        self.error_log = error_log
+        self.requested_at = requested_at
+        self.first_audio_span = first_audio_span
+        self.frames = 0
+
+    @property
+    def position(self) -> float:
+        return self.start_at + self.frames * self.FRAME_SECONDS
+
+    @property
+    def _current_error(self) -> Optional[Exception]:
+        return getattr(self.original, "_current_error", None)
+
+    def read(self) -> bytes:
+        data = self.original.read()
+        if data:
+            if self.frames == 0:
+                self.first_audio_span.end()
+                if self.requested_at is not None:
+                    FIRST_AUDIO_SECONDS.observe(
+                        time.monotonic() - self.requested_at, kind="resume" if self.start_at else "start"
+                    )
+            self.frames += 1
+        return data
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    def cleanup(self) -> None:
+        # Close the first-audio span even if FFmpeg never produced a frame.
+        self.first_audio_span.set(frames=self.frames)
+        self.first_audio_span.end()
+        self.original.cleanup()
+
+
+def playback_position(guild_id: int) -> float:
+    """Seconds into the track currently playing in a guild, from sent frames."""
+    player = players.peek(guild_id)
+    source = player.playback_source if player else None
+    return source.position if source else 0.0
+
+
+def reset_guild_playback(guild_id: int, forget: bool = True) -> None:
+    """Clear now-playing state, kill any preloaded source and set the player idle.
+
+    With ``forget`` the persisted session is dropped too, for intentional stops.
+    """
+    discard_preload(guild_id)
+    player = players.peek(guild_id)
+    if player is not None:
+        player.reset_playback()
+    if forget:
+        forget_session(guild_id)
+
+
+def discard_preload(guild_id: int) -> None:
+    """Cancel a pending preload and kill an already primed FFmpeg source."""
+    player = players.peek(guild_id)
+    if player is None:
+        return
+    task, player.preload_task = player.preload_task, None
+    if task and not task.done() and task is not asyncio.current_task():
+        task.cancel()
+    preloaded, player.preloaded = player.preloaded, None
+    if preloaded:
+        preloaded[1].cleanup()
+
+
+def take_preloaded_source(guild_id: int, entry: "Track") -> Optional[PreloadedSource]:
+    """Hand out the primed source if it belongs to ``entry``; otherwise clean it up."""
+    player = players.peek(guild_id)
+    preloaded = player.preloaded if player else None
+    if not preloaded:
+        return None
+    player.preloaded = None
+    preloaded_entry, source = preloaded
+    if preloaded_entry is entry and entry.resolved and entry.resolved.is_fresh():
+        return source
+    source.cleanup()
+    return None
+
+
+async def preload_next(guild: discord.Guild) -> None:
+    """Resolve the head of the queue and spawn plus prime its FFmpeg source."""
+    upcoming = get_guild_queue(guild.id).peek(1)
+    if not upcoming or not FFMPEG_EXE:
+        return
+    entry = upcoming[0]
+    resolved = await resolve_entry(entry, voice_bitrate_kbps(guild))
+    if not resolved:
+        return
+
+    location, codec = await playback_location(resolved)
+    bitrate_kbps = voice_bitrate_kbps(guild)
+    error_log = StreamErrorLog()
+
+    def _spawn_and_prime() -> Optional[PreloadedSource]:
+        original = create_audio_source(location, codec, bitrate_kbps, stderr=error_log)
+        source = PreloadedSource(original, location, codec, error_log)
+        if source.prime():
+            return source
+        source.cleanup()
+        return None
+
+    source = await asyncio.to_thread(_spawn_and_prime)
+    if source is None:
+        if error_log.rejected():
+            # Fix the URL now so the track does not fail once it is its turn.
+            await refresh_stream(entry, bitrate_kbps)
+        return
+    # The queue may have changed while FFmpeg was starting.
+    head = get_guild_queue(guild.id).peek(1)
+    if not head or head[0] is not entry:
+        source.cleanup()
+        return
+    player = players.get(guild.id)
+    previous, player.preloaded = player.preloaded, (entry, source)
+    if previous:
+        previous[1].cleanup()
+    logger.debug("Preloaded next track guild_id=%s title=%r", guild.id, resolved.title)
+
+
+def schedule_preload(guild: discord.Guild, duration: int) -> None:
+    """Preload the next entry PRELOAD_LEAD_SEC before the current track ends.
+
+    Only time spent actually playing is counted, so pauses delay the preload.
+    Tracks with unknown duration are not preloaded.
+    """
+    discard_preload(guild.id)
+    if duration <= 0:
+        return
+    player = players.get(guild.id)
+
+    async def _run() -> None:
+        try:
+            played = 0.0
+            while played < duration - PRELOAD_LEAD_SEC:
+                await asyncio.sleep(1.0)
+                vc = guild.voice_client
+                if not vc or not vc.is_connected():
+                    return
+                if vc.is_playing():
+                    played += 1.0
+            await preload_next(guild)
+        except asyncio.CancelledError:
+            raise
+        except Exception as preload_err:
+            logger.warning("Preload failed guild_id=%s error=%s", guild.id, preload_err)
+        finally:
+            if player.preload_task is asyncio.current_task():
+                player.preload_task = None
+
+    player.preload_task = asyncio.create_task(_run())
+
+
+@traced("start_track")
+async def start_track(
+    guild: discord.Guild,
+    url: str,
+    title: str,
+    target: object,
+    announce: bool = True,
+    source: Optional[discord.AudioSource] = None,
+    duration: int = 0,
+    codec: str = "",
+    start_at: float = 0.0,
+    entry: Optional[Track] = None,
+    requested_at: Optional[float] = None,
+) -> bool:
+    """Start playing one track and wire an error-tolerant after callback.
+
+    ``requested_at`` is when the track was picked, for the time-to-first-audio
+    metric; it defaults to now.
+    """
+    requested_at = requested_at if requested_at is not None else time.monotonic()
+    vc = await ensure_voice_connection(guild, target)
+    if not vc or not FFMPEG_EXE:
+        if source:
+            source.cleanup()
+        if not FFMPEG_EXE:
+            logger.error("FFmpeg nincs telepitve vagy nem talalhato.")
+        return False
+
+    annotate_span(preloaded=source is not None, codec=codec or "unknown", start_at=round(start_at, 1))
+    if source is None:
+        error_log = StreamErrorLog()
+        with trace_span("ffmpeg.spawn"):
+            source = create_audio_source(url, codec, voice_bitrate_kbps(guild), start_at, stderr=error_log)
+    else:
+        error_log = getattr(source, "error_log", None)
+    source = TrackedSource(source, start_at, error_log, requested_at, start_span("ffmpeg.first_audio"))
+
     def after(error):
-        fut = asyncio.run_coroutine_threadsafe(handle_track_end(guild, error), bot.loop)
+        # Runs on discord.py's audio player thread: hand off and return at once.
         try:
-            fut.result()
-        except Exception as exc:
-            logger.error("Track end callback hiba error=%s", exc)
+            bot.loop.call_soon_threadsafe(dispatch_track_end, guild, error)
+        except RuntimeError as exc:
+            # Loop already closed during shutdown.
+            logger.debug("Track end dropped guild_id=%s error=%s", guild.id, exc)
 
     try:
         vc.play(source, after=after)
@@ -635,29 +3815,122 @@ async def start_track(guild: discord.Guild, url: str, title: str, target: object
         source.cleanup()
         return False
 
-    now_playing[guild.id] = title
-    current_track[guild.id] = (url, title, target)
-    if announce:
+    player = players.get(guild.id)
+    player.now_playing = title
+    player.current = (url, title, target, codec, entry)
+    player.playback_source = source
+    player.interrupted = None
+    player.transition(PlayerState.PLAYING)
+    schedule_preload(guild, max(duration - int(start_at), 0) if duration else 0)
+    if announce and target is not None:
         await safe_send(target, f"🎶 Most játszom: **{title}**")
     return True
 
 
+async def resume_current_track(
+    guild: discord.Guild,
+    track: Tuple[str, str, object, str, Optional[Track]],
+    cause: str = "track_error",
+    position: Optional[float] = None,
+) -> bool:
+    """Restart the current track where it stopped instead of from 0:00.
+
+    ``position`` defaults to the frames sent by the source that just stopped.
+
+    FFmpeg seeks the input with ``-ss``, which for streams is an HTTP range
+    request, so the part already played is not downloaded again. A stream URL
+    that expired or was refused with HTTP 403/410 is re-resolved first, since
+    retrying it can never succeed.
+    """
+    location, title, target, codec, entry = track
+    player = players.peek(guild.id)
+    playing = player.playback_source if player else None
+    if position is None:
+        position = playback_position(guild.id)
+    rejected = bool(playing and playing.error_log and playing.error_log.rejected())
+    if entry is not None and is_url(location) and (rejected or entry.needs_resolve()):
+        logger.info("Stream URL unusable, re-resolving title=%r rejected=%s", title, rejected)
+        resolved = await refresh_stream(entry, voice_bitrate_kbps(guild))
+        if resolved is None:
+            RECOVERY_ATTEMPTS.inc(cause=cause, outcome="unresolvable")
+            return False
+        location, codec = resolved.stream_url, await ensure_codec_known(resolved)
+    logger.info("Track resume guild_id=%s position=%.1f", guild.id, position)
+    ok = await start_track(
+        guild, location, title, target, announce=False, codec=codec, start_at=position, entry=entry
+    )
+    RECOVERY_ATTEMPTS.inc(cause=cause, outcome="ok" if ok else "failed")
+    return ok
+
+
+TRACK_END_ERRORS = Counter("dcbot_track_end_errors_total", "Track-end handlers that raised.")
+
+
+def dispatch_track_end(guild: discord.Guild, error: Optional[Exception]) -> None:
+    """Queue a track-end event; one worker per guild handles them in arrival order.
+
+    Called on the event loop via call_soon_threadsafe, so the audio player
+    thread never waits for recovery sleeps, reconnects or the next track.
+    """
+    player = players.get(guild.id)
+    if player.track_end_events is None:
+        player.track_end_events = deque()
+    player.track_end_events.append(error)
+    worker = player.track_end_worker
+    if worker is None or worker.done():
+        player.track_end_worker = asyncio.create_task(drain_track_end_events(guild))
+
+
+async def drain_track_end_events(guild: discord.Guild) -> None:
+    player = players.get(guild.id)
+    events = player.track_end_events
+    try:
+        while events:
+            error = events.popleft()
+            try:
+                await handle_track_end(guild, error)
+            except Exception as exc:
+                TRACK_END_ERRORS.inc()
+                logger.error("Track end kezelesi hiba guild_id=%s error=%s", guild.id, exc, exc_info=True)
+    finally:
+        # No await between the emptiness check and here, so no event can be missed.
+        player.track_end_events = None
+        if player.track_end_worker is asyncio.current_task():
+            player.track_end_worker = None
+
+
 async def handle_track_end(guild: discord.Guild, error: Optional[Exception]):
-    """Handle playback completion and retry current track on transient errors."""
+    """Handle playback completion and retry current track on transient errors.
+
+    discord.py stops the player when the voice connection drops, which looks
+    like a clean track end. That track and its position are kept for
+    on_voice_state_update to resume instead of skipping to the next song.
+    """
+    vc = guild.voice_client
+    player = players.get(guild.id)
+    if (
+        error is None
+        and player.current
+        and not (vc and vc.is_connected())
+        and not is_intentional_voice_disconnect_active(guild.id)
+    ):
+        player.interrupted = (player.current, playback_position(guild.id))
+        log_voice_event("track_interrupted", guild.id, channel_id=player.last_channel_id)
+        return
     if error:
         logger.warning("Lejatszasi hiba error=%s", error)
-        track = current_track.get(guild.id)
+        track = player.current
         if track:
-            attempts = track_recovery_attempts.get(guild.id, 0)
+            attempts = player.recovery_attempts or 0
             if attempts < MAX_TRACK_RECOVERY_ATTEMPTS:
-                track_recovery_attempts[guild.id] = attempts + 1
+                player.recovery_attempts = attempts + 1
+                player.transition(PlayerState.RECOVERING)
                 await asyncio.sleep(1.5)
-                ok = await start_track(guild, track[0], track[1], track[2], announce=False)
+                ok = await resume_current_track(guild, track, cause="track_error")
                 if ok:
                     return
 
-    current_track.pop(guild.id, None)
-    track_recovery_attempts.pop(guild.id, None)
+    player.reset_playback()
     await play_next(guild)
 
 
@@ -669,6 +3942,51 @@ async def retry_play_next_later(guild: discord.Guild, delay_seconds: float = 2.0
     await play_next(guild)
 
 
+async def enqueue_spotify_tracks(
+    guild: discord.Guild,
+    target: object,
+    pages: AsyncIterator[List[str]],
+    status: Optional[discord.Message],
+) -> int:
+    """Enqueue Spotify tracks page by page in playlist order and report the result.
+
+    Entries only carry the search term; playback resolves the head entry and the
+    prefetcher resolves the next few while the current track plays. Playback
+    starts after the first page while later pages are still being fetched, and
+    the import stops if the bot leaves the voice channel meanwhile. The status
+    message is edited into the summary. Returns the number of queued tracks.
+    """
+    queue = get_guild_queue(guild.id)
+    preview: List[str] = []
+    total = 0
+    async for page in pages:
+        if total and guild.voice_client is None:
+            logger.info("Spotify import stopped guild_id=%s queued=%d reason=voice_left", guild.id, total)
+            await pages.aclose()
+            break
+        queue.extend(Track.from_target(term, term, target) for term in page)
+        preview.extend(page[:5 - len(preview)])
+        first_page = total == 0
+        total += len(page)
+        vc = guild.voice_client
+        if vc and not vc.is_playing() and not vc.is_paused():
+            await play_next(guild)
+        else:
+            schedule_prefetch(guild.id)
+        if first_page and total > 1:
+            await edit_status(target, status, f"✅ {total} szám hozzáadva, a többi betöltése folyamatban...")
+
+    if total == 1:
+        await edit_status(target, status, f"✅ Hozzáadva: **{preview[0]}**")
+    elif total:
+        lines = [f"✅ {total} szám hozzáadva a várólistához."]
+        lines.extend(f"+ {t}" for t in preview)
+        if total > 5:
+            lines.append(f"...és {total - 5} további.")
+        await edit_status(target, status, "\n".join(lines))
+    return total
+
+
 @bot.tree.error
 async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
     global last_resync_ts
@@ -695,6 +4013,12 @@ async def on_app_command_error(interaction: discord.Interaction, error: app_comm
     logger.error("App command hiba error=%s", error)
 
 
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    logger.info("Guild removed guild_id=%s", guild.id)
+    await release_guild(guild.id)
+
+
 @bot.event
 async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
     # Keep last known channel for bot reconnect attempts.
@@ -702,26 +4026,35 @@ async def on_voice_state_update(member: discord.Member, before: discord.VoiceSta
         return
     guild = member.guild
     if after.channel:
-        last_voice_channel_id[guild.id] = after.channel.id
+        players.get(guild.id).last_channel_id = after.channel.id
         return
     if before.channel and after.channel is None:
         if is_intentional_voice_disconnect_active(guild.id):
             log_voice_event("intentional_disconnect_skip_recovery", guild.id, channel_id=before.channel.id)
             return
+        player = players.get(guild.id)
         queue = get_guild_queue(guild.id)
         # If playback/queue exists, reconnect and continue automatically.
-        if guild.id in current_track or not queue.empty():
+        if player.current is not None or not queue.empty():
             await asyncio.sleep(2)
             vc = await ensure_voice_connection(guild)
-            if vc and not vc.is_playing() and not vc.is_paused():
-                track = current_track.get(guild.id)
+            if not vc:
+                # Nothing will resume the interrupted track; let the player go idle.
+                log_voice_event("reconnect_gave_up", guild.id, channel_id=before.channel.id)
+                reset_guild_playback(guild.id, forget=False)
+                return
+            if not vc.is_playing() and not vc.is_paused():
+                track, position = player.interrupted or (player.current, None)
+                player.interrupted = None
                 if track:
-                    attempts = track_recovery_attempts.get(guild.id, 0)
+                    attempts = player.recovery_attempts or 0
                     if attempts < MAX_TRACK_RECOVERY_ATTEMPTS:
-                        track_recovery_attempts[guild.id] = attempts + 1
-                        ok = await start_track(guild, track[0], track[1], track[2], announce=False)
+                        player.recovery_attempts = attempts + 1
+                        player.transition(PlayerState.RECOVERING)
+                        ok = await resume_current_track(guild, track, cause="reconnect", position=position)
                         if ok:
                             return
+                player.reset_playback()
                 await play_next(guild)
 
 @bot.command(name='join')
@@ -746,18 +4079,11 @@ async def leave(ctx):
     if ctx.voice_client:
         guild_id = ctx.guild.id
         mark_intentional_voice_disconnect(guild_id)
-        queue = get_guild_queue(guild_id)
-        while not queue.empty():
-            try:
-                queue.get_nowait()
-            except asyncio.QueueEmpty:
-                break
+        get_guild_queue(guild_id).clear()
         if ctx.voice_client.is_playing() or ctx.voice_client.is_paused():
             ctx.voice_client.stop()
-        now_playing.pop(guild_id, None)
-        current_track.pop(guild_id, None)
-        track_recovery_attempts.pop(guild_id, None)
-        last_voice_channel_id.pop(guild_id, None)
+        reset_guild_playback(guild_id)
+        players.get(guild_id).last_channel_id = None
         await ctx.voice_client.disconnect(force=True)
         await ctx.send("👋 Kiléptem a voice csatornából.")
     else:
@@ -765,6 +4091,7 @@ async def leave(ctx):
 
 
 @bot.command(name='play')
+@traced("command.play")
 async def play(ctx, *, query: str):
     """Play a song from YouTube or process Spotify URLs. Add to queue if already playing."""
     vc = ctx.voice_client
@@ -780,41 +4107,24 @@ async def play(ctx, *, query: str):
 
     queue = get_guild_queue(ctx.guild.id)
     if vc and vc.channel:
-        last_voice_channel_id[ctx.guild.id] = vc.channel.id
+        players.get(ctx.guild.id).last_channel_id = vc.channel.id
 
-    added_titles: List[str] = []
     if is_spotify_url(query) and SPOTIFY_CLIENT:
-        await ctx.send("🎧 Spotify link felismerve, számok hozzáadása...")
-        track_terms = await get_spotify_tracks(query)
-        if not track_terms:
-            await ctx.send("❌ Nem sikerült beolvasni a Spotify tartalmat, vagy üres a lejátszási lista.")
-        for term in track_terms:
-            res = await search_youtube(term)
-            if res:
-                audio_url, title = res
-                await queue.put((audio_url, title, ctx))
-                added_titles.append(title)
+        status = await send_status(ctx, "🎧 Spotify link felismerve, számok hozzáadása...")
+        added = await enqueue_spotify_tracks(ctx.guild, ctx, iter_spotify_tracks(query), status)
+        if not added:
+            await edit_status(ctx, status, "❌ Nem sikerült beolvasni a Spotify tartalmat, vagy üres a lejátszási lista.")
     else:
         await ctx.send(f"🔎 Keresés: {query}")
-        res = await search_youtube(query)
-        if res:
-            audio_url, title = res
-            await queue.put((audio_url, title, ctx))
-            added_titles.append(title)
+        track = await resolve_track(query, voice_bitrate_kbps(ctx.guild))
+        if track:
+            title = track.title
+            queue.append(Track.from_target(query, title, ctx, resolved=track))
+            await ctx.send(f"✅ Hozzáadva: **{title}**")
         else:
             await ctx.send("❌ Nem találtam eredményt.")
             return
 
-    if added_titles:
-        if len(added_titles) == 1:
-            await ctx.send(f"✅ Hozzáadva: **{added_titles[0]}**")
-        else:
-            await ctx.send(f"✅ {len(added_titles)} szám hozzáadva a várólistához.")
-            for t in added_titles[:5]:
-                await ctx.send(f"+ {t}")
-            if len(added_titles) > 5:
-                await ctx.send(f"...és {len(added_titles) - 5} további.")
-
     if vc and not vc.is_playing() and not vc.is_paused():
         await play_next(ctx.guild)
 
@@ -830,31 +4140,56 @@ async def play_next(guild: discord.Guild):
             if vc and (vc.is_connected() or vc.is_playing() or vc.is_paused()):
                 mark_intentional_voice_disconnect(guild.id)
                 await vc.disconnect(force=True)
-            current_track.pop(guild.id, None)
-            now_playing.pop(guild.id, None)
-            track_recovery_attempts.pop(guild.id, None)
+            reset_guild_playback(guild.id)
             return
         vc = await ensure_voice_connection(guild)
         if not vc:
-            current_track.pop(guild.id, None)
-            now_playing.pop(guild.id, None)
-            track_recovery_attempts.pop(guild.id, None)
+            reset_guild_playback(guild.id, forget=False)
             return
         if vc.is_playing() or vc.is_paused():
             return
-        try:
-            url, title, target = queue.get_nowait()
-        except asyncio.QueueEmpty:
-            mark_intentional_voice_disconnect(guild.id)
-            current_track.pop(guild.id, None)
-            now_playing.pop(guild.id, None)
-            track_recovery_attempts.pop(guild.id, None)
-            await vc.disconnect(force=True)
-            return
-        ok = await start_track(guild, url, title, target)
+        requested_at = time.monotonic()
+        while True:
+            try:
+                entry = queue.popleft()
+            except IndexError:
+                mark_intentional_voice_disconnect(guild.id)
+                reset_guild_playback(guild.id)
+                await vc.disconnect(force=True)
+                return
+            resolved = await resolve_entry(entry, voice_bitrate_kbps(guild))
+            if resolved:
+                break
+            await announce(entry, f"❌ Nem sikerült betölteni: **{entry.title}**")
+        player = players.get(guild.id)
+        resume, player.pending_resume = player.pending_resume, None
+        start_at = resume[1] if resume and resume[0] is entry else 0.0
+        # A preloaded source starts at 0:00, so it is useless for a resume.
+        source = None if start_at else take_preloaded_source(guild.id, entry)
+        if source:
+            location, codec = source.location, source.codec
+        else:
+            location, codec = await playback_location(resolved)
+        ok = await start_track(
+            guild,
+            location,
+            resolved.title,
+            channel_handle(entry.channel_id),
+            source=source,
+            duration=resolved.duration,
+            codec=codec,
+            start_at=start_at,
+            entry=entry,
+            requested_at=requested_at,
+        )
         if not ok:
-            await queue.put((url, title, target))
+            queue.append(entry)
             bot.loop.create_task(retry_play_next_later(guild, 2.0))
+            return
+        suggestion_index.add(resolved.title, played=True)
+        if session_store and vc.channel:
+            session_store.save_session(guild.id, vc.channel.id, entry, start_at)
+        schedule_prefetch(guild.id)
 
 
 @bot.command(name='skip')
@@ -872,6 +4207,7 @@ async def pause(ctx):
     """Pause the currently playing song."""
     if ctx.voice_client and ctx.voice_client.is_playing():
         ctx.voice_client.pause()
+        players.get(ctx.guild.id).follow_voice(PlayerState.PAUSED)
         await ctx.send("⏸️ Lejátszás szüneteltetve.")
     else:
         await ctx.send("ℹ️ Nem játszik semmi.")
@@ -882,6 +4218,7 @@ async def resume(ctx):
     """Resume a paused song."""
     if ctx.voice_client and ctx.voice_client.is_paused():
         ctx.voice_client.resume()
+        players.get(ctx.guild.id).follow_voice(PlayerState.PLAYING)
         await ctx.send("▶️ Lejátszás folytatva.")
     else:
         await ctx.send("ℹ️ Nem volt szüneteltetve.")
@@ -890,47 +4227,56 @@ async def resume(ctx):
 @bot.command(name='np')
 async def nowplaying(ctx):
     """Show what is currently playing."""
-    title = now_playing.get(ctx.guild.id)
+    player = players.peek(ctx.guild.id)
+    title = player.now_playing if player else None
     if title:
         await ctx.send(f"🎶 Most játszom: **{title}**")
     else:
         await ctx.send("ℹ️ Nem játszik semmi.")
 
 
+def format_queue_page(queue: GuildPlaylist, page: int, header: str = "Várólista") -> str:
+    """Render one page of the queue with 1-based positions."""
+    pages = max(1, -(-len(queue) // QUEUE_PAGE_SIZE))
+    page = max(1, min(page, pages))
+    start = (page - 1) * QUEUE_PAGE_SIZE
+    lines = [f"{header} ({len(queue)} szám, {page}/{pages}. oldal):"]
+    for idx, entry in enumerate(queue[start:start + QUEUE_PAGE_SIZE], start=start + 1):
+        lines.append(f"{idx}. {entry.title}")
+    if page < pages:
+        lines.append(f"…és még {len(queue) - start - QUEUE_PAGE_SIZE} további.")
+    return "\n".join(lines)
+
+
+def drop_stale_preload(guild_id: int) -> None:
+    """Kill a preloaded source whose entry is no longer at the head of the queue."""
+    player = players.peek(guild_id)
+    preloaded = player.preloaded if player else None
+    if not preloaded:
+        return
+    queue = get_guild_queue(guild_id)
+    if queue.empty() or queue[0] is not preloaded[0]:
+        discard_preload(guild_id)
+
+
 @bot.command(name='queue')
-async def queue_cmd(ctx):
+async def queue_cmd(ctx, page: int = 1):
     """Display the upcoming songs in the queue."""
     queue = get_guild_queue(ctx.guild.id)
     if queue.empty():
         await ctx.send("ℹ️ A várólista üres.")
         return
-    # list items without removing them
-    items = list(queue._queue)  # type: ignore[attr-defined]
-    msg_lines = [f"Várólista ({len(items)} szám):"]
-    for idx, (_, title, _) in enumerate(items, start=1):
-        if idx > 10:
-            msg_lines.append(f"…és még {len(items) - 10} további.")
-            break
-        msg_lines.append(f"{idx}. {title}")
-    await ctx.send("\n".join(msg_lines))
+    await ctx.send(format_queue_page(queue, page))
 
 
 @bot.command(name='stop')
 async def stop_cmd(ctx):
     """Stop playback and clear the queue."""
-    queue = get_guild_queue(ctx.guild.id)
-    # Clear queue
-    while not queue.empty():
-        try:
-            queue.get_nowait()
-        except asyncio.QueueEmpty:
-            break
+    get_guild_queue(ctx.guild.id).clear()
     # Stop current playback
     if ctx.voice_client and (ctx.voice_client.is_playing() or ctx.voice_client.is_paused()):
         ctx.voice_client.stop()
-    now_playing.pop(ctx.guild.id, None)
-    current_track.pop(ctx.guild.id, None)
-    track_recovery_attempts.pop(ctx.guild.id, None)
+    reset_guild_playback(ctx.guild.id)
     await ctx.send("⏹️ Lejátszás leállítva és várólista törölve.")
 
 
@@ -941,18 +4287,85 @@ async def shuffle_cmd(ctx):
     if queue.empty():
         await ctx.send("ℹ️ A várólista üres, nincs mit keverni.")
         return
-    # Extract all items
-    items = []
-    while not queue.empty():
-        items.append(await queue.get())
-    # Shuffle
-    random.shuffle(items)
-    # Put back
-    for item in items:
-        await queue.put(item)
+    queue.shuffle()
+    drop_stale_preload(ctx.guild.id)
+    schedule_prefetch(ctx.guild.id)
     await ctx.send("🔀 A várólista megkeverve.")
 
 
+@bot.command(name='remove')
+async def remove_cmd(ctx, position: int):
+    """Remove the song at the given queue position."""
+    queue = get_guild_queue(ctx.guild.id)
+    if position < 1:
+        await ctx.send("❌ Nincs ilyen sorszám a várólistában.")
+        return
+    try:
+        entry = queue.remove_at(position - 1)
+    except IndexError:
+        await ctx.send("❌ Nincs ilyen sorszám a várólistában.")
+        return
+    drop_stale_preload(ctx.guild.id)
+    schedule_prefetch(ctx.guild.id)
+    await ctx.send(f"🗑️ Eltávolítva: **{entry.title}**")
+
+
+@bot.command(name='move')
+async def move_cmd(ctx, source: int, destination: int):
+    """Move a queued song to another position."""
+    queue = get_guild_queue(ctx.guild.id)
+    if source < 1 or destination < 1:
+        await ctx.send("❌ Nincs ilyen sorszám a várólistában.")
+        return
+    try:
+        entry = queue[source - 1]
+        queue.move(source - 1, destination - 1)
+    except IndexError:
+        await ctx.send("❌ Nincs ilyen sorszám a várólistában.")
+        return
+    drop_stale_preload(ctx.guild.id)
+    schedule_prefetch(ctx.guild.id)
+    await ctx.send(f"↕️ **{entry.title}** áthelyezve a(z) {max(1, min(destination, len(queue)))}. helyre.")
+
+
+@bot.command(name='dedupe')
+async def dedupe_cmd(ctx):
+    """Remove duplicate songs from the queue."""
+    queue = get_guild_queue(ctx.guild.id)
+    removed = queue.dedupe(entry_identity)
+    drop_stale_preload(ctx.guild.id)
+    await ctx.send(f"🧹 {removed} ismétlődő szám eltávolítva.")
+
+
+@bot.command(name='loopdebug')
+@commands.has_guild_permissions(administrator=True)
+async def loopdebug_cmd(ctx, mode: str = "", slow_ms: int = 0):
+    """Show event loop lag, or switch asyncio slow-callback logging on/off (admin only)."""
+    loop = asyncio.get_running_loop()
+    mode = mode.lower()
+    if mode in {"on", "off"}:
+        set_loop_debug(loop, mode == "on", slow_ms or LOOP_LAG_WARN_MS or 100)
+    lines = [f"🩺 Asyncio debug: **{'be' if loop.get_debug() else 'ki'}** "
+             f"(lassú callback küszöb: {int(loop.slow_callback_duration * 1000)} ms)"]
+    if loop_watchdog:
+        p = loop_watchdog.percentiles()
+        lines.append(
+            f"Loop késés p50/p95/p99: {p[0.5] * 1000:.1f} / {p[0.95] * 1000:.1f} / {p[0.99] * 1000:.1f} ms, "
+            f"elakadások: {loop_watchdog.stalls}"
+        )
+    else:
+        lines.append("A loop késés figyelő ki van kapcsolva (LOOP_LAG_WARN_MS=0).")
+    await ctx.send("\n".join(lines))
+
+
+@loopdebug_cmd.error
+async def loopdebug_error(ctx, error: commands.CommandError):
+    if isinstance(error, (commands.MissingPermissions, commands.NoPrivateMessage)):
+        await ctx.send("⛔ Ehhez a parancshoz adminisztrátori jog kell.")
+        return
+    logger.error("loopdebug hiba error=%s", error)
+
+
 if not TOKEN:
     logger.warning("DISCORD_TOKEN nincs beallitva; run_bot inditaskor kotelezo.")
 
@@ -984,18 +4397,11 @@ async def leave_slash(interaction: discord.Interaction):
     if vc:
         guild_id = interaction.guild.id
         mark_intentional_voice_disconnect(guild_id)
-        queue = get_guild_queue(guild_id)
-        while not queue.empty():
-            try:
-                queue.get_nowait()
-            except asyncio.QueueEmpty:
-                break
+        get_guild_queue(guild_id).clear()
         if vc.is_playing() or vc.is_paused():
             vc.stop()
-        now_playing.pop(guild_id, None)
-        current_track.pop(guild_id, None)
-        track_recovery_attempts.pop(guild_id, None)
-        last_voice_channel_id.pop(guild_id, None)
+        reset_guild_playback(guild_id)
+        players.get(guild_id).last_channel_id = None
         await vc.disconnect(force=True)
         await interaction.response.send_message("👋 Kiléptem a voice csatornából.")
     else:
@@ -1005,11 +4411,13 @@ async def leave_slash(interaction: discord.Interaction):
 @music_group.command(name="play", description="Lejátszik egy dalt YouTube-ról vagy Spotify hivatkozásról.")
 @app_commands.describe(query="Dal címe, YouTube vagy Spotify URL")
 @app_commands.autocomplete(query=yt_autocomplete)
+@traced("command.play_slash")
 async def play_slash(interaction: discord.Interaction, query: str):
-    await interaction.response.defer()
+    with trace_span("interaction.defer"):
+        await interaction.response.defer()
     vc = interaction.guild.voice_client
     if vc and vc.channel:
-        last_voice_channel_id[interaction.guild.id] = vc.channel.id
+        players.get(interaction.guild.id).last_channel_id = vc.channel.id
 
     if not vc:
         if not interaction.user.voice:
@@ -1023,40 +4431,23 @@ async def play_slash(interaction: discord.Interaction, query: str):
             return
 
     queue = get_guild_queue(interaction.guild.id)
-    added_titles: List[str] = []
 
     if is_spotify_url(query) and SPOTIFY_CLIENT:
-        await interaction.followup.send("🎧 Spotify link felismerve, számok hozzáadása...")
-        track_terms = await get_spotify_tracks(query)
-        if not track_terms:
-            await interaction.followup.send("❌ Nem sikerült beolvasni a Spotify tartalmat, vagy üres a lejátszási lista.")
-        for term in track_terms:
-            res = await search_youtube(term)
-            if res:
-                audio_url, title = res
-                await queue.put((audio_url, title, interaction))
-                added_titles.append(title)
+        status = await send_status(interaction, "🎧 Spotify link felismerve, számok hozzáadása...")
+        added = await enqueue_spotify_tracks(interaction.guild, interaction, iter_spotify_tracks(query), status)
+        if not added:
+            await edit_status(interaction, status, "❌ Nem sikerült beolvasni a Spotify tartalmat, vagy üres a lejátszási lista.")
     else:
         await interaction.followup.send(f"🔎 Keresés: {query}")
-        res = await search_youtube(query)
-        if res:
-            audio_url, title = res
-            await queue.put((audio_url, title, interaction))
-            added_titles.append(title)
+        track = await resolve_track(query, voice_bitrate_kbps(interaction.guild))
+        if track:
+            title = track.title
+            queue.append(Track.from_target(query, title, interaction, resolved=track))
+            await interaction.followup.send(f"✅ Hozzáadva: **{title}**")
         else:
             await interaction.followup.send("❌ Nem találtam eredményt.")
             return
 
-    if added_titles:
-        if len(added_titles) == 1:
-            await interaction.followup.send(f"✅ Hozzáadva: **{added_titles[0]}**")
-        else:
-            await interaction.followup.send(f"✅ {len(added_titles)} szám hozzáadva a várólistához.")
-            for t in added_titles[:5]:
-                await interaction.followup.send(f"+ {t}")
-            if len(added_titles) > 5:
-                await interaction.followup.send(f"...és {len(added_titles) - 5} további.")
-
     if vc and not vc.is_playing() and not vc.is_paused():
         await play_next(interaction.guild)
 
@@ -1076,6 +4467,7 @@ async def pause_slash(interaction: discord.Interaction):
     vc = interaction.guild.voice_client
     if vc and vc.is_playing():
         vc.pause()
+        players.get(interaction.guild.id).follow_voice(PlayerState.PAUSED)
         await interaction.response.send_message("⏸️ Lejátszás szüneteltetve.")
     else:
         await interaction.response.send_message("ℹ️ Nem játszik semmi.")
@@ -1086,6 +4478,7 @@ async def resume_slash(interaction: discord.Interaction):
     vc = interaction.guild.voice_client
     if vc and vc.is_paused():
         vc.resume()
+        players.get(interaction.guild.id).follow_voice(PlayerState.PLAYING)
         await interaction.response.send_message("▶️ Lejátszás folytatva.")
     else:
         await interaction.response.send_message("ℹ️ Nem volt szüneteltetve.")
@@ -1093,7 +4486,8 @@ async def resume_slash(interaction: discord.Interaction):
 
 @music_group.command(name="np", description="Megjeleníti az aktuális számot.")
 async def now_playing_slash(interaction: discord.Interaction):
-    title = now_playing.get(interaction.guild.id)
+    player = players.peek(interaction.guild.id)
+    title = player.now_playing if player else None
     if title:
         await interaction.response.send_message(f"🎶 Most játszom: **{title}**")
     else:
@@ -1101,37 +4495,23 @@ async def now_playing_slash(interaction: discord.Interaction):
 
 
 @music_group.command(name="queue", description="Megjeleníti a várólistában lévő számokat.")
-async def queue_slash(interaction: discord.Interaction):
+@app_commands.describe(page="Oldalszám")
+async def queue_slash(interaction: discord.Interaction, page: int = 1):
     q = get_guild_queue(interaction.guild.id)
     if q.empty():
         await interaction.response.send_message("ℹ️ A várólista üres.")
         return
-
-    items: Iterable[Tuple[str, str, object]] = list(q._queue)  # type: ignore[attr-defined]
-    lines = [f"📋 Várólista ({len(items)} szám):"]
-    for idx, (_, title, _) in enumerate(items, start=1):
-        if idx > 10:
-            lines.append(f"...és még {len(items) - 10} további.")
-            break
-        lines.append(f"{idx}. {title}")
-    await interaction.response.send_message("\n".join(lines))
+    await interaction.response.send_message(format_queue_page(q, page, header="📋 Várólista"))
 
 
 @music_group.command(name="stop", description="Leállítja a lejátszást és törli a várólistát.")
 async def stop_slash(interaction: discord.Interaction):
-    q = get_guild_queue(interaction.guild.id)
-    while not q.empty():
-        try:
-            q.get_nowait()
-        except asyncio.QueueEmpty:
-            break
+    get_guild_queue(interaction.guild.id).clear()
 
     vc = interaction.guild.voice_client
     if vc and (vc.is_playing() or vc.is_paused()):
         vc.stop()
-    now_playing.pop(interaction.guild.id, None)
-    current_track.pop(interaction.guild.id, None)
-    track_recovery_attempts.pop(interaction.guild.id, None)
+    reset_guild_playback(interaction.guild.id)
     await interaction.response.send_message("⏹️ Lejátszás leállítva és várólista törölve.")
 
 
@@ -1142,15 +4522,57 @@ async def shuffle_slash(interaction: discord.Interaction):
         await interaction.response.send_message("ℹ️ A várólista üres, nincs mit keverni.")
         return
 
-    items = []
-    while not q.empty():
-        items.append(await q.get())
-    random.shuffle(items)
-    for item in items:
-        await q.put(item)
+    q.shuffle()
+    drop_stale_preload(interaction.guild.id)
+    schedule_prefetch(interaction.guild.id)
     await interaction.response.send_message("🔀 A várólista megkeverve.")
 
 
+@music_group.command(name="remove", description="Eltávolít egy számot a várólistából.")
+@app_commands.describe(position="A szám sorszáma a várólistában")
+async def remove_slash(interaction: discord.Interaction, position: int):
+    q = get_guild_queue(interaction.guild.id)
+    if position < 1:
+        await interaction.response.send_message("❌ Nincs ilyen sorszám a várólistában.")
+        return
+    try:
+        entry = q.remove_at(position - 1)
+    except IndexError:
+        await interaction.response.send_message("❌ Nincs ilyen sorszám a várólistában.")
+        return
+    drop_stale_preload(interaction.guild.id)
+    schedule_prefetch(interaction.guild.id)
+    await interaction.response.send_message(f"🗑️ Eltávolítva: **{entry.title}**")
+
+
+@music_group.command(name="move", description="Áthelyez egy számot a várólistában.")
+@app_commands.describe(source="Jelenlegi sorszám", destination="Új sorszám")
+async def move_slash(interaction: discord.Interaction, source: int, destination: int):
+    q = get_guild_queue(interaction.guild.id)
+    if source < 1 or destination < 1:
+        await interaction.response.send_message("❌ Nincs ilyen sorszám a várólistában.")
+        return
+    try:
+        entry = q[source - 1]
+        q.move(source - 1, destination - 1)
+    except IndexError:
+        await interaction.response.send_message("❌ Nincs ilyen sorszám a várólistában.")
+        return
+    drop_stale_preload(interaction.guild.id)
+    schedule_prefetch(interaction.guild.id)
+    await interaction.response.send_message(
+        f"↕️ **{entry.title}** áthelyezve a(z) {max(1, min(destination, len(q)))}. helyre."
+    )
+
+
+@music_group.command(name="dedupe", description="Eltávolítja az ismétlődő számokat a várólistából.")
+async def dedupe_slash(interaction: discord.Interaction):
+    q = get_guild_queue(interaction.guild.id)
+    removed = q.dedupe(entry_identity)
+    drop_stale_preload(interaction.guild.id)
+    await interaction.response.send_message(f"🧹 {removed} ismétlődő szám eltávolítva.")
+
+
 bot.tree.add_command(music_group)
 
 
@@ -1162,6 +4584,9 @@ def run_bot() -> None:
 
 
 if __name__ == "__main__":
+    if YTDL_BACKEND == "process":
+        # spawn re-runs the entry script in each worker; run.py keeps that import empty.
+        logger.warning("YTDL_BACKEND=process: start the bot with run.py, main.py is re-run in every worker.")
     run_bot()
 
 
@@ -0,0 +1,12 @@
+"""Start the bot: ``python run.py``.
+
+The ``process`` yt-dlp backend starts its workers with ``spawn``, which runs
+the entry script again in every worker. This script does nothing unless it is
+``__main__``, so workers load only ytdl_worker and never main.py's bot,
+thread pools and caches.
+"""
+
+if __name__ == "__main__":
+    import main
+
+    main.run_bot()
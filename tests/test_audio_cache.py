@@ -0,0 +1,65 @@
+import asyncio
+import hashlib
+import os
+import time
+
+import main
+
+
+def store_file(cache, video_id, payload, last_used=None):
+    path = cache._path(video_id)
+    with open(path, "wb") as fh:
+        fh.write(payload)
+    cache._db.execute(
+        "INSERT OR REPLACE INTO files (video_id, size, sha256, last_used) VALUES (?, ?, ?, ?)",
+        (video_id, len(payload), hashlib.sha256(payload).hexdigest(), last_used or time.time()),
+    )
+    cache._db.commit()
+    return path
+
+
+def test_lookup_returns_intact_file(tmp_path):
+    cache = main.AudioCache(str(tmp_path), max_bytes=1024, play_threshold=2)
+    path = store_file(cache, "abc", b"opus-data")
+
+    assert asyncio.run(cache.lookup("abc")) == path
+    assert asyncio.run(cache.lookup("missing")) is None
+
+
+def test_lookup_drops_corrupt_file(tmp_path):
+    cache = main.AudioCache(str(tmp_path), max_bytes=1024, play_threshold=2)
+    path = store_file(cache, "abc", b"opus-data")
+    with open(path, "wb") as fh:
+        fh.write(b"opus-dat!")
+
+    assert asyncio.run(cache.lookup("abc")) is None
+    assert not os.path.exists(path)
+
+
+def test_eviction_removes_least_recently_used(tmp_path):
+    cache = main.AudioCache(str(tmp_path), max_bytes=10, play_threshold=2)
+    old_path = store_file(cache, "old", b"123456", last_used=1.0)
+    new_path = store_file(cache, "new", b"123456", last_used=2.0)
+
+    cache._evict_sync()
+
+    assert not os.path.exists(old_path)
+    assert os.path.exists(new_path)
+
+
+def test_record_play_counts_until_threshold(tmp_path, monkeypatch):
+    cache = main.AudioCache(str(tmp_path), max_bytes=1024, play_threshold=3)
+    downloads = []
+    monkeypatch.setattr(cache, "_download_sync", downloads.append)
+    monkeypatch.setattr(main, "FFMPEG_EXE", "ffmpeg")
+    track = main.ResolvedTrack(video_id="hot", title="Hot", stream_url="u", expires_at=time.time() + 3600)
+
+    async def play_times(n):
+        for _ in range(n):
+            await cache.record_play(track)
+        await asyncio.sleep(0.05)
+
+    asyncio.run(play_times(2))
+    assert downloads == []
+    asyncio.run(play_times(1))
+    assert downloads == [track]
@@ -0,0 +1,118 @@
+import asyncio
+
+import main
+
+
+def test_suggestions_match_word_prefixes():
+    index = main.SuggestionIndex()
+    index.add("Rick Astley - Never Gonna Give You Up (Official Video)")
+    index.add("Never Enough")
+    index.add("Gonna Fly Now")
+
+    assert index.suggest("never gonna g") == ["Rick Astley - Never Gonna Give You Up (Official Video)"]
+    assert sorted(index.suggest("NEVER")) == ["Never Enough", "Rick Astley - Never Gonna Give You Up (Official Video)"]
+    assert index.suggest("gonna") == ["Rick Astley - Never Gonna Give You Up (Official Video)", "Gonna Fly Now"] or \
+        index.suggest("gonna") == ["Gonna Fly Now", "Rick Astley - Never Gonna Give You Up (Official Video)"]
+    assert index.suggest("zzz") == []
+
+
+def test_ranking_prefers_played_and_recent_titles():
+    index = main.SuggestionIndex()
+    now = 1_000_000.0
+    index.add("Song Old Favourite", now=now - 30 * 24 * 3600)
+    for _ in range(3):
+        index.add("Song Old Favourite", played=True, now=now - 30 * 24 * 3600)
+    index.add("Song Played Today", played=True, now=now)
+    index.add("Song Just Seen", now=now)
+
+    assert index.suggest("song", now=now) == ["Song Played Today", "Song Just Seen", "Song Old Favourite"]
+
+
+def test_capacity_trims_lowest_ranked():
+    index = main.SuggestionIndex(capacity=10)
+    for i in range(11):
+        index.add(f"title {i:02d}", played=i > 0, now=1000.0 + i)
+
+    assert len(index) <= 10
+    assert "title 00" not in index.suggest("title", limit=20)
+
+
+def test_autocomplete_answers_from_index_and_backfills(monkeypatch):
+    index = main.SuggestionIndex()
+    index.add("Never Gonna Give You Up")
+    monkeypatch.setattr(main, "suggestion_index", index)
+    monkeypatch.setattr(main, "autocomplete_cache", main.TTLCache("autocomplete", 16, 30))
+    monkeypatch.setattr(main, "autocomplete_scheduler", main.AutocompleteScheduler(2, 0, 8))
+    searched = []
+
+    async def fake_extract_info(query, timeout):
+        searched.append(query)
+        return {"entries": [{"title": "Never Gonna Stop"}]}
+
+    monkeypatch.setattr(main.search_pool, "extract_info", fake_extract_info)
+
+    async def scenario():
+        first = await main.yt_autocomplete(None, "never gonna")
+        await main.autocomplete_scheduler.join()
+        second = await main.yt_autocomplete(None, "never gonna s")
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert [c.name for c in first] == ["Never Gonna Give You Up"]
+    assert searched == ["ytsearch5:never gonna"]
+    assert [c.name for c in second] == ["Never Gonna Stop"]
+
+
+def test_scheduler_supersedes_previous_prefix_of_same_user():
+    ran = []
+
+    def fetch(key):
+        async def run():
+            ran.append(key)
+        return run
+
+    async def scenario():
+        scheduler = main.AutocompleteScheduler(2, 0.05, 8)
+        for key in ("ne", "nev", "neve", "never"):
+            scheduler.submit(1, key, fetch(key))
+            await asyncio.sleep(0)
+        scheduler.submit(2, "other", fetch("other"))
+        assert scheduler.submit(3, "other", fetch("duplicate")) is False
+        await scheduler.join()
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+
+    assert sorted(ran) == ["never", "other"]
+    assert len(scheduler) == 0
+
+
+def test_scheduler_caps_concurrency_and_prefers_newest():
+    order = []
+    running = []
+    peak = []
+
+    def fetch(key):
+        async def run():
+            running.append(key)
+            peak.append(len(running))
+            order.append(key)
+            await asyncio.sleep(0.01)
+            running.remove(key)
+        return run
+
+    async def scenario():
+        scheduler = main.AutocompleteScheduler(1, 0, 2)
+        for user, key in enumerate(("a", "b", "c", "d")):
+            scheduler.submit(user, key, fetch(key))
+            await asyncio.sleep(0)
+        await scheduler.join()
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+
+    assert max(peak) == 1
+    # "a" grabbed the only slot, "b" was dropped beyond max_pending and "d" beat "c".
+    assert order == ["a", "d", "c"]
+    assert scheduler.active == 0
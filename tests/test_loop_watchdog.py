@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+import main
+
+
+def test_percentiles_over_window():
+    watchdog = main.LoopWatchdog(threshold_sec=1.0)
+    for ms in range(1, 101):
+        watchdog.record(ms / 1000)
+
+    p = watchdog.percentiles()
+
+    assert p[0.5] == 0.051
+    assert p[0.95] == 0.096
+    assert p[0.99] == 0.1
+
+
+def test_stall_reports_blocking_stack_once(caplog):
+    watchdog = main.LoopWatchdog(threshold_sec=0.1)
+    watchdog.SAMPLE_SEC = 0.02
+
+    def blocking_helper():
+        time.sleep(0.3)
+
+    async def scenario():
+        task = asyncio.create_task(watchdog.run())
+        await asyncio.sleep(0.2)
+        blocking_helper()
+        await asyncio.sleep(0.2)
+        task.cancel()
+
+    asyncio.run(scenario())
+
+    assert watchdog.stalls == 1
+    assert "blocking_helper" in caplog.text
+    assert max(watchdog.samples) >= 0.25
+
+
+def test_is_url_uses_precompiled_pattern():
+    assert main.is_url("https://youtu.be/x")
+    assert main.is_url("www.example.com")
+    assert not main.is_url("never gonna give you up")
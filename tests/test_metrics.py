@@ -0,0 +1,48 @@
+import main
+
+
+def test_counter_and_histogram_render_prometheus_text():
+    registry = main.MetricsRegistry()
+    counter = main.Counter("t_events_total", "Events.", ("kind",), registry=registry)
+    histogram = main.Histogram("t_latency_seconds", "Latency.", ("outcome",), buckets=(0.1, 1.0), registry=registry)
+    counter.inc(kind="a")
+    counter.inc(2, kind='b"x')
+    histogram.observe(0.05, outcome="ok")
+    histogram.observe(0.5, outcome="ok")
+    histogram.observe(5.0, outcome="ok")
+
+    lines = registry.render().splitlines()
+
+    assert "# TYPE t_events_total counter" in lines
+    assert 't_events_total{kind="a"} 1.0' in lines
+    assert 't_events_total{kind="b\\"x"} 2.0' in lines
+    assert 't_latency_seconds_bucket{outcome="ok",le="0.1"} 1' in lines
+    assert 't_latency_seconds_bucket{outcome="ok",le="1.0"} 2' in lines
+    assert 't_latency_seconds_bucket{outcome="ok",le="+Inf"} 3' in lines
+    assert 't_latency_seconds_sum{outcome="ok"} 5.55' in lines
+    assert 't_latency_seconds_count{outcome="ok"} 3' in lines
+
+
+def test_gauge_collects_at_scrape_time():
+    registry = main.MetricsRegistry()
+    state = {"value": 1}
+    main.Gauge("t_depth", "Depth.", ("pool",), collect=lambda: [({"pool": "p"}, state["value"])], registry=registry)
+    state["value"] = 7
+
+    assert 't_depth{pool="p"} 7.0' in registry.render().splitlines()
+
+
+def test_voice_connect_attempts_feed_histogram():
+    before = main.VOICE_CONNECT_SECONDS.count(outcome="timeout")
+    main.log_voice_event("connect_timeout", 1, channel_id=2, attempt=1, elapsed_ms=1500)
+    main.log_voice_event("connect_start", 1, channel_id=2, attempt=1)
+
+    assert main.VOICE_CONNECT_SECONDS.count(outcome="timeout") == before + 1
+
+
+def test_executor_depth_counts_running_jobs(monkeypatch):
+    monkeypatch.setattr(main.extract_pool, "stats", lambda: {"name": "extract", "pending": 2, "active": 3})
+    monkeypatch.setattr(main.search_pool, "stats", lambda: {"name": "search", "pending": 0, "active": 1})
+    monkeypatch.setattr(main, "extract_backend", main.extract_pool)
+
+    assert main._collect_executor_depth() == [({"pool": "extract"}, 5), ({"pool": "search"}, 1)]
@@ -0,0 +1,116 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+def test_peek_never_creates_players():
+    registry = main.PlayerRegistry()
+
+    assert registry.peek(5) is None
+    assert len(registry) == 0
+
+    player = registry.get(5)
+    player.last_channel_id = 99
+
+    assert registry.get(5) is player and registry.peek(5).last_channel_id == 99
+    assert len(registry) == 1
+
+
+def test_state_transitions_and_reset():
+    player = main.GuildPlayer(1)
+    player.transition(main.PlayerState.CONNECTING)
+    player.transition(main.PlayerState.PLAYING)
+    player.transition(main.PlayerState.PAUSED)
+    player.current = ("url", "title", None, "", None)
+    player.recovery_attempts = 1
+
+    player.reset_playback()
+
+    assert player.state is main.PlayerState.IDLE
+    assert player.current is None and player.recovery_attempts is None
+
+
+def test_illegal_transition_raises_and_keeps_state():
+    player = main.GuildPlayer(1)
+
+    with pytest.raises(main.IllegalTransition):
+        player.transition(main.PlayerState.PAUSED)
+
+    assert player.state is main.PlayerState.IDLE
+    assert not player.can_transition(main.PlayerState.RECOVERING)
+
+
+def test_idle_eviction_keeps_busy_and_connected_guilds(monkeypatch):
+    registry = main.PlayerRegistry(idle_sec=60)
+    connected = {3}
+    monkeypatch.setattr(main, "guild_has_voice_client", lambda guild_id: guild_id in connected)
+    idle, queued, voice, playing = (registry.get(i) for i in range(1, 5))
+    queued.queue = main.GuildPlaylist()
+    queued.queue.append("song")
+    playing.state = main.PlayerState.PLAYING
+    fresh = registry.get(6)
+
+    evicted = registry.evict_idle(now=fresh.last_active + 30)
+    assert evicted == 0
+
+    evicted = registry.evict_idle(now=fresh.last_active + 120)
+
+    assert evicted == 2
+    assert registry.peek(1) is None and registry.peek(6) is None
+    assert registry.peek(2) is queued and registry.peek(3) is voice and registry.peek(4) is playing
+
+
+def test_reaper_purges_expired_autocomplete_and_tracks(monkeypatch):
+    autocomplete = main.TTLCache("autocomplete", 8, main.AUTOCOMPLETE_CACHE_TTL_SEC)
+    autocomplete.put("old", ["a"], now=1000.0 - main.AUTOCOMPLETE_CACHE_TTL_SEC * 2 / 3)
+    autocomplete.put("new", ["b"], now=1000.0)
+    monkeypatch.setattr(main, "autocomplete_cache", autocomplete)
+    cache = main.TrackCache(capacity=4)
+    expired = main.ResolvedTrack(video_id="v1", title="t", stream_url="u", expires_at=0.0)
+    cache._remember("old song", expired)
+    monkeypatch.setattr(main, "track_cache", cache)
+    monkeypatch.setattr(main, "players", main.PlayerRegistry())
+    monkeypatch.setattr(main, "suggestion_index", main.SuggestionIndex())
+
+    reaped = main.reap_idle_resources(now=1000.0 + main.AUTOCOMPLETE_CACHE_TTL_SEC / 2)
+
+    assert reaped == {"players": 0, "autocomplete": 1, "tracks": 1}
+    assert list(main.autocomplete_cache) == ["new"]
+    assert main.live_object_counts() == {"players": 0, "autocomplete": 1, "tracks": 0, "suggestions": 0}
+
+
+def test_guild_remove_releases_player(monkeypatch):
+    registry = main.PlayerRegistry()
+    monkeypatch.setattr(main, "players", registry)
+    monkeypatch.setattr(main, "session_store", None)
+    player = registry.get(42)
+    player.queue = main.GuildPlaylist()
+    player.queue.append("song")
+    player.current = ("url", "title", None, "", None)
+
+    asyncio.run(main.release_guild(42))
+
+    assert registry.peek(42) is None
+    assert len(player.queue) == 0
+
+
+@pytest.mark.parametrize("drifted", [main.PlayerState.IDLE, main.PlayerState.RECOVERING])
+def test_pause_resyncs_drifted_state_and_replies(monkeypatch, drifted):
+    registry = main.PlayerRegistry()
+    monkeypatch.setattr(main, "players", registry)
+    registry.get(7).state = drifted
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    vc = SimpleNamespace(is_playing=lambda: True, pause=lambda: sent.append("paused"))
+    ctx = SimpleNamespace(guild=SimpleNamespace(id=7), voice_client=vc, send=send)
+
+    asyncio.run(main.pause.callback(ctx))
+
+    assert registry.peek(7).state is main.PlayerState.PAUSED
+    assert sent == ["paused", "⏸️ Lejátszás szüneteltetve."]
@@ -0,0 +1,67 @@
+import main
+
+
+def make_playlist(items):
+    playlist = main.GuildPlaylist()
+    playlist.extend(items)
+    return playlist
+
+
+def test_popleft_indexing_and_slicing():
+    playlist = make_playlist(range(10))
+
+    assert playlist.popleft() == 0
+    assert playlist.popleft() == 1
+    assert len(playlist) == 8
+    assert playlist[0] == 2
+    assert playlist[-1] == 9
+    assert playlist[2:5] == [4, 5, 6]
+    assert playlist.peek(3) == [2, 3, 4]
+    assert list(playlist) == list(range(2, 10))
+
+
+def test_popleft_compacts_dead_prefix():
+    playlist = make_playlist(range(200))
+    for expected in range(150):
+        assert playlist.popleft() == expected
+
+    assert len(playlist._items) < 200
+    assert list(playlist) == list(range(150, 200))
+
+
+def test_remove_move_and_bounds():
+    playlist = make_playlist(["a", "b", "c", "d"])
+    playlist.popleft()
+
+    assert playlist.remove_at(1) == "c"
+    playlist.move(1, 0)
+    assert list(playlist) == ["d", "b"]
+    try:
+        playlist.remove_at(5)
+    except IndexError:
+        pass
+    else:
+        raise AssertionError("expected IndexError")
+
+
+def test_shuffle_keeps_entries_and_dedupe():
+    playlist = make_playlist(["x", "y", "x", "z", "y"])
+    playlist.popleft()
+    playlist.shuffle()
+
+    assert sorted(playlist) == ["x", "y", "y", "z"]
+    assert playlist.dedupe(lambda item: item) == 1
+    assert sorted(playlist) == ["x", "y", "z"]
+
+
+def test_remove_and_move_reject_negative_positions():
+    playlist = make_playlist(["a", "b", "c"])
+
+    for call in (lambda: playlist.remove_at(-1), lambda: playlist.move(-1, 0), lambda: playlist.move(0, -1)):
+        try:
+            call()
+        except IndexError:
+            pass
+        else:
+            raise AssertionError("expected IndexError")
+    assert list(playlist) == ["a", "b", "c"]
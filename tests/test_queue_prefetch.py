@@ -0,0 +1,211 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def isolated_players(monkeypatch):
+    """Give every test its own registry so queues and preloads do not leak into other tests."""
+    monkeypatch.setattr(main, "players", main.PlayerRegistry())
+
+
+def test_prefetch_resolves_only_next_entries(monkeypatch):
+    resolved_terms = []
+
+    async def fake_resolve(term, target_kbps=0):
+        resolved_terms.append(term)
+        return main.ResolvedTrack(video_id=term, title=term.title(), stream_url="u", expires_at=time.time() + 7200)
+
+    monkeypatch.setattr(main, "resolve_track", fake_resolve)
+    monkeypatch.setattr(main, "QUEUE_PREFETCH_AHEAD", 2)
+    monkeypatch.setattr(main, "session_store", None)
+
+    async def scenario():
+        queue = main.get_guild_queue(501)
+        entries = [main.Track(t, t) for t in ("one", "two", "three")]
+        for entry in entries:
+            queue.append(entry)
+        await main.prefetch_upcoming(501)
+        return entries
+
+    entries = asyncio.run(scenario())
+
+    assert resolved_terms == ["one", "two"]
+    assert entries[0].title == "One"
+    assert entries[2].resolved is None
+    assert entries[2].needs_resolve()
+
+
+class FakeSource:
+    def __init__(self, frames):
+        self.frames = list(frames)
+        self.cleaned = False
+
+    def read(self):
+        return self.frames.pop(0) if self.frames else b""
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        self.cleaned = True
+
+
+def test_preloaded_source_replays_primed_frames_first():
+    original = FakeSource([b"a", b"b", b"c"])
+    source = main.PreloadedSource(original)
+
+    assert source.prime(frames=2) is True
+    assert [source.read(), source.read(), source.read(), source.read()] == [b"a", b"b", b"c", b""]
+
+
+def test_preloaded_source_is_cleaned_up_when_head_changes(monkeypatch):
+    original = FakeSource([b"a"])
+    stale_entry = main.Track("old", "old")
+    main.players.get(601).preloaded = (stale_entry, main.PreloadedSource(original))
+
+    other = main.Track("new", "new")
+
+    assert main.take_preloaded_source(601, other) is None
+    assert original.cleaned is True
+    assert main.players.peek(601).preloaded is None
+
+
+def test_tracked_source_counts_sent_frames_from_seek_offset():
+    source = main.TrackedSource(FakeSource([b"a"] * 150), start_at=30.0)
+    for _ in range(200):
+        source.read()
+
+    assert source.frames == 150
+    assert source.position == 33.0
+
+
+def test_audio_source_seeks_with_ss(monkeypatch):
+    captured = {}
+
+    def fake_opus_audio(url, **kwargs):
+        captured.update(kwargs)
+        return FakeSource([])
+
+    monkeypatch.setattr(main.discord, "FFmpegOpusAudio", fake_opus_audio)
+    monkeypatch.setattr(main, "AUDIO_PIPELINE", "opus")
+    main.create_audio_source("https://example.com/a.webm", "opus", start_at=75.5)
+
+    assert captured["before_options"].startswith("-ss 75.50 ")
+    assert captured["codec"] == "copy"
+
+
+def test_opus_codec_names():
+    assert main.is_opus_codec("opus")
+    assert main.is_opus_codec("OPUS")
+    assert not main.is_opus_codec("mp4a.40.2")
+    assert not main.is_opus_codec("")
+
+
+def test_track_keeps_only_ids_from_target():
+    ctx = SimpleNamespace(channel=SimpleNamespace(id=42), author=SimpleNamespace(id=7), message=object())
+    interaction = SimpleNamespace(channel_id=43, user=SimpleNamespace(id=8))
+
+    from_ctx = main.Track.from_target("term", "Title", ctx)
+    from_interaction = main.Track.from_target("term", "Title", interaction)
+
+    assert (from_ctx.channel_id, from_ctx.requester_id) == (42, 7)
+    assert (from_interaction.channel_id, from_interaction.requester_id) == (43, 8)
+    assert not hasattr(from_ctx, "__dict__")
+
+
+def test_track_apply_records_resolution():
+    track = main.Track("never gonna", "never gonna")
+    resolved = main.ResolvedTrack(
+        video_id="dQw4w9WgXcQ", title="Never Gonna Give You Up", stream_url="u",
+        expires_at=time.time() + 7200, duration=213,
+    )
+
+    track.apply(resolved)
+
+    assert track.title == "Never Gonna Give You Up"
+    assert track.duration == 213
+    assert track.source_id == "dQw4w9WgXcQ"
+    assert main.entry_identity(track) == "dQw4w9WgXcQ"
+
+
+def test_track_end_events_are_handled_in_order_without_blocking(monkeypatch):
+    handled = []
+
+    async def fake_handle(guild, error):
+        await asyncio.sleep(0.01)
+        handled.append(error)
+        if error == "boom":
+            raise RuntimeError(error)
+
+    monkeypatch.setattr(main, "handle_track_end", fake_handle)
+    guild = SimpleNamespace(id=701)
+
+    async def scenario():
+        for error in ("first", "boom", "third"):
+            main.dispatch_track_end(guild, error)
+        assert handled == []
+        await main.players.peek(701).track_end_worker
+
+    asyncio.run(scenario())
+
+    assert handled == ["first", "boom", "third"]
+    player = main.players.peek(701)
+    assert player.track_end_worker is None
+    assert player.track_end_events is None
+
+
+def test_disconnect_stop_keeps_interrupted_track_for_resume(monkeypatch):
+    next_calls = []
+
+    async def fake_play_next(guild):
+        next_calls.append(guild.id)
+
+    monkeypatch.setattr(main, "play_next", fake_play_next)
+    monkeypatch.setattr(main, "playback_position", lambda guild_id: 42.0)
+    current = ("https://example.com/a.webm", "Song", None, "opus", main.Track("song", "Song"))
+    dropped = SimpleNamespace(id=801, voice_client=None)
+    player = main.players.get(801)
+    player.current = current
+    player.state = main.PlayerState.PLAYING
+
+    asyncio.run(main.handle_track_end(dropped, None))
+
+    assert player.interrupted == (current, 42.0)
+    assert player.current is current and next_calls == []
+
+    connected = SimpleNamespace(id=801, voice_client=SimpleNamespace(is_connected=lambda: True))
+    asyncio.run(main.handle_track_end(connected, None))
+
+    assert player.current is None and player.interrupted is None
+    assert next_calls == [801]
+
+
+def test_failed_reconnect_resets_interrupted_player(monkeypatch):
+    async def no_sleep(delay):
+        return None
+
+    async def no_voice(guild):
+        return None
+
+    monkeypatch.setattr(type(main.bot), "user", property(lambda self: SimpleNamespace(id=1)))
+    monkeypatch.setattr(main.asyncio, "sleep", no_sleep)
+    monkeypatch.setattr(main, "ensure_voice_connection", no_voice)
+    monkeypatch.setattr(main, "session_store", None)
+    current = ("https://example.com/a.webm", "Song", None, "opus", main.Track("song", "Song"))
+    player = main.players.get(802)
+    player.current = current
+    player.state = main.PlayerState.PLAYING
+    player.interrupted = (current, 42.0)
+    member = SimpleNamespace(id=1, guild=SimpleNamespace(id=802))
+
+    asyncio.run(main.on_voice_state_update(
+        member, SimpleNamespace(channel=SimpleNamespace(id=9)), SimpleNamespace(channel=None)
+    ))
+
+    assert player.state is main.PlayerState.IDLE
+    assert player.current is None and player.interrupted is None
@@ -0,0 +1,96 @@
+import main
+
+
+def make_playlist(store, guild_id=7):
+    return main.GuildPlaylist(store.journal(guild_id))
+
+
+def titles(tracks):
+    return [t.title for t in tracks]
+
+
+def test_queue_mutations_are_journaled_incrementally(tmp_path):
+    store = main.SessionStore(str(tmp_path / "sessions.db"))
+    playlist = make_playlist(store)
+    playlist.extend(main.Track(t, t, channel_id=5) for t in ("a", "b", "c", "d"))
+    playlist.popleft()
+    playlist.insert(1, main.Track("x", "x"))
+    playlist.move(3, 0)
+    store.save_session(7, 99, main.Track("a", "a"), 0.0)
+    store.flush()
+
+    keys, restored = store.load_queue(7)
+
+    assert titles(restored) == titles(playlist) == ["d", "b", "x", "c"]
+    assert keys == sorted(keys)
+    assert restored[0].channel_id == 5
+
+
+def test_restored_queue_keeps_journaling(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    store = main.SessionStore(db_path)
+    playlist = make_playlist(store)
+    playlist.extend(main.Track(t, t) for t in ("a", "b", "c"))
+    current = main.Track("now", "Now")
+    current.source_id = "abcdefghijk"
+    store.save_session(7, 99, current, 42.5)
+    store.flush()
+
+    reopened = main.SessionStore(db_path)
+    [(guild_id, channel_id, track, position)] = reopened.load_sessions()
+    keys, entries = reopened.load_queue(guild_id)
+    playlist = make_playlist(reopened, guild_id)
+    playlist.journal.seed(keys)
+    playlist.restore(entries)
+    playlist.insert(0, track)
+    playlist.popleft()
+    playlist.append(main.Track("d", "d"))
+    playlist.shuffle()
+    reopened.flush()
+
+    assert (channel_id, track.title, track.source_id, position) == (99, "Now", "abcdefghijk", 42.5)
+    assert sorted(titles(reopened.load_queue(7)[1])) == ["a", "b", "c", "d"]
+    assert titles(reopened.load_queue(7)[1]) == titles(playlist)
+
+
+def test_forget_drops_session_and_queue(tmp_path):
+    store = main.SessionStore(str(tmp_path / "sessions.db"))
+    playlist = make_playlist(store)
+    playlist.append(main.Track("a", "a"))
+    store.save_session(7, 99, None)
+    store.forget(7)
+    store.flush()
+
+    assert store.load_sessions() == []
+    assert store.load_queue(7) == ([], [])
+
+
+def test_repeated_inserts_at_same_index_rebalance_keys(tmp_path):
+    store = main.SessionStore(str(tmp_path / "sessions.db"))
+    playlist = make_playlist(store)
+    playlist.extend(main.Track(t, t) for t in ("a", "b", "c"))
+    for i in range(200):
+        playlist.insert(1, main.Track(f"x{i}", f"x{i}"))
+    store.flush()
+
+    keys, restored = store.load_queue(7)
+
+    assert len(restored) == len(playlist) == 203
+    assert titles(restored) == titles(playlist)
+    assert len(set(keys)) == len(keys)
+
+
+def test_stores_are_opened_on_startup_not_import(monkeypatch, tmp_path):
+    assert main.session_store is None
+    monkeypatch.setattr(main, "TRACK_CACHE_DB", str(tmp_path / "tracks.db"))
+    monkeypatch.setattr(main, "SPOTIFY_CACHE_DB", str(tmp_path / "spotify.db"))
+    monkeypatch.setattr(main, "SESSION_STORE_DB", str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(main, "track_cache", main.TrackCache(capacity=4))
+    monkeypatch.setattr(main, "spotify_cache", main.SpotifyCache())
+    monkeypatch.setattr(main, "session_store", None)
+    monkeypatch.setattr(main, "audio_cache", None)
+
+    main.open_stores()
+
+    assert isinstance(main.session_store, main.SessionStore)
+    assert sorted(p.name for p in tmp_path.glob("*.db")) == ["sessions.db", "spotify.db", "tracks.db"]
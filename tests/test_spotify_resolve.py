@@ -0,0 +1,171 @@
+import asyncio
+
+import main
+
+
+def test_resolve_terms_in_order_keeps_playlist_order(monkeypatch):
+    delays = {"a": 0.03, "b": 0.0, "c": 0.02, "d": 0.0}
+    running = 0
+    peak = 0
+
+    async def fake_resolve(term, target_kbps=0):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(delays[term])
+        running -= 1
+        if term == "c":
+            return None
+        return main.ResolvedTrack(video_id=term, title=term.upper(), stream_url="u", expires_at=0.0)
+
+    monkeypatch.setattr(main, "resolve_track", fake_resolve)
+
+    async def collect():
+        return [(term, track.title if track else None) async for term, track in main.resolve_terms_in_order("abcd", 2)]
+
+    assert asyncio.run(collect()) == [("a", "A"), ("b", "B"), ("c", None), ("d", "D")]
+    assert peak <= 2
+
+
+def spotify_terms(url):
+    async def collect():
+        return [term async for page in main.iter_spotify_tracks(url) for term in page]
+
+    return collect()
+
+
+class FakeSpotify:
+    def __init__(self):
+        self.snapshot = "s1"
+        self.calls = []
+
+    def playlist(self, playlist_id, fields=None):
+        self.calls.append("playlist")
+        return {"snapshot_id": self.snapshot}
+
+    def playlist_items(self, playlist_id, **kwargs):
+        self.calls.append("playlist_items")
+        return {"items": [{"track": {"id": "t1", "name": "One", "artists": [{"name": "A"}]}}, {"track": None}]}
+
+    def album_tracks(self, album_id, limit=50, offset=0):
+        self.calls.append("album_tracks")
+        return {"items": [{"id": "t2", "name": "Two", "artists": [{"name": "B"}, {"name": "C"}]}]}
+
+
+def test_spotify_playlist_refetched_only_when_snapshot_changes(monkeypatch, tmp_path):
+    client = FakeSpotify()
+    monkeypatch.setattr(main, "SPOTIFY_CLIENT", client)
+    monkeypatch.setattr(main, "spotify_cache", main.SpotifyCache(db_path=str(tmp_path / "spotify.db")))
+    url = "https://open.spotify.com/playlist/abc123"
+
+    assert asyncio.run(spotify_terms(url)) == ["One A"]
+    assert asyncio.run(spotify_terms(url)) == ["One A"]
+    assert client.calls == ["playlist", "playlist_items", "playlist"]
+
+    client.snapshot = "s2"
+    asyncio.run(spotify_terms(url))
+    assert client.calls[-2:] == ["playlist", "playlist_items"]
+
+
+def test_spotify_cache_persists_albums_and_their_tracks(monkeypatch, tmp_path):
+    client = FakeSpotify()
+    db_path = str(tmp_path / "spotify.db")
+    monkeypatch.setattr(main, "SPOTIFY_CLIENT", client)
+    monkeypatch.setattr(main, "spotify_cache", main.SpotifyCache(db_path=db_path))
+    assert asyncio.run(spotify_terms("https://open.spotify.com/album/alb1")) == ["Two B, C"]
+
+    # A restarted bot answers the album and its tracks without calling Spotify.
+    monkeypatch.setattr(main, "spotify_cache", main.SpotifyCache(db_path=db_path))
+    assert asyncio.run(spotify_terms("https://open.spotify.com/album/alb1")) == ["Two B, C"]
+    assert asyncio.run(spotify_terms("https://open.spotify.com/track/t2")) == ["Two B, C"]
+    assert client.calls == ["album_tracks"]
+
+    expired = main.SpotifyCache(ttl_sec=60, db_path=db_path)
+    entry = asyncio.run(expired.get("album", "alb1"))
+    assert entry is not None and not expired.is_fresh("album", entry, now=entry.fetched_at + 61)
+
+
+class PagedPlaylist(FakeSpotify):
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+        self.requests = []
+
+    def playlist_items(self, playlist_id, fields=None, additional_types=None, limit=100, offset=0):
+        self.requests.append((offset, limit))
+        end = min(offset + limit, self.size)
+        items = [{"track": {"id": f"t{i}", "name": f"Song {i}", "artists": [{"name": "X"}]}} for i in range(offset, end)]
+        return {"items": items, "next": "more" if end < self.size else None}
+
+
+def test_spotify_playlist_paginates_up_to_cap(monkeypatch):
+    client = PagedPlaylist(5000)
+    monkeypatch.setattr(main, "SPOTIFY_CLIENT", client)
+    monkeypatch.setattr(main, "spotify_cache", main.SpotifyCache())
+
+    async def pages():
+        return [len(page) async for page in main.iter_spotify_tracks("https://open.spotify.com/playlist/big", 250)]
+
+    assert asyncio.run(pages()) == [100, 100, 50]
+    assert client.requests == [(0, 100), (100, 100), (200, 50)]
+    # Capped imports are incomplete and must not be replayed from the cache.
+    assert asyncio.run(main.spotify_cache.get("playlist", "big")) is None
+
+
+def test_enqueue_starts_playback_before_later_pages(monkeypatch):
+    events = []
+
+    class FakeVoice:
+        playing = False
+
+        def is_playing(self):
+            return self.playing
+
+        def is_paused(self):
+            return False
+
+    class FakeGuild:
+        id = 77
+        voice_client = FakeVoice()
+
+    guild = FakeGuild()
+    monkeypatch.setattr(main, "players", main.PlayerRegistry())
+    monkeypatch.setattr(main, "session_store", None)
+
+    async def fake_play_next(g):
+        events.append(("play", len(main.get_guild_queue(g.id))))
+        g.voice_client.playing = True
+
+    async def fake_edit_status(target, status, text):
+        events.append(("status", text.splitlines()[0]))
+
+    monkeypatch.setattr(main, "play_next", fake_play_next)
+    monkeypatch.setattr(main, "schedule_prefetch", lambda guild_id: None)
+    monkeypatch.setattr(main, "edit_status", fake_edit_status)
+
+    async def pages():
+        events.append(("page", 1))
+        yield ["a", "b"]
+        events.append(("page", 2))
+        yield ["c"]
+
+    added = asyncio.run(main.enqueue_spotify_tracks(guild, None, pages(), None))
+
+    assert added == 3
+    assert events[:3] == [("page", 1), ("play", 2), ("status", "✅ 2 szám hozzáadva, a többi betöltése folyamatban...")]
+    assert events[3] == ("page", 2)
+    assert events[-1] == ("status", "✅ 3 szám hozzáadva a várólistához.")
+
+
+def test_spotify_track_entries_do_not_evict_collections():
+    cache = main.SpotifyCache(capacity=2, track_capacity=10)
+
+    async def scenario():
+        await cache.put("playlist", "p1", ["a"], "s1")
+        await cache.put("album", "a1", ["b"])
+        await cache.put_tracks({f"t{i}": f"song {i}" for i in range(100)})
+        return await cache.get("playlist", "p1"), await cache.get("album", "a1"), await cache.get("track", "t99")
+
+    playlist, album, track = asyncio.run(scenario())
+
+    assert playlist.terms == ["a"] and album.terms == ["b"] and track.terms == ["song 99"]
@@ -0,0 +1,54 @@
+import asyncio
+import json
+
+import main
+
+
+def test_spans_nest_and_flush_to_jsonl(tmp_path, monkeypatch):
+    exporter = main.SpanExporter(path=str(tmp_path / "traces.jsonl"))
+    monkeypatch.setattr(main, "span_exporter", exporter)
+
+    @main.traced("child")
+    async def child():
+        main.annotate_span(cache="miss")
+        await asyncio.sleep(0)
+
+    async def scenario():
+        with main.trace_span("command.play", guild_id=1):
+            await child()
+            await asyncio.create_task(child())
+        await exporter.flush()
+
+    asyncio.run(scenario())
+    records = [json.loads(line) for line in (tmp_path / "traces.jsonl").read_text().splitlines()]
+
+    root = next(r for r in records if r["name"] == "command.play")
+    children = [r for r in records if r["name"] == "child"]
+    assert len(children) == 2
+    assert all(c["trace_id"] == root["trace_id"] and c["parent_id"] == root["span_id"] for c in children)
+    assert children[0]["attributes"] == {"cache": "miss"}
+    assert root["parent_id"] == ""
+
+
+def test_failed_span_is_marked_in_otlp_payload(monkeypatch):
+    exporter = main.SpanExporter()
+    monkeypatch.setattr(main, "span_exporter", exporter)
+    try:
+        with main.trace_span("voice.connect", attempt=2):
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+
+    [span] = exporter.otlp_payload(exporter._drain())["resourceSpans"][0]["scopeSpans"][0]["spans"]
+
+    assert span["name"] == "voice.connect"
+    assert span["status"] == {"code": 2, "message": "RuntimeError: boom"}
+    assert span["attributes"] == [{"key": "attempt", "value": {"intValue": "2"}}]
+    assert len(span["traceId"]) == 32 and len(span["spanId"]) == 16
+
+
+def test_tracing_disabled_is_a_noop(monkeypatch):
+    monkeypatch.setattr(main, "span_exporter", None)
+    with main.trace_span("anything") as span:
+        span.set(x=1)
+    assert span is main.NOOP_SPAN
@@ -0,0 +1,288 @@
+import asyncio
+import time
+
+import main
+
+
+def make_track(video_id="abcdefghijk", expires_in=7200.0, title="Song"):
+    return main.ResolvedTrack(
+        video_id=video_id,
+        title=title,
+        stream_url=f"https://rr1.googlevideo.com/videoplayback?expire={int(time.time() + expires_in)}",
+        expires_at=time.time() + expires_in,
+        format_id="251",
+        acodec="opus",
+        ext="webm",
+        abr=130.0,
+        webpage_url=f"https://www.youtube.com/watch?v={video_id}",
+    )
+
+
+def test_parse_stream_expiry_reads_query_parameter():
+    url = "https://rr1.googlevideo.com/videoplayback?expire=1700000000&ei=xyz"
+    assert main.parse_stream_expiry(url) == 1700000000.0
+
+
+def test_parse_stream_expiry_falls_back_to_default_ttl():
+    now = 1000.0
+    assert main.parse_stream_expiry("https://example.com/a.mp3", now=now) == now + main.TRACK_CACHE_DEFAULT_TTL_SEC
+
+
+def test_extract_youtube_video_id_shapes():
+    assert main.extract_youtube_video_id("https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=1") == "dQw4w9WgXcQ"
+    assert main.extract_youtube_video_id("https://youtu.be/dQw4w9WgXcQ") == "dQw4w9WgXcQ"
+    assert main.extract_youtube_video_id("https://example.com/watch") is None
+
+
+def test_cache_hit_by_term_and_video_id():
+    cache = main.TrackCache(capacity=4)
+    track = make_track()
+    asyncio.run(cache.put(main.normalize_search_term("  Never  Gonna "), track))
+
+    assert asyncio.run(cache.get(term="never gonna")) is track
+    assert asyncio.run(cache.get(video_id=track.video_id)) is track
+
+
+def test_cache_lru_eviction():
+    cache = main.TrackCache(capacity=2)
+    first, second, third = (make_track(video_id=f"video{i:06d}") for i in range(3))
+    asyncio.run(cache.put("first", first))
+    asyncio.run(cache.put("second", second))
+    # Touch the first entry so the second becomes least recently used.
+    assert asyncio.run(cache.get(term="first")) is first
+    asyncio.run(cache.put("third", third))
+
+    assert asyncio.run(cache.get(term="second")) is None
+    assert asyncio.run(cache.get(term="first")) is first
+    assert len(cache) == 2
+
+
+def test_cache_skips_expired_urls():
+    cache = main.TrackCache(capacity=4)
+    track = make_track(expires_in=main.TRACK_CACHE_EXPIRY_MARGIN_SEC / 2)
+    asyncio.run(cache.put("soon expired", track))
+
+    assert asyncio.run(cache.get(term="soon expired")) is None
+
+
+def test_cache_survives_restart_via_sqlite(tmp_path):
+    db_path = str(tmp_path / "tracks.db")
+    track = make_track()
+    asyncio.run(main.TrackCache(capacity=4, db_path=db_path).put("persisted song", track))
+
+    restored = asyncio.run(main.TrackCache(capacity=4, db_path=db_path).get(term="persisted song"))
+
+    assert restored is not None
+    assert restored.video_id == track.video_id
+    assert restored.stream_url == track.stream_url
+    assert restored.acodec == "opus"
+
+
+def test_select_audio_format_prefers_opus_near_channel_bitrate():
+    formats = [
+        {"format_id": "140", "acodec": "mp4a.40.2", "vcodec": "none", "abr": 129.0, "url": "m4a", "protocol": "https"},
+        {"format_id": "249", "acodec": "opus", "vcodec": "none", "abr": 50.0, "url": "o50", "protocol": "https"},
+        {"format_id": "250", "acodec": "opus", "vcodec": "none", "abr": 70.0, "url": "o70", "protocol": "https"},
+        {"format_id": "251", "acodec": "opus", "vcodec": "none", "abr": 160.0, "url": "o160", "protocol": "https"},
+        {"format_id": "18", "acodec": "mp4a.40.2", "vcodec": "avc1", "abr": 96.0, "url": "video", "protocol": "https"},
+    ]
+
+    assert main.select_audio_format(formats, target_kbps=64)["format_id"] == "250"
+    assert main.select_audio_format(formats, target_kbps=128)["format_id"] == "251"
+    assert main.select_audio_format(formats)["format_id"] == "251"
+    assert main.select_audio_format(formats[:1], target_kbps=64)["format_id"] == "140"
+
+
+def test_stream_error_log_detects_rejected_urls():
+    log = main.StreamErrorLog()
+    log.write(b"[https @ 0x55] HTTP error 403 Forbidden\n")
+    assert log.rejected() is True
+
+    other = main.StreamErrorLog()
+    other.write(b"x" * 10000 + b"Connection timed out\n")
+    assert other.rejected() is False
+    assert len(other.text()) == main.StreamErrorLog.MAX_BYTES
+
+
+def test_refresh_stream_bypasses_cached_url(monkeypatch):
+    cache = main.TrackCache(capacity=4)
+    stale = make_track(video_id="dQw4w9WgXcQ")
+    fresh = make_track(video_id="dQw4w9WgXcQ", title="Fresh")
+    asyncio.run(cache.put("song", stale))
+    monkeypatch.setattr(main, "track_cache", cache)
+    extracted = []
+
+    async def fake_extract(term, cache_term, target_kbps=0):
+        extracted.append(term)
+        await cache.put(cache_term, fresh)
+        return fresh
+
+    monkeypatch.setattr(main, "_extract_and_cache", fake_extract)
+    entry = main.Track("song", "song", resolved=stale)
+
+    assert asyncio.run(main.refresh_stream(entry)) is fresh
+    assert extracted == ["https://www.youtube.com/watch?v=dQw4w9WgXcQ"]
+    assert entry.resolved is fresh
+    assert asyncio.run(cache.get(term="song")) is fresh
+
+
+def test_refresh_stream_uses_original_page_for_other_extractors(monkeypatch):
+    monkeypatch.setattr(main, "track_cache", main.TrackCache(capacity=4))
+    extracted = []
+
+    async def fake_extract(term, cache_term, target_kbps=0):
+        extracted.append(term)
+        return None
+
+    monkeypatch.setattr(main, "_extract_and_cache", fake_extract)
+    stale = main.ResolvedTrack(
+        video_id="123456789",
+        title="Song",
+        stream_url="https://cf-media.sndcdn.com/a.mp3",
+        expires_at=0.0,
+        webpage_url="https://soundcloud.com/artist/song",
+    )
+    entry = main.Track("artist song", "Song", resolved=stale)
+    restored = main.Track.from_record(entry.to_record())
+
+    asyncio.run(main.refresh_stream(restored))
+
+    assert extracted == ["https://soundcloud.com/artist/song"]
+
+
+def test_ttl_cache_evicts_lru_and_counts_stats():
+    cache = main.TTLCache("test", capacity=2, ttl_sec=10)
+    cache.put("a", 1, now=0.0)
+    cache.put("b", 2, now=0.0)
+    assert cache.get("a", now=1.0) == 1
+    cache.put("c", 3, now=1.0)
+
+    assert cache.get("b", now=1.0) is None
+    assert cache.get("c", now=20.0) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["expirations"]) == (1, 2, 1, 1)
+    assert stats["hit_ratio"] == round(1 / 3, 3)
+
+
+def test_ttl_cache_drops_expired_entries_on_insert():
+    cache = main.TTLCache("test", capacity=10, ttl_sec=10)
+    cache.put("old", 1, now=0.0)
+    cache.put("fresh", 2, now=5.0)
+    cache.put("new", 3, now=12.0)
+
+    assert list(cache) == ["fresh", "new"]
+    assert cache.put("forever", 4, ttl=0, now=12.0) is None
+    assert cache.purge_expired(now=1000.0) == 2
+    assert list(cache) == ["forever"]
+
+
+def test_known_term_skips_search_after_url_expiry(monkeypatch, tmp_path):
+    db_path = str(tmp_path / "tracks.db")
+    asyncio.run(main.TrackCache(capacity=4, db_path=db_path).put("one a", make_track(expires_in=-1.0)))
+    monkeypatch.setattr(main, "track_cache", main.TrackCache(capacity=4, db_path=db_path))
+    extracted = []
+
+    async def fake_extract(term, cache_term, target_kbps=0):
+        extracted.append(term)
+        return None
+
+    monkeypatch.setattr(main, "_extract_and_cache", fake_extract)
+    asyncio.run(main.resolve_track("One  A"))
+
+    assert extracted == ["https://www.youtube.com/watch?v=abcdefghijk"]
+
+
+def test_pool_pending_drops_when_queued_jobs_time_out(monkeypatch):
+    pool = main.YoutubeDLPool("test", {}, max_workers=1)
+
+    class SlowYDL:
+        def extract_info(self, url, download=False):
+            time.sleep(0.2)
+            return {}
+
+    monkeypatch.setattr(pool, "_get_ydl", lambda: SlowYDL())
+
+    async def scenario():
+        results = await asyncio.gather(
+            *(pool.extract_info(f"q{i}", timeout=0.1) for i in range(3)), return_exceptions=True
+        )
+        assert all(isinstance(result, asyncio.TimeoutError) for result in results)
+        await asyncio.sleep(0.3)
+
+    asyncio.run(scenario())
+    stats = pool.stats()
+    pool._executor.shutdown(wait=True)
+
+    assert stats["pending"] == 0 and stats["active"] == 0
+    assert stats["completed"] == 1
+
+
+def test_expired_non_youtube_url_is_not_rewritten(monkeypatch, tmp_path):
+    db_path = str(tmp_path / "tracks.db")
+    url = "https://soundcloud.com/artist/song"
+    expired = make_track(video_id="123456789", expires_in=-1.0)
+    asyncio.run(main.TrackCache(capacity=4, db_path=db_path).put(main.normalize_search_term(url), expired))
+    monkeypatch.setattr(main, "track_cache", main.TrackCache(capacity=4, db_path=db_path))
+    extracted = []
+
+    async def fake_extract(term, cache_term, target_kbps=0):
+        extracted.append(term)
+        return None
+
+    monkeypatch.setattr(main, "_extract_and_cache", fake_extract)
+    asyncio.run(main.resolve_track(url))
+
+    assert extracted == [url]
+
+
+def test_process_workers_do_not_rerun_bot_setup(tmp_path):
+    import os
+    import subprocess
+    import sys
+
+    repo = os.path.dirname(os.path.abspath(main.__file__))
+    # Same shape as run.py: the bot is only imported when the script is __main__.
+    entry = tmp_path / "entry.py"
+    entry.write_text(
+        "import sys\n"
+        f"sys.path.insert(0, {repo!r})\n"
+        "if __name__ == '__main__':\n"
+        "    import main\n"
+        "    pool = main.ProcessExtractPool({'quiet': True}, 1, 30.0, 0, fallback=None)\n"
+        "    probe = \"[m for m in ('main', 'discord', 'aiohttp') if m in __import__('sys').modules]\"\n"
+        "    print(pool._ensure_executor().submit(eval, probe).result(timeout=60))\n"
+        "    pool._executor.shutdown()\n"
+    )
+    child = subprocess.run([sys.executable, str(entry)], capture_output=True, text=True, timeout=120)
+    assert child.returncode == 0, child.stderr
+    assert child.stdout.strip().splitlines()[-1] == "[]"
+
+    # What spawn does with the real entry script in each worker.
+    code = (
+        "import runpy, sys; runpy.run_path('run.py', run_name='__mp_main__'); "
+        "sys.exit('main' in sys.modules or 'discord' in sys.modules)"
+    )
+    assert subprocess.run([sys.executable, "-c", code], cwd=repo).returncode == 0
+
+
+def test_worker_record_resolves_in_parent():
+    import ytdl_worker
+
+    info = {"entries": [{
+        "id": "abcdefghijk",
+        "title": "Song",
+        "duration": 200,
+        "webpage_url": "https://www.youtube.com/watch?v=abcdefghijk",
+        "thumbnails": [{"url": "t"}] * 50,
+        "formats": [
+            {"format_id": "251", "acodec": "opus", "vcodec": "none", "abr": 130.0, "url": "o", "protocol": "https",
+             "http_headers": {"User-Agent": "x"}},
+        ],
+    }]}
+
+    record = ytdl_worker.compact_entry(info)
+    track = main.build_resolved_track(record, target_kbps=128)
+
+    assert "thumbnails" not in record and "http_headers" not in record["formats"][0]
+    assert (track.video_id, track.format_id, track.duration) == ("abcdefghijk", "251", 200)
+    assert track.webpage_url == "https://www.youtube.com/watch?v=abcdefghijk"
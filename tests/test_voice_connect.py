@@ -74,7 +74,7 @@ def test_connect_voice_success_first_attempt(monkeypatch):
     assert vc is not None
     assert error_code == ""
     assert guild.voice_client is vc
-    assert main.last_voice_channel_id[guild.id] == channel.id
+    assert main.players.peek(guild.id).last_channel_id == channel.id
 
 
 def test_connect_voice_timeout_then_success(monkeypatch):
@@ -92,7 +92,7 @@ def test_connect_voice_timeout_then_success(monkeypatch):
 
     assert vc is not None
     assert error_code == ""
-    assert main.last_voice_channel_id[guild.id] == channel.id
+    assert main.players.peek(guild.id).last_channel_id == channel.id
 
 
 def test_connect_voice_all_timeouts_returns_timeout_code(monkeypatch):
@@ -0,0 +1,58 @@
+"""Worker-process entry points for the ``process`` yt-dlp backend.
+
+Worker processes are started with the ``spawn`` context. Besides this module
+they re-run the entry script, which is why the bot is started from run.py: it
+does nothing at import, so workers never run main.py's setup (bot, thread
+pools, caches). Keep this module free of side effects and of imports from main.
+"""
+import os
+from typing import Optional
+
+import yt_dlp
+
+# Fields of the resolved entry and of its formats that the bot needs to pick a stream.
+ENTRY_KEYS = (
+    "id", "title", "url", "duration", "webpage_url", "original_url",
+    "format_id", "acodec", "vcodec", "ext", "abr", "tbr", "protocol",
+)
+FORMAT_KEYS = ("format_id", "acodec", "vcodec", "ext", "abr", "tbr", "url", "protocol")
+
+_ydl: Optional[yt_dlp.YoutubeDL] = None
+
+
+def init_worker(options: dict) -> None:
+    """Process pool initializer: build the worker's long-lived YoutubeDL instance."""
+    global _ydl
+    _ydl = yt_dlp.YoutubeDL(options)
+
+
+def warm_worker() -> int:
+    """No-op task used to make the pool start its worker processes eagerly."""
+    return os.getpid()
+
+
+def compact_entry(info: Optional[dict]) -> Optional[dict]:
+    """Reduce an extraction result to its first entry with only the fields the bot uses."""
+    if not info:
+        return None
+    entries = info.get("entries", [info])
+    if not entries:
+        return None
+    entry = entries[0]
+    compact = {key: entry[key] for key in ENTRY_KEYS if key in entry}
+    compact["formats"] = [
+        {key: fmt[key] for key in FORMAT_KEYS if key in fmt} for fmt in entry.get("formats") or []
+    ]
+    return compact
+
+
+def extract_entry(search_term: str) -> Optional[dict]:
+    """Extract ``search_term`` and return a small, picklable record of the first entry."""
+    if _ydl is None:
+        raise RuntimeError("yt-dlp worker used without init_worker")
+    try:
+        info = _ydl.extract_info(search_term, download=False)
+    except Exception as exc:
+        # yt-dlp exceptions carry unpicklable state; send back only the message.
+        raise RuntimeError(f"{type(exc).__name__}: {exc}") from None
+    return compact_entry(info)